@@ -1,6 +1,7 @@
 from django.contrib import admin
-from django.db.models import Avg, Count
 from django.utils.html import format_html
+from core.models import UserProfile
+from core.renditions import thumbnail_url
 from .models import Blog, Post, Tag, Comment, Rating
 
 
@@ -25,7 +26,7 @@ class BlogAdmin(admin.ModelAdmin):
             return format_html(
                 '<a href="{}" target="_blank"><img src="{}" style="width: 60px; height: 60px; object-fit: cover;" /></a>',
                 obj.image.url,
-                obj.image.url
+                thumbnail_url(obj.image, obj.image_renditions)
             )
         return 'No Image Available'
 
@@ -35,7 +36,7 @@ class BlogAdmin(admin.ModelAdmin):
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ['id', 'thumbnail', 'title',
-                    'author', 'created_at', 'comment_count', 'rating_count', 'average_rating']
+                    'author', 'created_at', 'total_comments', 'total_ratings', 'average_rating']
     autocomplete_fields = ['author']
     list_per_page = 10
     list_filter = ['created_at', 'tags']
@@ -46,18 +47,14 @@ class PostAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.select_related('author').prefetch_related('tags').annotate(
-            avg_rating=Avg('ratings__score'),
-            rating_count=Count('ratings', distinct=True),
-            comment_count=Count('comments', distinct=True)
-        )
+        return qs.select_related('author').prefetch_related('tags')
 
     def thumbnail(self, obj):
         if obj.image:
             return format_html(
                 '<a href="{}" target="_blank"><img src="{}" style="width: 60px; height: 60px; object-fit: cover;" /></a>',
                 obj.image.url,
-                obj.image.url
+                thumbnail_url(obj.image, obj.image_renditions)
             )
         return 'No Image Available'
 
@@ -71,13 +68,13 @@ class PostAdmin(admin.ModelAdmin):
         return round(obj.avg_rating or 0, 1)
     average_rating.short_description = 'Avg Rating'
 
-    def rating_count(self, obj):
+    @admin.display(ordering='rating_count', description='Ratings')
+    def total_ratings(self, obj):
         return obj.rating_count
-    rating_count.short_description = 'Ratings'
 
-    def comment_count(self, obj):
+    @admin.display(ordering='comment_count', description='Comments')
+    def total_comments(self, obj):
         return obj.comment_count
-    comment_count.short_description = 'Comments'
 
 
 @admin.register(Tag)
@@ -126,7 +123,16 @@ class RatingFilter(admin.SimpleListFilter):
 
 @admin.action(description='Reset ratings')
 def reset_rating(model_admin, request, queryset):
+    blog_ids = set(queryset.exclude(blog=None).values_list('blog_id', flat=True))
+    post_ids = set(queryset.exclude(post=None).values_list('post_id', flat=True))
+    author_ids = (
+        set(Blog.objects.filter(pk__in=blog_ids).values_list('author_id', flat=True))
+        | set(Post.objects.filter(pk__in=post_ids).values_list('author_id', flat=True)))
     updated_count = queryset.update(score=0)
+    # QuerySet.update() bypasses the counter signals; profiles sum the targets.
+    Blog.objects.recalculate_counters(blog_ids)
+    Post.objects.recalculate_counters(post_ids)
+    UserProfile.objects.recalculate_counters(author_ids)
     model_admin.message_user(
         request, f'{updated_count} rating(s) were reset to 0.')
 
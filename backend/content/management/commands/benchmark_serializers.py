@@ -0,0 +1,85 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIRequestFactory
+
+from content.models import Post
+from content.serializers import PostSerializer
+from core.cards import bump_profile_version
+from core.serializers import PublicUserSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Time PostSerializer on a page of posts with and without cached '
+            'user cards. Seeded rows are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100)
+        parser.add_argument('--authors', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per measurement; the best time is reported.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['posts'], options['authors'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, posts, authors, repeat):
+        User = get_user_model()
+        User.objects.bulk_create(
+            User(username=f'serializer-bench-{i}',
+                 email=f'serializer-bench-{i}@example.com',
+                 first_name='Bench', last_name=str(i))
+            for i in range(authors))
+        users = list(User.objects.filter(username__startswith='serializer-bench-'))
+        Post.objects.bulk_create(
+            Post(author=users[i % authors], title=f'Post {i}', caption='Caption')
+            for i in range(posts))
+        page = list(Post.objects.filter(author__in=users)
+                    .select_related('author').prefetch_related('tags')[:posts])
+        request = APIRequestFactory().get('/content/posts/')
+
+        def serialize():
+            return PostSerializer(page, many=True, context={'request': request}).data
+
+        def measure(before=None):
+            best = None
+            for _ in range(repeat):
+                if before:
+                    before()
+                started = time.perf_counter()
+                serialize()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            return best * 1000
+
+        PublicUserSerializer.use_card_cache = False
+        try:
+            uncached_data = serialize()
+            uncached = measure()
+        finally:
+            PublicUserSerializer.use_card_cache = True
+        assert serialize() == uncached_data, 'Cached cards changed the payload'
+
+        def invalidate():
+            for user in users:
+                bump_profile_version(user.pk)
+
+        cold = measure(before=invalidate)
+        warm = measure()
+
+        self.stdout.write(f'{len(page)} posts by {authors} authors, best of {repeat}:')
+        self.stdout.write(f'  per-row user serializer: {uncached:7.2f} ms')
+        self.stdout.write(f'  cards, cold cache:       {cold:7.2f} ms')
+        self.stdout.write(f'  cards, warm cache:       {warm:7.2f} ms')
+        self.stdout.write(self.style.SUCCESS(
+            f'Warm cards serialize the page {uncached / warm:.1f}x faster.'))
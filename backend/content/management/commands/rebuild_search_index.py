@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from content.models import Blog, Post, SearchDocument
+from content.search import index_queryset
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for blogs and posts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of blogs/posts indexed per transaction.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        SearchDocument.objects.all().delete()
+
+        total = 0
+        for model in (Blog, Post):
+            indexed = index_queryset(
+                model.objects.all(), batch_size=options['batch_size'])
+            total += indexed
+            self.stdout.write(f'Indexed {indexed} {model.__name__.lower()}s.')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt search index for {total} documents in {elapsed:.1f}s.'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from content.models import Blog, Post
+from core.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = ('Recompute the stored rating and comment counters on blogs and posts, '
+            'then the content stats on user profiles.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows recalculated per UPDATE statement.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        for model in (Blog, Post):
+            pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            updated = 0
+            for start in range(0, len(pks), batch_size):
+                updated += model.objects.recalculate_counters(
+                    pks[start:start + batch_size])
+            self.stdout.write(self.style.SUCCESS(
+                f'Reconciled counters for {updated} {model._meta.verbose_name_plural}.'))
+
+        # Profile ratings are summed from the blog/post counters fixed above.
+        user_ids = list(UserProfile.objects.order_by('user_id')
+                        .values_list('user_id', flat=True))
+        updated = 0
+        for start in range(0, len(user_ids), batch_size):
+            updated += UserProfile.objects.recalculate_counters(
+                user_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled stats for {updated} user profiles.'))
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Comment = apps.get_model('content', 'Comment')
+    Rating = apps.get_model('content', 'Rating')
+
+    def aggregate(model, fk_name, expression):
+        rows = (
+            model.objects.filter(**{fk_name: OuterRef('pk')})
+            .order_by()
+            .values(fk_name)
+            .annotate(value=expression)
+            .values('value')
+        )
+        return Coalesce(Subquery(rows), 0)
+
+    for model_name, fk_name in (('Blog', 'blog'), ('Post', 'post')):
+        apps.get_model('content', model_name).objects.update(
+            rating_sum=aggregate(Rating, fk_name, Sum('score')),
+            rating_count=aggregate(Rating, fk_name, Count('id')),
+            comment_count=aggregate(Comment, fk_name, Count('id')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0018_alter_rating_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='blog',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -2,18 +2,51 @@ from django.db import models
 
 from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models.functions import Coalesce
 
 
 class ContentManager(models.Manager):
     def get_queryset(self):
-        return super().get_queryset().select_related('author').annotate(
-            avg_rating=models.Avg('ratings__score'),
-            rating_count=models.Count('ratings', distinct=True),
-            comment_count=models.Count('comments', distinct=True)
+        return super().get_queryset().select_related('author')
+
+    def _child_aggregate(self, related_name, aggregate):
+        """Correlated subquery aggregating a reverse FK relation per row"""
+        relation = self.model._meta.get_field(related_name)
+        fk_name = relation.field.name
+        children = (
+            relation.related_model.objects
+            .filter(**{fk_name: models.OuterRef('pk')})
+            .order_by()
+            .values(fk_name)
+            .annotate(value=aggregate)
+            .values('value')
         )
+        return Coalesce(models.Subquery(children), 0)
+
+    def recalculate_counters(self, pks=None):
+        """Recompute the stored rating/comment counters from the child tables"""
+        queryset = self.all()
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        return queryset.update(
+            rating_sum=self._child_aggregate('ratings', models.Sum('score')),
+            rating_count=self._child_aggregate('ratings', models.Count('id')),
+            comment_count=self._child_aggregate(
+                'comments', models.Count('id')),
+        )
+
+
+class RatedContentMixin:
+    """Exposes the average rating derived from the stored counters"""
+
+    @property
+    def avg_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
 
 
-class Blog(models.Model):
+class Blog(RatedContentMixin, models.Model):
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
@@ -22,9 +55,13 @@ class Blog(models.Model):
                               blank=True,
                               null=True,
                               default='blog_images/b_default.webp')
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     tags = models.ManyToManyField('Tag', blank=True)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
 
     objects = ContentManager()
 
@@ -34,9 +71,12 @@ class Blog(models.Model):
     class Meta:
         verbose_name_plural = 'Blog'
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['created', 'id']),
+        ]
 
 
-class Post(models.Model):
+class Post(RatedContentMixin, models.Model):
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='posts'
     )
@@ -47,10 +87,14 @@ class Post(models.Model):
         null=True,
         default='post_images/default.webp'
     )
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     caption = models.TextField(max_length=1000, blank=True)
     youtube_url = models.URLField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     tags = models.ManyToManyField('Tag', related_name='posts', blank=True)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
 
     objects = ContentManager()
 
@@ -60,6 +104,7 @@ class Post(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['created_at']),
+            models.Index(fields=['created_at', 'id']),
             models.Index(fields=['author', 'created_at']),
             models.Index(fields=['author']),
         ]
@@ -89,6 +134,11 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['created', 'id']),
+            models.Index(fields=['blog', 'created', 'id']),
+            models.Index(fields=['post', 'created', 'id']),
+        ]
 
 
 class Rating(models.Model):
@@ -123,3 +173,36 @@ class Rating(models.Model):
         else:
             target = "Unknown"
         return f"Rating {self.score} by {self.user.username} on {target}"
+
+
+class SearchDocument(models.Model):
+    blog = models.OneToOneField(
+        Blog, on_delete=models.CASCADE,
+        related_name='search_document',
+        null=True, blank=True
+    )
+    post = models.OneToOneField(
+        Post, on_delete=models.CASCADE,
+        related_name='search_document',
+        null=True, blank=True
+    )
+    length = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        target = f"Blog {self.blog_id}" if self.blog_id else f"Post {self.post_id}"
+        return f"Search document for {target}"
+
+
+class SearchPosting(models.Model):
+    document = models.ForeignKey(
+        SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    term = models.CharField(max_length=64)
+    frequency = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.term} x{self.frequency} in {self.document_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'document']),
+        ]
@@ -0,0 +1,264 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import (Avg, Case, Count, F, FloatField, Q, Sum,
+                              Value, When)
+from django.utils.html import escape
+
+from .models import Blog, Post, SearchDocument, SearchPosting
+
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERM_LENGTH = 64
+STOPWORDS = frozenset("""
+    a an and are as at be but by for from has have in is it its of on or
+    that the this to was were will with
+""".split())
+
+# Field weights: a title hit counts as much as two body hits.
+TITLE_WEIGHT = 2
+BODY_WEIGHT = 1
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SNIPPET_LENGTH = 200
+FACET_LIMIT = 10
+
+
+def normalize(word):
+    word = unicodedata.normalize('NFKD', word.lower())
+    word = ''.join(ch for ch in word if not unicodedata.combining(ch))
+    return word[:MAX_TERM_LENGTH]
+
+
+def tokenize(text):
+    tokens = []
+    for match in WORD_RE.finditer(text or ''):
+        token = normalize(match.group())
+        if len(token) > 1 and token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+def _document_terms(instance):
+    """Weighted term frequencies for a Blog or Post"""
+    body = instance.content if isinstance(instance, Blog) else instance.caption
+    author = instance.author
+    fields = [
+        (instance.title, TITLE_WEIGHT),
+        (body, BODY_WEIGHT),
+        (' '.join(tag.name for tag in instance.tags.all()), BODY_WEIGHT),
+        (f"{author.username} {author.first_name} {author.last_name}", BODY_WEIGHT),
+    ]
+    terms = Counter()
+    for text, weight in fields:
+        for token in tokenize(text):
+            terms[token] += weight
+    return terms
+
+
+def _target_kwargs(instance):
+    return {'blog': instance} if isinstance(instance, Blog) else {'post': instance}
+
+
+def index_instance(instance):
+    """(Re)build the postings of a single Blog or Post"""
+    terms = _document_terms(instance)
+    with transaction.atomic():
+        document, _ = SearchDocument.objects.update_or_create(
+            **_target_kwargs(instance),
+            defaults={'length': sum(terms.values())}
+        )
+        document.postings.all().delete()
+        SearchPosting.objects.bulk_create(
+            SearchPosting(document=document, term=term, frequency=frequency)
+            for term, frequency in terms.items()
+        )
+
+
+def index_queryset(queryset, batch_size=500):
+    """Bulk (re)index a Blog or Post queryset; returns the number indexed"""
+    field_name = 'blog' if queryset.model is Blog else 'post'
+    queryset = queryset.select_related('author').prefetch_related('tags')
+    indexed = 0
+
+    for start in range(0, queryset.count(), batch_size):
+        batch = list(queryset.order_by('pk')[start:start + batch_size])
+        terms = {obj.pk: _document_terms(obj) for obj in batch}
+        with transaction.atomic():
+            SearchDocument.objects.filter(
+                **{f'{field_name}__in': batch}).delete()
+            SearchDocument.objects.bulk_create(
+                SearchDocument(**{f'{field_name}_id': pk},
+                               length=sum(counts.values()))
+                for pk, counts in terms.items()
+            )
+            # bulk_create does not return primary keys on every backend
+            documents = dict(
+                SearchDocument.objects
+                .filter(**{f'{field_name}__in': batch})
+                .values_list(f'{field_name}_id', 'id')
+            )
+            SearchPosting.objects.bulk_create(
+                (SearchPosting(document_id=documents[pk], term=term,
+                               frequency=frequency)
+                 for pk, counts in terms.items()
+                 for term, frequency in counts.items()),
+                batch_size=5000
+            )
+        indexed += len(batch)
+    return indexed
+
+
+def match_postings(terms, kind=None, tag=None, author=None):
+    """Postings of the query terms, restricted to the requested documents"""
+    postings = SearchPosting.objects.filter(term__in=terms)
+    if kind == 'blog':
+        postings = postings.filter(document__blog__isnull=False)
+    elif kind == 'post':
+        postings = postings.filter(document__post__isnull=False)
+    if tag:
+        postings = postings.filter(document__in=SearchDocument.objects.filter(
+            Q(blog__tags__name__iexact=tag) | Q(post__tags__name__iexact=tag)
+        ).values('pk'))
+    if author:
+        postings = postings.filter(document__in=SearchDocument.objects.filter(
+            Q(blog__author__username=author) | Q(post__author__username=author)
+        ).values('pk'))
+    return postings
+
+
+def rank(postings, terms):
+    """
+    Score matching documents with BM25.
+
+    Returns a values queryset of (document_id, document__blog_id,
+    document__post_id, score) ordered by descending score.
+    """
+    total = SearchDocument.objects.count()
+    average_length = SearchDocument.objects.aggregate(
+        value=Avg('length'))['value'] or 1
+    frequencies = (
+        SearchPosting.objects.filter(term__in=terms)
+        .values('term').annotate(df=Count('id')).values_list('term', 'df')
+    )
+    idf = {
+        term: math.log(1 + (total - df + 0.5) / (df + 0.5))
+        for term, df in frequencies
+    }
+
+    term_weight = Case(
+        *(When(term=term, then=Value(weight)) for term, weight in idf.items()),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    saturation = (F('frequency') * (K1 + 1)) / (
+        F('frequency') + K1 * (1 - B)
+        + (K1 * B / average_length) * F('document__length')
+    )
+    return (
+        postings
+        .values('document_id', 'document__blog_id', 'document__post_id')
+        .annotate(score=Sum(term_weight * saturation, output_field=FloatField()))
+        .order_by('-score', 'document_id')
+    )
+
+
+def build_snippet(text, terms, length=SNIPPET_LENGTH):
+    """Escaped excerpt of `text` around the first hit, with hits in <mark>"""
+    text = text or ''
+    start = 0
+    for match in WORD_RE.finditer(text):
+        if normalize(match.group()) in terms:
+            start = max(0, match.start() - length // 4)
+            break
+    if start:
+        # Do not start in the middle of a word.
+        boundary = text.rfind(' ', 0, start)
+        start = boundary + 1 if boundary >= 0 else 0
+    end = min(len(text), start + length)
+    window = text[start:end]
+
+    pieces = []
+    last = 0
+    for match in WORD_RE.finditer(window):
+        if normalize(match.group()) in terms:
+            pieces.append(escape(window[last:match.start()]))
+            pieces.append(f'<mark>{escape(match.group())}</mark>')
+            last = match.end()
+    pieces.append(escape(window[last:]))
+
+    snippet = ''.join(pieces).strip()
+    if start > 0:
+        snippet = '…' + snippet
+    if end < len(text):
+        snippet = snippet + '…'
+    return snippet
+
+
+def load_hits(rows, terms):
+    """Attach Blog/Post instances and highlighted text to ranked rows"""
+    terms = set(terms)
+    blog_ids = [row['document__blog_id'] for row in rows if row['document__blog_id']]
+    post_ids = [row['document__post_id'] for row in rows if row['document__post_id']]
+    blogs = Blog.objects.prefetch_related('tags').in_bulk(blog_ids)
+    posts = Post.objects.prefetch_related('tags').in_bulk(post_ids)
+
+    hits = []
+    for row in rows:
+        if row['document__blog_id']:
+            obj = blogs.get(row['document__blog_id'])
+            kind, body, created = 'blog', getattr(obj, 'content', ''), getattr(obj, 'created', None)
+        else:
+            obj = posts.get(row['document__post_id'])
+            kind, body, created = 'post', getattr(obj, 'caption', ''), getattr(obj, 'created_at', None)
+        if obj is None:
+            continue
+        hits.append({
+            'type': kind,
+            'id': obj.id,
+            'score': round(row['score'], 4),
+            'title': obj.title,
+            'highlighted_title': build_snippet(obj.title, terms, length=len(obj.title)),
+            'snippet': build_snippet(body, terms),
+            'author': obj.author,
+            'tags': obj.tags.all(),
+            'created': created,
+        })
+    return hits
+
+
+def facets(postings):
+    """Tag and author counts across every matching document"""
+    matched = postings.values('document_id')
+    blog_ids = SearchDocument.objects.filter(
+        pk__in=matched, blog__isnull=False).values('blog_id')
+    post_ids = SearchDocument.objects.filter(
+        pk__in=matched, post__isnull=False).values('post_id')
+
+    tags = Counter()
+    authors = Counter()
+    for model, ids in ((Blog, blog_ids), (Post, post_ids)):
+        through = model.tags.through
+        fk_name = model._meta.model_name
+        for name, count in (through.objects
+                            .filter(**{f'{fk_name}_id__in': ids})
+                            .values_list('tag__name')
+                            .annotate(count=Count('id'))):
+            tags[name] += count
+        for username, count in (model.objects.filter(pk__in=ids)
+                                .values_list('author__username')
+                                .annotate(count=Count('id'))):
+            authors[username] += count
+
+    return {
+        'tags': [{'name': name, 'count': count}
+                 for name, count in tags.most_common(FACET_LIMIT)],
+        'authors': [{'username': username, 'count': count}
+                    for username, count in authors.most_common(FACET_LIMIT)],
+    }
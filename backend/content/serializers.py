@@ -1,9 +1,11 @@
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 from .models import Blog, Post, Tag, Comment, Rating
 
-from core.serializers import PublicUserSerializer
+from core.fieldsets import SparseFieldsMixin
+from core.serializers import ImageRenditionsField, PublicUserSerializer
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -12,7 +14,7 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class BlogSerializer(serializers.ModelSerializer):
+class BlogSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = PublicUserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     tag_ids = serializers.ListField(
@@ -26,13 +28,15 @@ class BlogSerializer(serializers.ModelSerializer):
         source='avg_rating', read_only=True)
     total_comments = serializers.IntegerField(
         source='comment_count', read_only=True)
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = Blog
         fields = ['id', 'author', 'title', 'content',
-                  'image', 'created', 'updated', 'tags', 'tag_ids',
+                  'image', 'image_renditions', 'created', 'updated', 'tags', 'tag_ids',
                   'total_comments', 'total_ratings', 'average_rating']
         read_only_fields = ['id', 'author', 'created', 'updated']
+        read_dependencies = {'average_rating': ['rating_sum', 'rating_count']}
 
     def create(self, validated_data):
         tag_ids = validated_data.pop('tag_ids', [])
@@ -49,7 +53,7 @@ class BlogSerializer(serializers.ModelSerializer):
         return blog
 
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = PublicUserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     tag_ids = serializers.ListField(
@@ -63,13 +67,15 @@ class PostSerializer(serializers.ModelSerializer):
         source='avg_rating', read_only=True)
     total_comments = serializers.IntegerField(
         source='comment_count', read_only=True)
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = Post
-        fields = ['id', 'author', 'title', 'image', 'caption',
+        fields = ['id', 'author', 'title', 'image', 'image_renditions', 'caption',
                   'youtube_url', 'created_at', 'tags', 'tag_ids',
                   'total_comments', 'total_ratings', 'average_rating']
         read_only_fields = ['id', 'author', 'created_at']
+        read_dependencies = {'average_rating': ['rating_sum', 'rating_count']}
 
     def create(self, validated_data):
         author = self.context['author']
@@ -90,7 +96,7 @@ class PostSerializer(serializers.ModelSerializer):
         return post
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = PublicUserSerializer(read_only=True)
     post = serializers.PrimaryKeyRelatedField(
         queryset=Post.objects.all(), write_only=True, required=False, allow_null=True
@@ -131,7 +137,9 @@ class CommentSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         author = self.context['user']
         validated_data['user'] = author
-        return Comment.objects.create(**validated_data)
+        # The comment notification is queued by signal in the same transaction.
+        with transaction.atomic():
+            return Comment.objects.create(**validated_data)
 
     class Meta:
         model = Comment
@@ -141,7 +149,7 @@ class CommentSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'user', 'created']
 
 
-class RatingSerializer(serializers.ModelSerializer):
+class RatingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = PublicUserSerializer(read_only=True)
     blog = serializers.PrimaryKeyRelatedField(
         queryset=Blog.objects.all(), write_only=True, required=False, allow_null=True
@@ -190,3 +198,16 @@ class RatingSerializer(serializers.ModelSerializer):
         model = Rating
         fields = ['id', 'user', 'blog', 'post', 'blog_id', 'post_id', 'score']
         read_only_fields = ['id', 'user']
+
+
+class SearchResultSerializer(serializers.Serializer):
+    """Serializer for ranked search hits"""
+    type = serializers.CharField(read_only=True)
+    id = serializers.IntegerField(read_only=True)
+    score = serializers.FloatField(read_only=True)
+    title = serializers.CharField(read_only=True)
+    highlighted_title = serializers.CharField(read_only=True)
+    snippet = serializers.CharField(read_only=True)
+    author = PublicUserSerializer(read_only=True)
+    tags = TagSerializer(many=True, read_only=True)
+    created = serializers.DateTimeField(read_only=True)
@@ -1,19 +1,285 @@
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db.models import F, QuerySet
+from django.db.models.functions import Greatest
+from django.db.models.signals import (post_save, pre_save, pre_delete,
+                                      post_delete, m2m_changed)
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
-from .models import Comment
-from core.models import Notification
-from core.utils import create_notification
+from .models import Blog, Post, Tag, Comment, Rating
+from .search import index_instance, index_queryset
+from core.cache import bump_version
+from core.models import Notification, UserProfile
+from core.outbox import enqueue, handler
+from core.search import SEARCHABLE_USER_FIELDS
+from core.utils import coalesce_notification
+
+
+def _adjust_target_counters(blog_id, post_id, **deltas):
+    """Apply F() deltas to the stored counters of a blog and/or post"""
+    # Decrements stop at 0, so a counter that drifted low cannot fail the delete.
+    changes = {field: F(field) + delta if delta >= 0 else Greatest(F(field) + delta, 0)
+               for field, delta in deltas.items()}
+    if blog_id:
+        Blog.objects.filter(pk=blog_id).update(**changes)
+    if post_id:
+        Post.objects.filter(pk=post_id).update(**changes)
+
+
+def _adjust_rating_counters(blog_id, post_id, rating_sum, rating_count=0):
+    """Apply a rating change to its blog/post and to the author's profile stats"""
+    deltas = {'rating_sum': rating_sum}
+    if rating_count:
+        deltas['rating_count'] = rating_count
+    _adjust_target_counters(blog_id, post_id, **deltas)
+    model, pk = (Blog, blog_id) if blog_id else (Post, post_id)
+    author_id = model.objects.filter(pk=pk).values_list('author_id', flat=True).first()
+    UserProfile.objects.adjust_counters(author_id, **deltas)
+
+
+def _deleted_with_user(origin):
+    """True when the delete cascades from a user, whose profile goes away too"""
+    User = UserProfile._meta.get_field('user').related_model
+    if isinstance(origin, QuerySet):
+        return origin.model is User
+    return isinstance(origin, User)
+
+
+def _deleted_with_target(origin):
+    """True when the delete cascades from a Blog/Post, whose counters go away too"""
+    if isinstance(origin, QuerySet):
+        return origin.model in (Blog, Post)
+    return isinstance(origin, (Blog, Post))
 
 
 @receiver(post_save, sender=Comment)
-def create_comment_notification(sender, instance, created, **kwargs):
+def create_comment_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue('content.comment_created', comment_id=instance.id)
+
+
+@handler('content.comment_created')
+def notify_comment(comment_id):
+    comment = (Comment.objects.select_related('user', 'blog__author', 'post__author')
+               .filter(pk=comment_id).first())
+    if comment is None:
+        return
+    target = comment.blog or comment.post
+    if target and target.author != comment.user:
+        kind = 'blog' if comment.blog else 'post'
+
+        def describe(actors, count):
+            if count == 1:
+                return f"{actors} commented on your {kind}."
+            return f"{actors} left {count} comments on your {kind}."
+
+        coalesce_notification(
+            recipient=target.author,
+            notification_type=Notification.NOTIFICATION_TYPE_NEW_COMMENT,
+            target=target,
+            actor=comment.user.username,
+            content_object=comment,
+            describe=describe,
+        )
+
+
+@receiver(post_save, sender=Rating)
+def create_rating_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue('content.rating_created', rating_id=instance.id)
+
+
+@handler('content.rating_created')
+def notify_rating(rating_id):
+    rating = (Rating.objects.select_related('user', 'blog__author', 'post__author')
+              .filter(pk=rating_id).first())
+    if rating is None:
+        return
+    target = rating.blog or rating.post
+    if target and target.author != rating.user:
+        kind = 'blog' if rating.blog else 'post'
+
+        def describe(actors, count):
+            if count == 1:
+                return f"{actors} rated your {kind} with {rating.score}⭐."
+            return f"{actors} left {count} ratings on your {kind}."
+
+        coalesce_notification(
+            recipient=target.author,
+            notification_type=Notification.NOTIFICATION_TYPE_RATING_GIVEN,
+            target=target,
+            actor=rating.user.username,
+            content_object=target,
+            describe=describe,
+        )
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, **kwargs):
     if created:
-        target = instance.blog or instance.post
-        if target and target.author != instance.user:
-            create_notification(
-                recipient=target.author,
-                notification_type='comment',
-                message=f"{instance.user.username} commented on your {'blog' if instance.blog else 'post'}.",
-                content_object=instance
-            )
+        _adjust_target_counters(
+            instance.blog_id, instance.post_id, comment_count=1)
+        UserProfile.objects.adjust_counters(instance.user_id, comment_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comment_count(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_target(origin):
+        _adjust_target_counters(
+            instance.blog_id, instance.post_id, comment_count=-1)
+    if not _deleted_with_user(origin):
+        UserProfile.objects.adjust_counters(instance.user_id, comment_count=-1)
+
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk and not kwargs.get('raw'):
+        instance._previous_rating = (
+            Rating.objects.filter(pk=instance.pk)
+            .values('blog_id', 'post_id', 'score')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Rating)
+def update_rating_counters(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if created:
+        _adjust_rating_counters(
+            instance.blog_id, instance.post_id,
+            rating_sum=instance.score, rating_count=1)
+    elif previous is None:
+        return
+    elif (previous['blog_id'], previous['post_id']) == (instance.blog_id, instance.post_id):
+        if previous['score'] != instance.score:
+            _adjust_rating_counters(
+                instance.blog_id, instance.post_id,
+                rating_sum=instance.score - previous['score'])
+    else:
+        _adjust_rating_counters(
+            previous['blog_id'], previous['post_id'],
+            rating_sum=-previous['score'], rating_count=-1)
+        _adjust_rating_counters(
+            instance.blog_id, instance.post_id,
+            rating_sum=instance.score, rating_count=1)
+
+
+@receiver(post_delete, sender=Rating)
+def decrement_rating_counters(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_target(origin):
+        _adjust_rating_counters(
+            instance.blog_id, instance.post_id,
+            rating_sum=-instance.score, rating_count=-1)
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_save, sender=Post)
+def increment_authored_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        field = 'blog_count' if sender is Blog else 'post_count'
+        UserProfile.objects.adjust_counters(instance.author_id, **{field: 1})
+
+
+@receiver(post_delete, sender=Blog)
+@receiver(post_delete, sender=Post)
+def recalculate_author_stats(sender, instance, origin=None, **kwargs):
+    # The ratings went with the row; recount instead of trusting the
+    # in-memory rating totals, which may predate the delete.
+    if not _deleted_with_user(origin):
+        UserProfile.objects.recalculate_counters([instance.author_id])
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_instance(instance)
+
+
+@receiver(m2m_changed, sender=Blog.tags.through)
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_search_index_tags(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # clear() from the tag side sends no pk_set; remember who loses the tag.
+        instance._cleared_pks = list(
+            model.objects.filter(tags=instance).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        index_instance(instance)
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', None)
+    if pk_set:
+        # Tag side of the relation: reindex every affected blog/post.
+        index_queryset(model.objects.filter(pk__in=pk_set))
+
+
+@receiver(post_save, sender=Tag)
+def reindex_tagged_content(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        index_queryset(Blog.objects.filter(tags=instance))
+        index_queryset(Post.objects.filter(tags=instance))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tagged_content(sender, instance, **kwargs):
+    instance._tagged_content = (
+        list(instance.blog_set.values_list('pk', flat=True)),
+        list(instance.posts.values_list('pk', flat=True)),
+    )
+
+
+@receiver(post_delete, sender=Tag)
+def reindex_untagged_content(sender, instance, **kwargs):
+    blog_ids, post_ids = getattr(instance, '_tagged_content', ([], []))
+    index_queryset(Blog.objects.filter(pk__in=blog_ids))
+    index_queryset(Post.objects.filter(pk__in=post_ids))
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_searchable_user_fields(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._previous_searchable = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not SEARCHABLE_USER_FIELDS & set(update_fields):
+        return
+    instance._previous_searchable = (
+        sender.objects.filter(pk=instance.pk)
+        .values(*SEARCHABLE_USER_FIELDS)
+        .first()
+    )
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reindex_authored_content(sender, instance, created, raw=False, **kwargs):
+    previous = getattr(instance, '_previous_searchable', None)
+    if created or raw or previous is None:
+        return
+    if all(getattr(instance, field) == value for field, value in previous.items()):
+        return
+    index_queryset(Blog.objects.filter(author=instance))
+    index_queryset(Post.objects.filter(author=instance))
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_delete, sender=Blog)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_content_cache_version(sender, **kwargs):
+    bump_version(sender._meta.label_lower)
+
+
+@receiver(m2m_changed, sender=Blog.tags.through)
+@receiver(m2m_changed, sender=Post.tags.through)
+def bump_tagged_cache_version(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version(instance._meta.label_lower)
+        bump_version(model._meta.label_lower)
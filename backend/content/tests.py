@@ -1,3 +1,301 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from core.cache import VERSION_KEY
+from core.models import MyUser, Notification, UserProfile
+
+from .admin import reset_rating
+from .models import Blog, Comment, Post, Rating, Tag
+
+
+class CounterTests(TestCase):
+    """The stored rating and comment counters follow their child rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        cls.bob = MyUser.objects.create_user(
+            username='bob', email='bob@example.com', password='x')
+
+    def setUp(self):
+        self.blog = Blog.objects.create(author=self.alice, title='Blog', content='Content')
+        self.post = Post.objects.create(author=self.alice, title='Post')
+
+    def assertCounters(self, target, rating_sum, rating_count, comment_count):
+        target.refresh_from_db()
+        self.assertEqual((target.rating_sum, target.rating_count, target.comment_count),
+                         (rating_sum, rating_count, comment_count))
+
+    def test_comments(self):
+        comments = [Comment.objects.create(user=self.bob, post=self.post, content=str(i))
+                    for i in range(3)]
+        Comment.objects.create(user=self.bob, blog=self.blog, content='On the blog')
+        self.assertCounters(self.post, 0, 0, 3)
+        self.assertCounters(self.blog, 0, 0, 1)
+
+        comments[0].delete()
+        self.assertCounters(self.post, 0, 0, 2)
+        Comment.objects.filter(post=self.post).delete()
+        self.assertCounters(self.post, 0, 0, 0)
+
+    def test_ratings(self):
+        rating = Rating.objects.create(user=self.bob, post=self.post, score=4)
+        Rating.objects.create(user=self.alice, post=self.post, score=1)
+        self.assertCounters(self.post, 5, 2, 0)
+        self.assertEqual(self.post.avg_rating, 2.5)
+
+        rating.score = 2
+        rating.save()
+        self.assertCounters(self.post, 3, 2, 0)
+
+        rating.post, rating.blog = None, self.blog
+        rating.save()
+        self.assertCounters(self.post, 1, 1, 0)
+        self.assertCounters(self.blog, 2, 1, 0)
+
+        Rating.objects.all().delete()
+        self.assertCounters(self.post, 0, 0, 0)
+        self.assertCounters(self.blog, 0, 0, 0)
+        self.assertIsNone(self.post.avg_rating)
+
+    def test_cascade_delete(self):
+        Comment.objects.create(user=self.bob, post=self.post, content='Hi')
+        Rating.objects.create(user=self.bob, post=self.post, score=5)
+        self.post.delete()
+        self.assertFalse(Comment.objects.exists() or Rating.objects.exists())
+
+    def test_drifted_counters_stop_at_zero(self):
+        comment = Comment.objects.create(user=self.bob, post=self.post, content='Hi')
+        rating = Rating.objects.create(user=self.bob, post=self.post, score=5)
+        Post.objects.filter(pk=self.post.pk).update(rating_sum=0, rating_count=0, comment_count=0)
+
+        comment.delete()
+        rating.delete()
+        self.assertCounters(self.post, 0, 0, 0)
+
+    def test_reconcile_command(self):
+        Comment.objects.create(user=self.bob, post=self.post, content='Hi')
+        Rating.objects.create(user=self.bob, post=self.post, score=3)
+        Rating.objects.create(user=self.bob, blog=self.blog, score=5)
+        Post.objects.filter(pk=self.post.pk).update(rating_sum=40, rating_count=9, comment_count=7)
+        Blog.objects.filter(pk=self.blog.pk).update(rating_sum=0, rating_count=0)
+
+        call_command('reconcile_content_counters', stdout=StringIO())
+        self.assertCounters(self.post, 3, 1, 1)
+        self.assertCounters(self.blog, 5, 1, 0)
+
+    def test_reset_rating_action_recounts_targets_and_authors(self):
+        Rating.objects.create(user=self.bob, post=self.post, score=4)
+        Rating.objects.create(user=self.bob, blog=self.blog, score=2)
+        reset_rating(mock.Mock(), None, Rating.objects.filter(post=self.post))
+        self.assertCounters(self.post, 0, 1, 0)
+        profile = UserProfile.objects.get(user=self.alice)
+        self.assertEqual((profile.rating_sum, profile.rating_count, profile.rating),
+                         (2, 2, 1.0))
+
+    def test_serializers_read_stored_counters(self):
+        Rating.objects.create(user=self.bob, post=self.post, score=4)
+        Comment.objects.create(user=self.bob, post=self.post, content='Hi')
+        response = self.client.get(f'/content/posts/{self.post.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['total_ratings'], response.data['average_rating'],
+             response.data['total_comments']),
+            (1, 4.0, 1))
+
+
+class SearchTests(TestCase):
+    """/content/search/ ranks indexed blogs and posts, and the index follows writes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x', first_name='Alice')
+        cls.agility = Tag.objects.create(name='agility')
+
+    def search(self, query):
+        response = self.client.get('/content/search/', {'q': query})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def hits(self, query):
+        return [(hit['type'], hit['id']) for hit in self.search(query)['results']]
+
+    def test_ranks_title_hits_first(self):
+        body = Blog.objects.create(author=self.alice, title='Weekend',
+                                   content='We tried a new frisbee in the park.')
+        title = Post.objects.create(author=self.alice, title='Frisbee tricks',
+                                    caption='Catching practice.')
+        Post.objects.create(author=self.alice, title='Unrelated', caption='Nothing here.')
+
+        data = self.search('Frisbee')
+        self.assertEqual([(hit['type'], hit['id']) for hit in data['results']],
+                         [('post', title.pk), ('blog', body.pk)])
+        self.assertIn('<mark>frisbee</mark>', data['results'][1]['snippet'].lower())
+        self.assertEqual(self.hits('frisbee tricks')[0], ('post', title.pk))
+        self.assertEqual(self.client.get('/content/search/', {'q': 'the'}).status_code, 400)
+
+    def test_reindexes_on_edit(self):
+        post = Post.objects.create(author=self.alice, title='Puppy', caption='')
+        post.title = 'Beagle'
+        post.save()
+        self.assertEqual(self.hits('puppy'), [])
+        self.assertEqual(self.hits('beagle'), [('post', post.pk)])
+
+    def test_reindexes_on_tag_changes(self):
+        post = Post.objects.create(author=self.alice, title='Course', caption='')
+        blog = Blog.objects.create(author=self.alice, title='Course', content='Jumps')
+        post.tags.add(self.agility)
+        self.agility.blog_set.add(blog)
+        self.assertCountEqual(self.hits('agility'), [('post', post.pk), ('blog', blog.pk)])
+        self.assertEqual(self.search('course')['facets']['tags'],
+                         [{'name': 'agility', 'count': 2}])
+
+        post.tags.clear()
+        self.assertEqual(self.hits('agility'), [('blog', blog.pk)])
+        self.agility.blog_set.clear()
+        self.assertEqual(self.hits('agility'), [])
+
+    def test_reindexes_authored_content_on_rename(self):
+        post = Post.objects.create(author=self.alice, title='Walk', caption='')
+        self.alice.first_name = 'Alicia'
+        self.alice.save()
+        self.assertEqual(self.hits('alicia'), [('post', post.pk)])
+
+        with mock.patch('content.signals.index_queryset') as index_queryset:
+            self.alice.save()
+            self.alice.save(update_fields=['first_name'])
+            self.alice.location = 'Leeds'
+            self.alice.save()
+        index_queryset.assert_not_called()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': 'content-tests'}},
+)
+class ResponseCacheTests(TestCase):
+    """Anonymous blog and post reads are cached until something they show changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x', first_name='Alice')
+        cls.post = Post.objects.create(author=cls.alice, title='Walk')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get(self, url, expected):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get('X-Cache'), expected)
+        return response.data
+
+    def test_caches_anonymous_reads(self):
+        url = f'/content/posts/{self.post.pk}/'
+        self.get('/content/posts/', 'MISS')
+        self.get('/content/posts/', 'HIT')
+        self.get(url, 'MISS')
+        self.get(url, 'HIT')
+
+        self.client.force_authenticate(self.alice)
+        self.get('/content/posts/', None)
+
+    def test_writes_invalidate(self):
+        url = f'/content/posts/{self.post.pk}/'
+        self.get(url, 'MISS')
+        Comment.objects.create(user=self.alice, post=self.post, content='Hi')
+        self.assertEqual(self.get(url, 'MISS')['total_comments'], 1)
+
+        self.post.tags.add(Tag.objects.create(name='dogs'))
+        self.assertEqual(self.get(url, 'MISS')['tags'][0]['name'], 'dogs')
+
+        Post.objects.create(author=self.alice, title='Run')
+        self.assertEqual(self.get('/content/posts/', 'MISS')['count'], 2)
+
+    def test_user_saves_invalidate_only_rendered_changes(self):
+        self.get('/content/posts/', 'MISS')
+        MyUser.objects.create_user(username='bob', email='bob@example.com', password='x')
+        self.alice.save(update_fields=['last_login'])
+        self.alice.set_password('y')
+        self.alice.save()
+        self.get('/content/posts/', 'HIT')
+
+        self.alice.first_name = 'Alicia'
+        self.alice.save()
+        data = self.get('/content/posts/', 'MISS')
+        self.assertEqual(data['results'][0]['author']['full_name'], 'Alicia')
+
+    def test_versions_survive_eviction(self):
+        self.get('/content/posts/', 'MISS')
+        cache.delete(VERSION_KEY.format('content.post'))
+        self.get('/content/posts/', 'MISS')
+
+    def test_stats(self):
+        self.get('/content/posts/', 'MISS')
+        self.get('/content/posts/', 'HIT')
+        self.client.force_authenticate(MyUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='x'))
+        response = self.client.get('/content/cache-stats/')
+        self.assertEqual(response.data['post'], {'hits': 1, 'misses': 1})
+
+
+class NotificationGroupingTests(TestCase):
+    """Comments and ratings on one target fold into one unread notification"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol, cls.dave, cls.erin = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('alice', 'bob', 'carol', 'dave', 'erin'))
+        cls.post = Post.objects.create(author=cls.alice, title='Walk')
+        cls.blog = Blog.objects.create(author=cls.alice, title='Diary', content='Text')
+
+    def comment(self, user, **target):
+        comment = Comment.objects.create(user=user, content='Hi', **(target or {'post': self.post}))
+        call_command('process_outbox', once=True, stdout=StringIO())
+        return comment
+
+    def notifications(self):
+        return list(Notification.objects.filter(recipient=self.alice).order_by('id')
+                    .values_list('message', flat=True))
+
+    def test_groups_comments_per_target(self):
+        self.comment(self.bob)
+        self.comment(self.carol)
+        latest = self.comment(self.bob)
+        self.comment(self.carol, blog=self.blog)
+        self.comment(self.alice)
+        self.assertEqual(self.notifications(), ['bob and carol left 3 comments on your post.',
+                                                'carol commented on your blog.'])
+        notification = Notification.objects.filter(recipient=self.alice).earliest('id')
+        self.assertEqual(notification.target_url,
+                         f'/post/{self.post.pk}/#comment-{latest.pk}')
+        self.assertEqual(notification.extra_data,
+                         {'count': 3, 'actors': ['bob', 'carol'], 'more_actors': False})
+
+    def test_caps_actors_and_restarts_once_read(self):
+        for user in (self.bob, self.carol, self.dave, self.erin):
+            self.comment(user)
+        self.assertEqual(self.notifications(),
+                         ['erin, dave, carol and others left 4 comments on your post.'])
+
+        Notification.objects.update(is_read=True)
+        self.comment(self.bob)
+        self.assertEqual(self.notifications()[1], 'bob commented on your post.')
+
+    def test_groups_ratings(self):
+        Rating.objects.create(user=self.bob, post=self.post, score=4)
+        call_command('process_outbox', once=True, stdout=StringIO())
+        self.assertEqual(self.notifications(), ['bob rated your post with 4⭐.'])
+        Rating.objects.create(user=self.carol, post=self.post, score=5)
+        call_command('process_outbox', once=True, stdout=StringIO())
+        self.assertEqual(self.notifications(), ['carol and bob left 2 ratings on your post.'])
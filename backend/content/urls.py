@@ -1,7 +1,9 @@
 from django.urls import path
 from rest_framework_nested import routers
 from rest_framework.routers import DefaultRouter
-from .views import BlogViewSet, CommentViewSet, PostViewSet, RatingViewSet, TagViewSet
+from .views import (BlogViewSet, CommentViewSet, ContentSearchView,
+                    PostViewSet, RatingViewSet, ResponseCacheStatsView,
+                    TagViewSet)
 
 
 router = routers.DefaultRouter()
@@ -19,4 +21,8 @@ post_router = routers.NestedDefaultRouter(router, 'posts', lookup='post')
 post_router.register('comments', CommentViewSet, basename='post-comments')
 post_router.register('ratings', RatingViewSet, basename='post-ratings')
 
-urlpatterns = router.urls + blog_router.urls + post_router.urls
+urlpatterns = [
+    path('search/', ContentSearchView.as_view(), name='content-search'),
+    path('cache-stats/', ResponseCacheStatsView.as_view(),
+         name='content-cache-stats'),
+] + router.urls + blog_router.urls + post_router.urls
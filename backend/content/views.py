@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.db.models import Count, Avg
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
@@ -6,9 +7,17 @@ from rest_framework.permissions import (IsAuthenticatedOrReadOnly,
                                         AllowAny)
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.generics import GenericAPIView
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from core.pagination import DefaultPagination
+from core.asyncviews import AsyncReadMixin
+from core.cache import CachedResponseMixin, response_cache_stats
+from core.compiled import CompiledListMixin
+from core.fieldsets import SparseFieldsetMixin
+from core.pagination import DefaultPagination, HybridPagination
+from core.routers import ReplicaReadMixin
 from .permissions import IsAuthorOrAdminOrReadOnly, IsAdminOrReadOnly
 
 
@@ -16,19 +25,26 @@ from .serializers import (BlogSerializer,
                           CommentSerializer,
                           PostSerializer,
                           RatingSerializer,
+                          SearchResultSerializer,
                           TagSerializer)
 from .models import Blog, Post, Tag, Comment, Rating
-from core.models import Notification
-from core.utils import create_notification
+from . import search
 
 
-class BlogViewSet(ModelViewSet):
+CONTENT_CACHE_DEPENDENCIES = ('content.comment', 'content.rating',
+                              'content.tag', 'core.myuser')
+
+
+class BlogViewSet(ReplicaReadMixin, CachedResponseMixin, SparseFieldsetMixin, CompiledListMixin,
+                  ModelViewSet):
     serializer_class = BlogSerializer
+    cache_dependencies = ('content.blog',) + CONTENT_CACHE_DEPENDENCIES
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['created', 'updated', 'tags__name']
     search_fields = ['title', 'content']
     ordering_fields = ['id', 'created', 'updated']
-    pagination_class = DefaultPagination
+    pagination_class = HybridPagination
+    keyset_ordering = ('-created', '-id')
     permission_classes = [IsAdminOrReadOnly]
 
     def get_queryset(self):
@@ -49,15 +65,18 @@ class BlogViewSet(ModelViewSet):
         serializer.save(author=self.request.user)
 
 
-class PostViewSet(ModelViewSet):
+class PostViewSet(ReplicaReadMixin, CachedResponseMixin, SparseFieldsetMixin, CompiledListMixin,
+                  ModelViewSet):
     serializer_class = PostSerializer
+    cache_dependencies = ('content.post',) + CONTENT_CACHE_DEPENDENCIES
     permission_classes = [IsAuthorOrAdminOrReadOnly]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['created_at', 'author', 'tags']
     search_fields = ['title', 'caption', 'tags__name', 'author__username__icontains',
                      'author__first_name__icontains', 'author__last_name__icontains']
     ordering_fields = ['id', 'created_at', 'title']
-    pagination_class = DefaultPagination
+    pagination_class = HybridPagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         base_queryset = Post.objects.all()
@@ -90,7 +109,15 @@ class PostViewSet(ModelViewSet):
         return super().update(request, *args, **kwargs)
 
 
-class CommentViewSet(ModelViewSet):
+class AsyncPostViewSet(AsyncReadMixin, PostViewSet):
+    """PostViewSet with list and retrieve served on the event loop under ASGI"""
+
+    def get_queryset(self):
+        # Serializers cannot load the author lazily on the event loop.
+        return super().get_queryset().select_related('author')
+
+
+class CommentViewSet(ReplicaReadMixin, SparseFieldsetMixin, ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -99,7 +126,8 @@ class CommentViewSet(ModelViewSet):
     search_fields = ['user__username__icontains', 'user__first_name__icontains',
                      'user__last_name__icontains', 'content__icontains']
     ordering_fields = ['id', 'created']
-    pagination_class = DefaultPagination
+    pagination_class = HybridPagination
+    keyset_ordering = ('-created', '-id')
 
     def get_queryset(self):
         queryset = Comment.objects.all().select_related('user', 'blog', 'post')
@@ -130,7 +158,7 @@ class CommentViewSet(ModelViewSet):
         instance.delete()
 
 
-class RatingViewSet(ModelViewSet):
+class RatingViewSet(ReplicaReadMixin, SparseFieldsetMixin, ModelViewSet):
     serializer_class = RatingSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
@@ -157,16 +185,9 @@ class RatingViewSet(ModelViewSet):
         if (blog and blog.author == user) or (post and post.author == user):
             raise ValidationError("You cannot rate your own blog or post.")
 
-        rating = serializer.save(user=user)
-
-        recipient = blog.author if blog else post.author
-        if recipient != user:
-            create_notification(
-                recipient=recipient,
-                notification_type=Notification.NOTIFICATION_TYPE_RATING_GIVEN,
-                message=f"{user.username} rated your {'blog' if blog else 'post'} with {rating.score}⭐.",
-                content_object=blog if blog else post,
-            )
+        # The rating notification is queued by signal in the same transaction.
+        with transaction.atomic():
+            serializer.save(user=user)
 
     def perform_update(self, serializer):
         if serializer.instance.user != self.request.user and not self.request.user.is_staff:
@@ -179,7 +200,7 @@ class RatingViewSet(ModelViewSet):
         instance.delete()
 
 
-class TagViewSet(ModelViewSet):
+class TagViewSet(ReplicaReadMixin, ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     filter_backends = [SearchFilter, OrderingFilter]
@@ -190,3 +211,40 @@ class TagViewSet(ModelViewSet):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
             return [IsAdminUser()]
         return [AllowAny()]
+
+
+class ContentSearchView(GenericAPIView):
+    """
+    Ranked full-text search over blogs and posts.
+    ?q=<terms>&type=blog|post&tag=<name>&author=<username>
+    """
+    serializer_class = SearchResultSerializer
+    pagination_class = DefaultPagination
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        terms = sorted(set(search.tokenize(request.query_params.get('q', ''))))
+        if not terms:
+            raise ValidationError({'q': 'Enter at least one search term.'})
+
+        postings = search.match_postings(
+            terms,
+            kind=request.query_params.get('type'),
+            tag=request.query_params.get('tag'),
+            author=request.query_params.get('author'),
+        )
+        page = self.paginate_queryset(search.rank(postings, terms))
+        serializer = self.get_serializer(
+            search.load_hits(page, terms), many=True)
+
+        response = self.get_paginated_response(serializer.data)
+        response.data['facets'] = search.facets(postings)
+        return response
+
+
+class ResponseCacheStatsView(APIView):
+    """Hit/miss counters of the anonymous blog and post response cache"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(response_cache_stats(['blog', 'post']))
@@ -1,6 +1,7 @@
 from django.utils.html import format_html
+from .renditions import thumbnail_url
 from django.contrib import admin
-from .models import MyUser, UserProfile, Notification
+from .models import MyUser, UserProfile, Notification, ArchivedNotification
 
 
 @admin.register(MyUser)
@@ -14,7 +15,7 @@ class MyUserAdmin(admin.ModelAdmin):
             return format_html(
                 '<a href="{}" target="_blank"><img src="{}" style="width: 60px; height: 60px; object-fit: cover;" /></a>',
                 obj.profile_image.url,
-                obj.profile_image.url
+                thumbnail_url(obj.profile_image, obj.profile_image_renditions)
             )
         return 'No Image Available'
 
@@ -35,3 +36,11 @@ class NotificationAdmin(admin.ModelAdmin):
     list_display = ['id', 'recipient', 'notification_type',
                     'message', 'is_read', 'created_at']
     list_filter = ['is_read']
+
+
+@admin.register(ArchivedNotification)
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+    list_display = ['original_id', 'recipient', 'notification_type',
+                    'message', 'is_read', 'created_at', 'archived_at']
+    list_filter = ['notification_type', 'is_read']
+    list_select_related = ['recipient']
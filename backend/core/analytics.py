@@ -0,0 +1,98 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DailyClickCount
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClickBuffer:
+    """
+    Collects affiliate clicks in memory and writes them as per-item, per-day
+    counter increments once `max_events` clicks have accumulated, or
+    `max_age` seconds after the first buffered click even if no other click
+    arrives. Clicks buffered in a process that dies unflushed are lost,
+    which is acceptable for analytics.
+    """
+
+    def __init__(self, max_events=500, max_age=30):
+        self.max_events = max_events
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._events = 0
+        self._timer = None
+
+    def add(self, content_type_id, object_id, day):
+        with self._lock:
+            self._counts[(content_type_id, object_id, day)] += 1
+            self._events += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.max_age, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+            due = self._events >= self.max_events
+        if due:
+            self.flush()
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread's own connections; nothing else will close them.
+            connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._events = 0
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not counts:
+            return 0
+        try:
+            write_click_counts(counts)
+        except Exception:
+            logger.exception(f"Failed to flush {sum(counts.values())} affiliate clicks")
+            return 0
+        return sum(counts.values())
+
+
+def write_click_counts(counts):
+    """Upsert {(content_type_id, object_id, day): clicks} into the counters"""
+    with transaction.atomic():
+        DailyClickCount.objects.bulk_create(
+            [DailyClickCount(content_type_id=content_type_id,
+                             object_id=object_id, day=day)
+             for content_type_id, object_id, day in counts],
+            ignore_conflicts=True,
+        )
+        for (content_type_id, object_id, day), clicks in counts.items():
+            DailyClickCount.objects.filter(
+                content_type_id=content_type_id, object_id=object_id, day=day
+            ).update(clicks=F('clicks') + clicks)
+
+
+click_buffer = ClickBuffer(
+    max_events=getattr(settings, 'CLICK_BUFFER_MAX_EVENTS', 500),
+    max_age=getattr(settings, 'CLICK_BUFFER_MAX_AGE_SECONDS', 30),
+)
+atexit.register(click_buffer.flush)
+
+
+def record_click(item):
+    click_buffer.add(
+        ContentType.objects.get_for_model(item).id,
+        item.pk,
+        timezone.localdate(),
+    )
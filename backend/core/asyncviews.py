@@ -0,0 +1,173 @@
+"""
+Native async read endpoints for ASGI.
+
+AsyncReadMixin goes in front of a ViewSet and serves the actions that
+have an async twin (`alist`, `aretrieve`, `a<action>`) on the event loop:
+the token's user is loaded with `aget()`, pages are counted with
+`acount()` and read with `aiterator()`, and the ViewSet's own permission
+checks, querysets, filters, pagination and serializers do the rest. The
+serializers run over rows that are already loaded, so they must not
+touch a relation the queryset does not select or prefetch.
+
+Everything else runs the ViewSet's sync code in a thread, as Django
+does for any sync view under ASGI: writes, actions without an async
+twin, anonymous requests to views caching their responses, and
+requests filtered with `filterset_fields` (django-filter validates model
+choices with queries).
+
+dogworld/asgi.py routes the ASGI application through dogworld/asgi_urls.py,
+where these ViewSets take over the paths of the sync ones; WSGI keeps
+serving the sync ViewSets.
+"""
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from django.utils.decorators import classonlymethod
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import CachedResponseMixin
+
+
+class AsyncJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that can load the token's user with the async ORM"""
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        """get_user() with the user read by aget()"""
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+        try:
+            user = await self.user_model.objects.aget(**{jwt_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist as e:
+            raise exceptions.AuthenticationFailed(_('User not found'), code='user_not_found') from e
+
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if jwt_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                    jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise exceptions.AuthenticationFailed(
+                    _("The user's password has been changed."), code='password_changed')
+
+        return user
+
+
+async def afetch(queryset, chunk_size=2000):
+    """The rows of `queryset`, read with the async ORM"""
+    return [row async for row in queryset.aiterator(chunk_size=chunk_size)]
+
+
+class AsyncReadMixin:
+    """For ViewSets: serves the actions with an async twin natively; see the module docstring"""
+    authentication_classes = [AsyncJWTAuthentication]
+
+    @classonlymethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        return markcoroutinefunction(view)
+
+    def get_async_handler(self, request):
+        action = self.action_map.get(request.method.lower())
+        handler = getattr(self, f'a{action}', None) if action else None
+        if handler is None:
+            return None
+        if (isinstance(self, CachedResponseMixin)
+                and not request.META.get('HTTP_AUTHORIZATION')):
+            return None  # anonymous responses come from the response cache
+        filters = getattr(self, 'filterset_fields', ())
+        if any(name in request.GET for name in filters):
+            return None
+        return handler
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = self.get_async_handler(request)
+        if handler is None:
+            return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.aperform_authentication(request)
+            self.initial(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def aperform_authentication(self, request):
+        """Request._authenticate(), awaiting authenticators that can load users async"""
+        for authenticator in request.authenticators:
+            try:
+                if hasattr(authenticator, 'aauthenticate'):
+                    user_auth_tuple = await authenticator.aauthenticate(request)
+                else:
+                    user_auth_tuple = await sync_to_async(authenticator.authenticate)(request)
+            except exceptions.APIException:
+                request._not_authenticated()
+                raise
+
+            if user_auth_tuple is not None:
+                request._authenticator = authenticator
+                request.user, request.auth = user_auth_tuple
+                return
+
+        request._not_authenticated()
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def prepare_objects(self, objects):
+        """Load what serializing `objects` would otherwise query for"""
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            await self.prepare_objects(page)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        objects = await afetch(queryset)
+        await self.prepare_objects(objects)
+        return Response(self.get_serializer(objects, many=True).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        await self.prepare_objects([instance])
+        return Response(self.get_serializer(instance).data)
@@ -0,0 +1,130 @@
+"""
+Cached user cards for nested user serializers.
+
+A card is the serialized form of a user nested in another payload (a post
+author, a message sender). Cards are cached per serializer, site origin and
+user under the user's profile version, which is bumped whenever one of the
+user's CARD_FIELDS changes. The first card a serializer tree needs fetches
+the cards of every user on the page with one multi-get; each card is then
+built at most once per request and shared by every row that shows that user.
+"""
+from django.core.cache import cache
+from django.db.models import QuerySet
+from rest_framework.serializers import ListSerializer
+
+from .cache import bump_version, get_versions
+
+
+CARD_KEY = 'user-card:{kind}:{origin}:{user_id}:{version}'
+CARD_TIMEOUT = 60 * 60
+MEMO_KEY = '_user_cards'
+# User fields rendered by any card serializer, and so by any cached payload
+# that embeds a user.
+CARD_FIELDS = frozenset({'username', 'email', 'first_name', 'last_name', 'location', 'is_active',
+                         'date_joined', 'profile_image', 'profile_image_renditions'})
+
+
+def profile_version_name(user_id):
+    return f'profile:{user_id}'
+
+
+def bump_profile_version(user_id):
+    bump_version(profile_version_name(user_id))
+
+
+def _loaded(objects):
+    """`objects` if it is already in memory; never runs a query"""
+    if isinstance(objects, QuerySet):
+        return list(objects) if objects._result_cache is not None else []
+    return list(objects) if isinstance(objects, (list, tuple)) else []
+
+
+class UserCardMixin:
+    """For ModelSerializers of the user model that are nested in other payloads"""
+    use_card_cache = True
+
+    def get_card_kind(self):
+        return type(self).__name__
+
+    def to_representation(self, instance):
+        if not self.use_card_cache:
+            return super().to_representation(instance)
+        memo = self.context.setdefault(MEMO_KEY, {})
+        key = (self.get_card_kind(), instance.pk)
+        if key not in memo:
+            self.load_cards([instance] + self.page_users())
+        return memo[key]
+
+    def page_users(self):
+        """Users shown by this and sibling card fields across the page"""
+        root, parent = self.root, self.parent
+        many = isinstance(root, ListSerializer)
+        if many and self is root.child:
+            # A list of users itself, e.g. search results.
+            return _loaded(root.instance)
+        if parent is not None and parent is root:
+            objects = [root.instance]
+        elif many and parent is root.child:
+            objects = _loaded(root.instance)
+        else:
+            return []
+
+        sources = [field.source for field in parent.fields.values()
+                   if type(field) is type(self) and '.' not in field.source]
+        users = []
+        for obj in objects:
+            for source in sources:
+                user = getattr(obj, source, None)
+                if user is not None:
+                    users.append(user)
+        return users
+
+    def load_cards(self, users):
+        self._load_cards({user.pk: user for user in users})
+
+    def load_cards_by_id(self, user_ids):
+        """
+        Memoize the cards of `user_ids`, reading only the users whose cards
+        are not cached; for readers that have ids but no user objects.
+        """
+        self._load_cards(dict.fromkeys(user_ids))
+        memo = self.context[MEMO_KEY]
+        kind = self.get_card_kind()
+        return {pk: memo[(kind, pk)] for pk in user_ids if (kind, pk) in memo}
+
+    def _load_cards(self, users):
+        memo = self.context.setdefault(MEMO_KEY, {})
+        kind = self.get_card_kind()
+        pending = {pk: user for pk, user in users.items()
+                   if pk is not None and (kind, pk) not in memo}
+        if not pending:
+            return
+
+        keys, cached = {}, {}
+        if self.use_card_cache:
+            request = self.context.get('request')
+            origin = request.build_absolute_uri('/') if request else ''
+            versions = get_versions([profile_version_name(pk) for pk in pending])
+            keys = {
+                pk: CARD_KEY.format(kind=kind, origin=origin, user_id=pk, version=version)
+                for pk, version in zip(pending, versions)
+            }
+            cached = cache.get_many(list(keys.values()))
+
+        unloaded = [pk for pk, user in pending.items()
+                    if user is None and keys.get(pk) not in cached]
+        if unloaded:
+            pending.update(self.Meta.model.objects.in_bulk(unloaded))
+
+        missing = {}
+        for pk, user in pending.items():
+            card = cached.get(keys.get(pk))
+            if card is None:
+                if user is None:
+                    continue  # deleted since the ids were read
+                card = super().to_representation(user)
+                if pk in keys:
+                    missing[keys[pk]] = card
+            memo[(kind, pk)] = card
+        if missing:
+            cache.set_many(missing, CARD_TIMEOUT)
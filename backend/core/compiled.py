@@ -0,0 +1,445 @@
+"""
+Compiled read path for list endpoints.
+
+`compile_serializer()` walks a ModelSerializer's readable fields once per
+process and turns each into an accessor over `.values()` rows: plain
+columns are read and converted directly, files and renditions are turned
+into URLs, nested user cards come from the card cache, nested objects from
+joined columns and many-to-many children from one extra query per page.
+Fields that need a model instance (properties, SerializerMethodFields)
+get one built from the row only for those fields. The payload is the same
+as the serializer's, key for key and in the same order.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .cards import UserCardMixin
+from .fieldsets import CONTEXT_KEY as SPARSE_FIELDS_KEY
+from .renderers import FastJSONRenderer
+from .serializers import ImageRenditionsField
+from .renditions import current_renditions, renditions_field
+
+
+SKIP = object()
+
+# DRF representations that are plain conversions of the column value.
+CONVERTERS = {
+    serializers.IntegerField.to_representation: int,
+    serializers.FloatField.to_representation: float,
+    serializers.CharField.to_representation: str,
+}
+# Fields whose representation does not depend on the serializer context.
+CONTEXT_FREE_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.ChoiceField,
+    serializers.DateField, serializers.DateTimeField, serializers.DecimalField,
+    serializers.DurationField, serializers.FloatField, serializers.IntegerField,
+    serializers.JSONField, serializers.ReadOnlyField, serializers.TimeField,
+    serializers.UUIDField,
+)
+
+
+class Page:
+    """Per-render state shared by the accessors of one page of rows"""
+
+    def __init__(self, compiled, rows, context):
+        self.compiled = compiled
+        self.rows = rows
+        self.context = context
+        self.request = context.get('request')
+        self._serializer = None
+
+    @property
+    def serializer(self):
+        """The serializer bound to the context, for methods and bound fields"""
+        if self._serializer is None:
+            self._serializer = self.compiled.serializer_class(context=self.context)
+        return self._serializer
+
+
+class Row:
+    """A `.values()` row plus the model instance built from it on demand"""
+    __slots__ = ('values', 'compiled', 'db', '_instance')
+
+    def __init__(self, values, compiled, db):
+        self.values = values
+        self.compiled = compiled
+        self.db = db
+        self._instance = None
+
+    @property
+    def instance(self):
+        if self._instance is None:
+            names = [name for name in self.compiled.concrete_columns
+                     if name in self.values]
+            self._instance = self.compiled.model.from_db(
+                self.db, names, [self.values[name] for name in names])
+        return self._instance
+
+
+class Step:
+    """Reads one output key; `prepare()` returns `get(row) -> value or SKIP`"""
+
+    def __init__(self, key):
+        self.key = key
+
+    columns = ()
+
+    def prepare(self, page):
+        raise NotImplementedError
+
+
+class ValueStep(Step):
+    def __init__(self, key, column, field):
+        super().__init__(key)
+        self.column = column
+        self.columns = (column,)
+        self.convert = (CONVERTERS.get(type(field).to_representation)
+                        or field.to_representation)
+
+    def prepare(self, page):
+        column, convert = self.column, self.convert
+
+        def get(row):
+            value = row.values[column]
+            return None if value is None else convert(value)
+        return get
+
+
+class FileStep(Step):
+    def __init__(self, key, column, field, model_field):
+        super().__init__(key)
+        self.column = column
+        self.columns = (column,)
+        self.storage = model_field.storage
+        self.use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+    def prepare(self, page):
+        column, storage, request = self.column, self.storage, page.request
+        use_url = self.use_url
+        urls = {}  # many rows share a default image
+
+        def get(row):
+            name = row.values[column]
+            if not name:
+                return None
+            if not use_url:
+                return name
+            if name not in urls:
+                url = storage.url(name)
+                urls[name] = request.build_absolute_uri(url) if request is not None else url
+            return urls[name]
+        return get
+
+
+class RenditionsStep(Step):
+    def __init__(self, key, column, model_field):
+        super().__init__(key)
+        self.column = column
+        self.record_column = renditions_field(column)
+        self.columns = (column, self.record_column)
+        self.model_field = model_field
+
+    def prepare(self, page):
+        column, record_column = self.column, self.record_column
+        model_field, request = self.model_field, page.request
+        originals = {}  # URLs of images without renditions depend on the name only
+
+        def get(row):
+            name, record = row.values[column], row.values[record_column]
+            image = model_field.attr_class(None, model_field, name)
+            if current_renditions(image, record) is not None:
+                return ImageRenditionsField.represent(image, record, request)
+            if name not in originals:
+                originals[name] = ImageRenditionsField.represent(image, None, request)
+            return originals[name]
+        return get
+
+
+class CardStep(Step):
+    def __init__(self, key, column, serializer_class):
+        super().__init__(key)
+        self.column = column
+        self.columns = (column,)
+        self.serializer_class = serializer_class
+
+    def prepare(self, page):
+        column = self.column
+        user_ids = list(dict.fromkeys(
+            row[column] for row in page.rows if row[column] is not None))
+        cards = self.serializer_class(context=page.context).load_cards_by_id(user_ids)
+
+        def get(row):
+            user_id = row.values[column]
+            return None if user_id is None else cards.get(user_id)
+        return get
+
+
+class NestedStep(Step):
+    """A nested serializer over a forward foreign key, read from joined columns"""
+
+    def __init__(self, key, column, steps):
+        super().__init__(key)
+        self.column = column
+        self.steps = steps
+        self.columns = (column,) + tuple(c for step in steps for c in step.columns)
+
+    def prepare(self, page):
+        column = self.column
+        getters = [(step.key, step.prepare(page)) for step in self.steps]
+
+        def get(row):
+            if row.values[column] is None:
+                return None
+            item = {}
+            for key, getter in getters:
+                value = getter(row)
+                if value is not SKIP:
+                    item[key] = value
+            return item
+        return get
+
+
+class ManyStep(Step):
+    """A nested many=True serializer over a many-to-many field"""
+
+    def __init__(self, key, relation, steps):
+        super().__init__(key)
+        self.relation = relation
+        self.steps = steps
+
+    def prepare(self, page):
+        pk_column = page.compiled.pk_column
+        owner_ids = [row[pk_column] for row in page.rows]
+        # Same joins and filter as prefetch_related(), so the same row order.
+        query_name = self.relation.related_query_name()
+        child_columns = [column for step in self.steps for column in step.columns]
+        children = (
+            self.relation.related_model._default_manager
+            .filter(**{f'{query_name}__in': owner_ids})
+            .values(query_name, *child_columns)
+        ) if owner_ids else []
+
+        getters = [(step.key, step.prepare(page)) for step in self.steps]
+        grouped = {}
+        for values in children:
+            child = Row(values, None, None)
+            item = {}
+            for key, getter in getters:
+                value = getter(child)
+                if value is not SKIP:
+                    item[key] = value
+            grouped.setdefault(values[query_name], []).append(item)
+
+        def get(row):
+            return grouped.get(row.values[pk_column], [])
+        return get
+
+
+class MissingStep(Step):
+    """A source the rows cannot have; mirrors DRF's handling of the AttributeError"""
+
+    def __init__(self, key, field):
+        super().__init__(key)
+        self.field = field
+
+    def prepare(self, page):
+        field = self.field
+
+        def get(row):
+            if field.default is not empty:
+                return field.get_default()
+            if field.allow_null:
+                return None
+            return SKIP
+        return get
+
+
+class InstanceStep(Step):
+    """Anything else, evaluated by the DRF field against a model instance"""
+
+    def __init__(self, key, field):
+        super().__init__(key)
+        self.field = field
+
+    def prepare(self, page):
+        if isinstance(self.field, serializers.SerializerMethodField):
+            method = getattr(page.serializer, self.field.method_name)
+
+            def get(row):
+                return method(row.instance)
+            return get
+
+        field = (self.field if isinstance(self.field, CONTEXT_FREE_FIELDS)
+                 else page.serializer.fields[self.key])
+
+        def get(row):
+            try:
+                attribute = field.get_attribute(row.instance)
+            except SkipField:
+                return SKIP
+            if attribute is None:
+                return None
+            return field.to_representation(attribute)
+        return get
+
+
+class CompiledSerializer:
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        opts = self.model._meta
+        self.pk_column = opts.pk.attname
+        self.concrete_columns = [field.attname for field in opts.concrete_fields]
+        self.steps = self.compile_fields(serializer_class(), self.model, prefix='')
+        self.dependencies = {
+            key: [opts.get_field(name).attname for name in names]
+            for key, names in getattr(serializer_class.Meta, 'read_dependencies', {}).items()
+        }
+        self._plans = {}
+
+    def plan(self, selected=None):
+        """The steps for the `selected` keys (all when None) and the columns they read"""
+        if selected not in self._plans:
+            steps = [step for step in self.steps if selected is None or step.key in selected]
+            columns = [self.pk_column]
+            for step in steps:
+                if isinstance(step, InstanceStep):
+                    columns += self.dependencies.get(step.key, self.concrete_columns)
+                else:
+                    columns += step.columns
+            # Sparse plans read only their columns; full ones read every row column.
+            if selected is None:
+                columns = self.concrete_columns + columns
+            self._plans[selected] = (steps, list(dict.fromkeys(columns)))
+        return self._plans[selected]
+
+    def compile_fields(self, serializer, model, prefix):
+        return [self.compile_field(field, model, prefix)
+                for field in serializer._readable_fields]
+
+    def compile_field(self, field, model, prefix):
+        key = field.field_name
+        name = type(field.parent).__name__
+
+        if isinstance(field, ImageRenditionsField):
+            return RenditionsStep(key, prefix + field.image_field,
+                                  model._meta.get_field(field.image_field))
+        if field.source == '*' and not isinstance(field, serializers.SerializerMethodField):
+            raise ImproperlyConfigured(
+                f"{name}.{key}: source='*' fields cannot be compiled")
+
+        if isinstance(field, serializers.SerializerMethodField) or len(field.source_attrs) > 1:
+            model_field = None
+        else:
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                model_field = None
+
+        if isinstance(field, serializers.ListSerializer):
+            if (prefix or model_field is None or not model_field.many_to_many
+                    or model_field.auto_created):
+                raise ImproperlyConfigured(
+                    f"{name}.{key}: only forward many-to-many lists can be compiled")
+            steps = self.compile_fields(field.child, model_field.related_model, prefix='')
+            if not all(isinstance(step, (ValueStep, FileStep, MissingStep)) for step in steps):
+                raise ImproperlyConfigured(
+                    f"{name}.{key}: nested list fields must be model columns")
+            return ManyStep(key, model_field, steps)
+
+        if isinstance(field, serializers.BaseSerializer):
+            if model_field is None or not model_field.many_to_one:
+                raise ImproperlyConfigured(
+                    f"{name}.{key}: only forward foreign keys can be nested")
+            column = prefix + model_field.attname
+            if isinstance(field, UserCardMixin) and not prefix:
+                return CardStep(key, column, type(field))
+            steps = self.compile_fields(
+                field, model_field.related_model, prefix=f'{prefix}{model_field.name}__')
+            if any(isinstance(step, InstanceStep) for step in steps):
+                raise ImproperlyConfigured(
+                    f"{name}.{key}: nested fields must be model columns")
+            return NestedStep(key, column, steps)
+
+        if model_field is not None and model_field.concrete and not model_field.is_relation:
+            column = prefix + model_field.attname
+            if isinstance(field, serializers.FileField):
+                return FileStep(key, column, field, model_field)
+            if isinstance(field, CONTEXT_FREE_FIELDS):
+                return ValueStep(key, column, field)
+
+        if model_field is None and not isinstance(field, serializers.SerializerMethodField):
+            if not hasattr(model, field.source_attrs[0]):
+                return MissingStep(key, field)
+        if prefix:
+            raise ImproperlyConfigured(
+                f"{name}.{key}: nested fields must be model columns")
+        return InstanceStep(key, field)
+
+    def values(self, queryset, selected=None, keep=()):
+        """
+        `queryset` reduced to the rows the accessors of `selected` read,
+        plus the `keep` columns
+        """
+        _, columns = self.plan(selected)
+        columns = list(dict.fromkeys([*columns, *keep]))
+        return queryset.prefetch_related(None).values(*columns)
+
+    def render(self, rows, context, db=None, selected=None):
+        rows = list(rows)
+        page = Page(self, rows, context)
+        steps, _ = self.plan(selected)
+        getters = [(step.key, step.prepare(page)) for step in steps]
+        data = []
+        for values in rows:
+            row = Row(values, self, db)
+            item = {}
+            for key, getter in getters:
+                value = getter(row)
+                if value is not SKIP:
+                    item[key] = value
+            data.append(item)
+        return data
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    return CompiledSerializer(serializer_class)
+
+
+class CompiledListMixin:
+    """
+    For ModelViewSets: serves `list` from `.values()` rows through the
+    compiled form of the view's serializer, rendered with orjson. Turned
+    off for every view by COMPILED_READS = False.
+    """
+    renderer_classes = [FastJSONRenderer] + [
+        renderer for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+        if not issubclass(renderer, JSONRenderer)]
+
+    def use_compiled_read(self):
+        return getattr(settings, 'COMPILED_READS', True)
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_compiled_read():
+            return super().list(request, *args, **kwargs)
+
+        compiled = compile_serializer(self.get_serializer_class())
+        context = self.get_serializer_context()
+        selected = context.get(SPARSE_FIELDS_KEY)
+        keep = [field.lstrip('-') for field in getattr(self, 'keyset_ordering', ())]
+        queryset = compiled.values(
+            self.filter_queryset(self.get_queryset()), selected, keep)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                compiled.render(page, context, db=queryset.db, selected=selected))
+        return Response(compiled.render(queryset, context, db=queryset.db, selected=selected))
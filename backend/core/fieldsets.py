@@ -0,0 +1,167 @@
+"""
+Sparse fieldsets for read endpoints.
+
+`?fields=id,title` limits a payload to the named fields and `?include=`
+names the nested objects (author, tags, category, ...) to embed. With
+`include` alone every plain field is returned plus the named nested ones,
+so `?include=` on its own drops all nested objects. Without either
+parameter payloads are unchanged.
+
+The view trims its queryset to match: unrequested columns are deferred
+and nested objects that are not embedded are neither joined nor
+prefetched. Fields computed from other columns name those columns in
+`Meta.read_dependencies`; without an entry the columns are not trimmed.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+from .renditions import renditions_field
+from .serializers import ImageRenditionsField
+
+
+FIELDS_PARAM = 'fields'
+INCLUDE_PARAM = 'include'
+CONTEXT_KEY = 'sparse_fields'
+
+
+def _names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+@lru_cache(maxsize=None)
+def readable_fields(serializer_class):
+    """The readable fields of `serializer_class`, built once per process"""
+    return {field.field_name: field for field in serializer_class()._readable_fields}
+
+
+def is_nested(field):
+    return isinstance(field, serializers.BaseSerializer)
+
+
+def requested_fields(query_params, serializer_class):
+    """
+    Names of the fields asked for with ?fields= and ?include=, or None when
+    neither is given. Unknown names are a validation error.
+    """
+    if FIELDS_PARAM not in query_params and INCLUDE_PARAM not in query_params:
+        return None
+    fields = readable_fields(serializer_class)
+    nested = {name for name, field in fields.items() if is_nested(field)}
+
+    if FIELDS_PARAM in query_params:
+        selected = _names(query_params[FIELDS_PARAM])
+    else:
+        selected = set(fields) - nested
+    included = _names(query_params.get(INCLUDE_PARAM, ''))
+
+    errors = {}
+    if selected - set(fields):
+        errors[FIELDS_PARAM] = (
+            f"Unknown field(s): {', '.join(sorted(selected - set(fields)))}. "
+            f"Available: {', '.join(fields)}.")
+    if included - nested:
+        errors[INCLUDE_PARAM] = (
+            f"Cannot include: {', '.join(sorted(included - nested))}. "
+            f"Available: {', '.join(sorted(nested)) or 'none'}.")
+    if errors:
+        raise ValidationError(errors)
+    return frozenset(selected | included)
+
+
+def trim_queryset(queryset, serializer_class, selected, keep=()):
+    """
+    `queryset` loading only what the `selected` fields read. `keep` names
+    extra fields to load, e.g. the columns a cursor is built from.
+    """
+    fields = readable_fields(serializer_class)
+    dependencies = getattr(serializer_class.Meta, 'read_dependencies', {})
+    opts = queryset.model._meta
+    # Foreign keys are cheap and permission checks tend to compare them.
+    columns = {opts.pk.name, *keep,
+               *(field.name for field in opts.concrete_fields if field.is_relation)}
+    select, prefetch = [], []
+    trim_columns = True
+
+    for name in selected:
+        field = fields[name]
+        if name in dependencies:
+            columns.update(dependencies[name])
+            continue
+        if isinstance(field, ImageRenditionsField):
+            columns.update((field.image_field, renditions_field(field.image_field)))
+            continue
+        try:
+            model_field = opts.get_field(field.source_attrs[0]) if field.source_attrs else None
+        except FieldDoesNotExist:
+            model_field = None
+
+        if model_field is None:
+            trim_columns = False  # a property or method with unknown inputs
+        elif model_field.many_to_many or model_field.one_to_many:
+            prefetch.append(model_field.name)
+        elif model_field.many_to_one or model_field.one_to_one:
+            select.append(model_field.name)
+        else:
+            columns.add(model_field.name)
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if trim_columns:
+        queryset = queryset.only(*columns)
+    return queryset
+
+
+class SparseFieldsetMixin:
+    """
+    For ModelViewSets: honours ?fields= and ?include= on list and retrieve.
+    The view's serializer needs SparseFieldsMixin.
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        if not hasattr(self, '_sparse_fields'):
+            self._sparse_fields = None
+            if (self.request.method in SAFE_METHODS
+                    and getattr(self, 'action', None) in self.sparse_actions):
+                self._sparse_fields = requested_fields(
+                    self.request.query_params, self.get_serializer_class())
+        return self._sparse_fields
+
+    def wants_field(self, name):
+        selected = self.get_sparse_fields()
+        return selected is None or name in selected
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context[CONTEXT_KEY] = self.get_sparse_fields()
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        selected = self.get_sparse_fields()
+        if selected is None:
+            return queryset
+        keep = [field.lstrip('-') for field in getattr(self, 'keyset_ordering', ())]
+        return trim_queryset(queryset, self.get_serializer_class(), selected, keep)
+
+
+class SparseFieldsMixin:
+    """For serializers of SparseFieldsetMixin views; trims the root serializer only"""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.context.get(CONTEXT_KEY)
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if selected is None or parent is not None:
+            return fields
+        return {name: field for name, field in fields.items()
+                if name in selected or field.write_only}
@@ -0,0 +1,64 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.renditions import (IMAGE_FIELDS, record_renditions,
+                             render_image, renditions_field)
+
+
+class Command(BaseCommand):
+    help = ('Render thumb/card/full variants for stored images that do not '
+            'have them yet, in parallel worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Re-render variants that already exist.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        # Shared files (e.g. the default images) are rendered only once.
+        pending = {}
+        for label, field_name in IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            rows = model.objects.exclude(**{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True}).values_list(
+                field_name, renditions_field(field_name))
+            for source, record in rows.iterator():
+                if options['force'] or (record or {}).get('source') != source:
+                    pending.setdefault(source, set()).add((model, field_name))
+
+        self.stdout.write(f'Rendering {len(pending)} images '
+                          f'with {options["workers"]} workers.')
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+
+        rendered = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(render_image, source, options['force']): source
+                for source in pending
+            }
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    record = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f'Failed to render {source}: {exc}')
+                    continue
+                for model, field_name in pending[source]:
+                    record_renditions(model, field_name, source, record)
+                rendered += 1
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} images in {elapsed:.1f}s ({failed} failed).'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Notification
+from core.utils import resolve_target_urls
+
+
+class Command(BaseCommand):
+    help = 'Store the target URL on notifications created before it was denormalized.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = 0
+
+        while True:
+            batch = list(
+                Notification.objects
+                .filter(target_url='', pk__gt=last_pk)
+                .order_by('pk')
+                .only('id', 'content_type_id', 'object_id', 'target_url')
+                [:batch_size]
+            )
+            if not batch:
+                break
+            resolve_target_urls(batch)
+            Notification.objects.bulk_update(batch, ['target_url'])
+            updated += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored target URLs on {updated} notifications.'))
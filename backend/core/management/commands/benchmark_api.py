@@ -0,0 +1,216 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import MyUser
+from core.seeding import dataset_counts, seed_dataset
+
+
+ENDPOINTS = ('post-list', 'post-detail', 'conversations', 'conversation-history',
+             'notifications', 'user-search', 'product-list')
+# Latency increases below this many milliseconds are noise, not regressions.
+MIN_REGRESSION_MS = 0.5
+
+
+def percentile(values, q):
+    """Linear interpolation between closest ranks of the sorted `values`"""
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database with a reproducible dataset and time '
+            'the hot API endpoints end to end. Prints a JSON report of latency '
+            'percentiles, queries per request and throughput; with --baseline, '
+            'fails when an endpoint got slower or runs more queries than in a '
+            'stored report.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Multiplies the dataset size (200 users, 2000 posts, ...).')
+        for name in ('users', 'posts', 'blogs', 'comments', 'ratings', 'messages',
+                     'notifications', 'products', 'services'):
+            parser.add_argument(f'--{name}', type=int, help=f'Number of {name}; overrides --scale.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seeds the dataset and the request mix.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Timed requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Untimed requests per endpoint first.')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma-separated subset of: ' + ', '.join(ENDPOINTS))
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+        parser.add_argument('--baseline', help='A stored report to compare against.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p50/p95 slowdown against the baseline (0.25 = 25%%).')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s): {', '.join(sorted(unknown))}")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        counts = dataset_counts(options['scale'], **{
+            name: options[name] for name in dataset_counts()})
+        database = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(IMAGE_RENDITIONS={'WORKERS': 0}):
+                report = self.run(counts, endpoints, options)
+        finally:
+            connection.creation.destroy_test_db(database, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = self.compare(report, baseline, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR(f'  {regression}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}.')
+            self.stderr.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
+
+    def run(self, counts, endpoints, options):
+        started = time.perf_counter()
+        data = seed_dataset(counts, seed=options['seed'])
+        self.stderr.write(
+            f'Seeded {", ".join(f"{count} {name}" for name, count in counts.items())} '
+            f'on {connection.vendor} in {time.perf_counter() - started:.1f}s.')
+
+        users = MyUser.objects.in_bulk(data['users'])
+        first_names = {pk: user.first_name for pk, user in users.items()}
+        contacts = data['contacts']
+
+        def post_list(rng):
+            return rng.choice(data['users']), '/content/posts/'
+
+        def post_detail(rng):
+            return rng.choice(data['users']), f'/content/posts/{rng.choice(data["posts"])}/'
+
+        def conversations(rng):
+            return rng.choice(data['users']), '/messaging/messages/conversations/'
+
+        def conversation_history(rng):
+            user = rng.choice(data['users'])
+            return user, f'/messaging/messages/conversation/?user_id={rng.choice(contacts[user])}'
+
+        def notifications(rng):
+            return rng.choice(data['users']), '/messaging/notifications/'
+
+        def user_search(rng):
+            name = first_names[rng.choice(data['users'])]
+            return rng.choice(data['users']), f'/users/search/?query={name[:rng.randint(3, 5)]}'
+
+        def product_list(rng):
+            return rng.choice(data['users']), '/marketplace/products/'
+
+        requests = {
+            'post-list': post_list, 'post-detail': post_detail,
+            'conversations': conversations, 'conversation-history': conversation_history,
+            'notifications': notifications, 'user-search': user_search,
+            'product-list': product_list,
+        }
+
+        results = {}
+        for name in endpoints:
+            rng = random.Random(f'{options["seed"]}:{name}')
+            plan = [requests[name](rng) for _ in range(options['warmup'] + options['requests'])]
+            results[name] = self.measure(
+                [(users[pk], url) for pk, url in plan], options['warmup'])
+            result = results[name]
+            self.stderr.write(
+                f'  {name:<21} p50 {result["p50_ms"]:8.2f} ms   p95 {result["p95_ms"]:8.2f} ms'
+                f'   p99 {result["p99_ms"]:8.2f} ms   {result["queries_per_request"]:5.1f} queries'
+                f'   {result["throughput_rps"]:7.1f} req/s'
+                + (f'   {result["errors"]} errors' if result['errors'] else ''))
+
+        return {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'dataset': {'seed': options['seed'], 'counts': counts},
+            'requests_per_endpoint': options['requests'],
+            'endpoints': results,
+        }
+
+    def measure(self, plan, warmup):
+        client = APIClient()
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        latencies, query_counts, errors = [], [], 0
+        with connection.execute_wrapper(count_query):
+            for user, url in plan[:warmup]:
+                client.force_authenticate(user)
+                client.get(url)
+
+            started = time.perf_counter()
+            for user, url in plan[warmup:]:
+                client.force_authenticate(user)
+                queries = 0
+                request_started = time.perf_counter()
+                response = client.get(url)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+                query_counts.append(queries)
+                errors += response.status_code != 200
+            elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'queries_per_request': round(sum(query_counts) / len(query_counts), 2),
+            'max_queries': max(query_counts),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'errors': errors,
+        }
+
+    def compare(self, report, baseline, tolerance):
+        """Descriptions of where `report` is worse than `baseline`"""
+        if (report['dataset'], report['database']) != (baseline['dataset'], baseline['database']):
+            raise CommandError(
+                'The baseline was recorded with a different dataset or database; '
+                f'rerun with the same options on {baseline["database"]}.')
+        regressions = []
+        for name, result in report['endpoints'].items():
+            if result['errors']:
+                regressions.append(f'{name}: {result["errors"]} non-200 responses')
+            base = baseline['endpoints'].get(name)
+            if base is None:
+                continue
+            for key in ('p50_ms', 'p95_ms'):
+                if (result[key] > base[key] * (1 + tolerance)
+                        and result[key] - base[key] > MIN_REGRESSION_MS):
+                    regressions.append(
+                        f'{name}: {key} {result[key]:.2f} vs {base[key]:.2f} '
+                        f'(+{(result[key] / base[key] - 1) * 100:.0f}%)')
+            if result['queries_per_request'] > base['queries_per_request']:
+                regressions.append(
+                    f'{name}: {result["queries_per_request"]} queries per request '
+                    f'vs {base["queries_per_request"]}')
+        return regressions
@@ -0,0 +1,124 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from content.models import Blog, Post, Tag
+from content.views import BlogViewSet, PostViewSet
+from marketplace.models import Category, Product
+from marketplace.views import ProductViewSet
+from messaging.models import Message
+from messaging.views import MessageViewSet
+from services.models import Service
+from services.views import ServiceViewSet
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Time the list endpoints of posts, blogs, products, services and '
+            'messages with and without compiled reads, checking that both '
+            'return the same bytes. Seeded rows are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100,
+                            help='Rows per endpoint; also the page size.')
+        parser.add_argument('--authors', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per measurement; the best time is reported.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), override_settings(IMAGE_RENDITIONS={'WORKERS': 0}):
+                self.run(options['rows'], options['authors'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows, authors):
+        User = get_user_model()
+        User.objects.bulk_create(
+            User(username=f'compiled-bench-{i}',
+                 email=f'compiled-bench-{i}@example.com',
+                 first_name='Bench', last_name=str(i))
+            for i in range(authors))
+        users = list(User.objects.filter(username__startswith='compiled-bench-'))
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'compiled-bench-{i}') for i in range(5))
+
+        posts = Post.objects.bulk_create(
+            Post(author=users[i % authors], title=f'Post {i}', caption='Caption',
+                 rating_sum=i % 7, rating_count=i % 3)
+            for i in range(rows))
+        blogs = Blog.objects.bulk_create(
+            Blog(author=users[i % authors], title=f'Blog {i}', content='Text')
+            for i in range(rows))
+        for through, owner, objects in ((Post.tags.through, 'post', posts),
+                                        (Blog.tags.through, 'blog', blogs)):
+            through.objects.bulk_create(
+                through(**{owner: obj, 'tag': tags[(obj.pk + k) % len(tags)]})
+                for obj in objects for k in range(2))
+
+        category = Category.objects.create(name='Compiled bench', slug='compiled-bench')
+        Product.objects.bulk_create(
+            Product(title=f'Product {i}', slug=f'compiled-bench-{i}',
+                    description='Description', price=Decimal('9.99'),
+                    affiliate_url='https://example.com/product', category=category)
+            for i in range(rows))
+        Service.objects.bulk_create(
+            Service(name=f'Service {i}', slug=f'compiled-bench-{i}',
+                    service_type='walker', description='Description',
+                    contact_email='service@example.com', city='Oslo')
+            for i in range(rows))
+        Message.objects.bulk_create(
+            Message(sender=users[i % 2], receiver=users[1 - i % 2], content=f'Message {i}')
+            for i in range(rows))
+        return users
+
+    def run(self, rows, authors, repeat):
+        users = self.seed(rows, max(authors, 2))
+        factory = APIRequestFactory()
+        endpoints = [
+            ('posts', PostViewSet, f'/content/posts/?page_size={rows}'),
+            ('blogs', BlogViewSet, f'/content/blogs/?page_size={rows}'),
+            ('products', ProductViewSet,
+             f'/marketplace/products/?page_size={rows}'),
+            ('services', ServiceViewSet, f'/services/?page_size={rows}'),
+            ('messages', MessageViewSet, '/messaging/messages/'),
+        ]
+
+        self.stdout.write(f'{rows} rows per endpoint, best of {repeat}:')
+        for name, viewset, url in endpoints:
+            view = viewset.as_view({'get': 'list'})
+
+            def get():
+                request = factory.get(url)
+                force_authenticate(request, users[0])
+                response = view(request)
+                response.render()
+                return response
+
+            def measure(compiled):
+                with override_settings(COMPILED_READS=compiled):
+                    content = get().content
+                    best = None
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        get()
+                        elapsed = time.perf_counter() - started
+                        best = elapsed if best is None else min(best, elapsed)
+                return content, best * 1000
+
+            expected, regular = measure(False)
+            actual, compiled = measure(True)
+            assert actual == expected, f'Compiled {name} payload differs'
+            self.stdout.write(
+                f'  {name:<9} serializers {regular:7.2f} ms   compiled {compiled:7.2f} ms'
+                f'   {regular / compiled:4.1f}x  ({len(actual)} bytes, identical)')
+        self.stdout.write(self.style.SUCCESS('Compiled payloads match byte for byte.'))
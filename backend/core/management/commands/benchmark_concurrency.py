@@ -0,0 +1,247 @@
+import asyncio
+import io
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.management.commands.benchmark_api import percentile
+from core.models import MyUser
+from core.seeding import dataset_counts, seed_dataset
+from dogworld.asgi import AsyncReadsASGIHandler
+
+
+# The endpoints with native async views under ASGI.
+ENDPOINTS = ('post-list', 'post-detail', 'conversations', 'conversation-history',
+             'unread-count', 'notifications')
+MODES = ('wsgi', 'asgi-sync', 'asgi')
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database and load the hot read endpoints with '
+            'concurrent clients, once through the WSGI application on a pool of '
+            '--threads worker threads (like a gthread worker), once through the '
+            'ASGI application with the sync views and once with the native async '
+            'views. Everything runs in this process; prints a JSON report of '
+            'throughput and latency percentiles per endpoint and concurrency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=0.25,
+                            help='Multiplies the dataset size (200 users, 2000 posts, ...).')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seeds the dataset and the request mix.')
+        parser.add_argument('--concurrency', default='1,8,32,64',
+                            help='Comma-separated numbers of concurrent clients.')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Worker threads serving the WSGI application.')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Timed requests per endpoint, mode and concurrency.')
+        parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                            help='Sleep this long in every query, as a network round trip '
+                                 'to the database server would.')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma-separated subset of: ' + ', '.join(ENDPOINTS))
+        parser.add_argument('--modes', default=','.join(MODES),
+                            help='Comma-separated subset of: ' + ', '.join(MODES))
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        endpoints = [name.strip() for name in options['endpoints'].split(',') if name.strip()]
+        modes = [name.strip() for name in options['modes'].split(',') if name.strip()]
+        unknown = (set(endpoints) - set(ENDPOINTS)) | (set(modes) - set(MODES))
+        if unknown:
+            raise CommandError(f"Unknown endpoint(s) or mode(s): {', '.join(sorted(unknown))}")
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency takes comma-separated integers.')
+
+        database = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        delay = options['db_latency_ms'] / 1000
+
+        def slow_query(execute, sql, params, many, context):
+            time.sleep(delay)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_query)
+
+        try:
+            with override_settings(IMAGE_RENDITIONS={'WORKERS': 0}):
+                plans = self.plan(endpoints, options)
+                if delay:
+                    connection.execute_wrappers.append(slow_query)
+                    connection_created.connect(add_latency)
+                report = self.run(plans, modes, levels, options)
+        finally:
+            connection_created.disconnect(add_latency)
+            connection.creation.destroy_test_db(database, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def plan(self, endpoints, options):
+        """The (token, path, query string) requests to make per endpoint"""
+        counts = dataset_counts(options['scale'])
+        started = time.perf_counter()
+        data = seed_dataset(counts, seed=options['seed'])
+        self.stderr.write(
+            f'Seeded {", ".join(f"{count} {name}" for name, count in counts.items())} '
+            f'on {connection.vendor} in {time.perf_counter() - started:.1f}s.')
+
+        tokens = {user.pk: f'Bearer {AccessToken.for_user(user)}'
+                  for user in MyUser.objects.filter(pk__in=data['users'])}
+
+        def request(name, rng):
+            user = rng.choice(data['users'])
+            path, query = {
+                'post-list': ('/content/posts/', ''),
+                'post-detail': (f'/content/posts/{rng.choice(data["posts"])}/', ''),
+                'conversations': ('/messaging/messages/conversations/', ''),
+                'conversation-history': ('/messaging/messages/conversation/',
+                                         f'user_id={rng.choice(data["contacts"][user])}'),
+                'unread-count': ('/messaging/messages/unread_count/', ''),
+                'notifications': ('/messaging/notifications/', ''),
+            }[name]
+            return tokens[user], path, query
+
+        plans = {}
+        for name in endpoints:
+            rng = random.Random(f'{options["seed"]}:{name}')
+            plans[name] = [request(name, rng) for _ in range(options['requests'])]
+        return plans
+
+    def run(self, plans, modes, levels, options):
+        results = {}
+        for mode in modes:
+            results[mode] = {}
+            for name, plan in plans.items():
+                results[mode][name] = {}
+                for level in levels:
+                    result = asyncio.run(self.measure(mode, plan, level, options['threads']))
+                    results[mode][name][str(level)] = result
+                    self.stderr.write(
+                        f'  {mode:<9} {name:<21} c={level:<4} {result["throughput_rps"]:8.1f} req/s'
+                        f'   p50 {result["p50_ms"]:8.2f} ms   p95 {result["p95_ms"]:8.2f} ms'
+                        + (f'   {result["errors"]} errors' if result['errors'] else ''))
+
+        return {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'dataset': {'seed': options['seed'], 'counts': dataset_counts(options['scale'])},
+            'db_latency_ms': options['db_latency_ms'],
+            'wsgi_threads': options['threads'],
+            'requests': options['requests'],
+            'results': results,
+        }
+
+    async def measure(self, mode, plan, concurrency, threads):
+        if mode == 'wsgi':
+            pool = ThreadPoolExecutor(threads)
+            application = WSGIHandler()
+            loop = asyncio.get_running_loop()
+
+            async def call(request):
+                return await loop.run_in_executor(pool, wsgi_get, application, *request)
+        else:
+            pool = None
+            application = AsyncReadsASGIHandler() if mode == 'asgi' else ASGIHandler()
+
+            async def call(request):
+                return await asgi_get(application, *request)
+
+        # One untimed pass over a few requests loads code paths and caches.
+        for request in plan[:concurrency]:
+            await call(request)
+
+        pending = iter(plan)
+        latencies, errors = [], 0
+
+        async def client():
+            nonlocal errors
+            for request in pending:
+                request_started = time.perf_counter()
+                status = await call(request)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+                errors += status != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        if pool is not None:
+            pool.shutdown()
+
+        latencies.sort()
+        return {
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'errors': errors,
+        }
+
+
+def wsgi_get(application, authorization, path, query):
+    """Status code of a GET through the WSGI application"""
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SCRIPT_NAME': '', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_AUTHORIZATION': authorization,
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(), 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    response = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_get(application, authorization, path, query):
+    """Status code of a GET through the ASGI application"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', authorization.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    status = []
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    finished = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected until the response is sent.
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(scope, receive, send)
+    finished.set()
+    return status[0]
@@ -0,0 +1,82 @@
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIRequestFactory
+
+from content.models import Post
+from content.views import PostViewSet
+from core.pagination import KeysetPagination
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare page number and keyset pagination latency for the first '
+            'and a deep page of the post list. Seeded rows are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=5000,
+                            help='Deep page number to compare against page 1.')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Requests per measurement; the best time is reported.')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, page, page_size, repeat, **options):
+        total = page * page_size
+        author, _ = get_user_model().objects.get_or_create(
+            username='pagination-bench',
+            defaults={'email': 'pagination-bench@example.com'})
+        self.stdout.write(f'Seeding {total} posts...')
+        Post.objects.bulk_create(
+            (Post(author=author, title=f'Post {i}') for i in range(total)),
+            batch_size=5000)
+
+        view = PostViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+
+        def measure(params):
+            best = None
+            for _ in range(repeat):
+                request = factory.get('/content/posts/', params)
+                started = time.perf_counter()
+                response = view(request)
+                response.render()
+                assert response.status_code == 200, response.content
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            return best * 1000
+
+        self.stdout.write('mode         page 1 (ms)   page %d (ms)' % page)
+
+        first = measure({'page': 1, 'page_size': page_size})
+        deep = measure({'page': page, 'page_size': page_size})
+        self.stdout.write(f'page number  {first:11.2f}   {deep:11.2f}')
+
+        paginator = KeysetPagination()
+        paginator.ordering = PostViewSet.keyset_ordering
+        paginator.base_url = 'http://testserver/content/posts/'
+        boundary = (Post.objects.order_by(*PostViewSet.keyset_ordering)
+                    [(page - 1) * page_size - 1])
+        position = paginator._get_position_from_instance(
+            boundary, paginator.ordering)
+        cursor = paginator.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position))
+        cursor = parse_qs(urlsplit(cursor).query)['cursor'][0]
+
+        first = measure({'pagination': 'cursor', 'page_size': page_size})
+        deep = measure({'cursor': cursor, 'page_size': page_size})
+        self.stdout.write(f'keyset       {first:11.2f}   {deep:11.2f}')
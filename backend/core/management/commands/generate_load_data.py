@@ -0,0 +1,85 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.seeding import (DEFAULT_COUNTS, TABLES, Dataset, dataset_counts, finish_dataset,
+                          generate, load_data_statement)
+
+
+class Command(BaseCommand):
+    help = ('Generate a large, referentially consistent dataset for load testing, '
+            'written with multi-row INSERTs or as CSV files for LOAD DATA INFILE. '
+            'Rows are added to the existing ones, with ids after the current maximum.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Multiplies the default counts (200 users, 2000 posts, ...).')
+        for name in DEFAULT_COUNTS:
+            parser.add_argument(f'--{name}', type=int, help=f'Number of {name}; overrides --scale.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Processes generating the chunks of each table; 0 for one per CPU.')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows per INSERT statement.')
+        parser.add_argument('--csv', metavar='DIRECTORY',
+                            help='Write CSV files and a load.sql for MySQL there instead of inserting. '
+                                 'Ids still follow the rows of the configured database.')
+
+    def handle(self, *args, **options):
+        counts = dataset_counts(options['scale'], **{name: options[name] for name in DEFAULT_COUNTS})
+        workers = options['workers'] or os.cpu_count()
+        directory = options['csv'] and os.path.abspath(options['csv'])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        elif workers > 1 and connection.vendor == 'sqlite':
+            self.stderr.write('SQLite takes one writer at a time; inserting with one worker.')
+            workers = 1
+
+        dataset = Dataset(counts, seed=options['seed'])
+        started = time.perf_counter()
+        table_started = started
+
+        def progress(table, rows):
+            nonlocal table_started
+            elapsed = time.perf_counter() - table_started
+            self.stdout.write(f'  {table.model._meta.db_table:<28} {rows:>11,} rows '
+                              f'{elapsed:7.1f}s  {rows / max(elapsed, 1e-9):>10,.0f} rows/s')
+            table_started = time.perf_counter()
+
+        action = f'Writing CSV to {directory}' if directory else f'Inserting into {connection.vendor}'
+        self.stdout.write(f'{action} with {workers} worker(s):')
+        try:
+            generate(dataset, workers=workers, directory=directory,
+                     batch_size=options['batch_size'], progress=progress)
+        except OSError as e:
+            raise CommandError(e)
+
+        if directory:
+            self.write_load_script(directory)
+            self.stdout.write(self.style.SUCCESS(
+                f'Wrote CSV in {time.perf_counter() - started:.1f}s. Load it with\n'
+                f'  mysql --local-infile=1 <database> < {os.path.join(directory, "load.sql")}\n'
+                f'then run reconcile_content_counters, rebuild_conversations, '
+                f'rebuild_user_search_index and rebuild_search_index.'))
+            return
+
+        self.stdout.write('Rebuilding counters, conversations and the search indexes...')
+        finish_started = time.perf_counter()
+        finish_dataset(dataset, batch_size=options['batch_size'])
+        self.stdout.write(f'  done in {time.perf_counter() - finish_started:.1f}s')
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated the dataset in {time.perf_counter() - started:.1f}s.'))
+
+    def write_load_script(self, directory):
+        files = set(os.listdir(directory))
+        lines = ['SET FOREIGN_KEY_CHECKS = 0;', 'SET UNIQUE_CHECKS = 0;']
+        for table in TABLES:
+            prefix = f'{table.model._meta.db_table}.'
+            for name in sorted(name for name in files
+                               if name.startswith(prefix) and name.endswith('.csv')):
+                lines.append(load_data_statement(table, os.path.join(directory, name)))
+        lines += ['SET UNIQUE_CHECKS = 1;', 'SET FOREIGN_KEY_CHECKS = 1;']
+        with open(os.path.join(directory, 'load.sql'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
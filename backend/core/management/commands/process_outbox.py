@@ -0,0 +1,79 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from core.models import OutboxEvent
+from core.outbox import claim_batch, outbox_setting, process_event
+
+
+def _process_in_thread(event_id):
+    try:
+        return process_event(event_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Carry out queued outbox events (notifications and other side '
+            'effects of writes) in batches, retrying failures with backoff.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of threads handling events of a batch. SQLite '
+                 'locks the whole database per write, so it always uses 1.')
+        parser.add_argument(
+            '--batch-size', type=int, default=outbox_setting('BATCH_SIZE'),
+            help='Number of events claimed at a time.')
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to sleep when no event is due.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no event is due instead of polling.')
+        parser.add_argument(
+            '--purge-after-hours', type=int, default=24,
+            help='Delete done events older than this many hours.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        processed = failed = 0
+        workers = options['workers']
+        if connection.vendor == 'sqlite' and workers > 1:
+            self.stderr.write('SQLite cannot write concurrently; using 1 worker.')
+            workers = 1
+
+        # A single worker handles events in this thread, on its own connection.
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        try:
+            while True:
+                ids = claim_batch(options['batch_size'])
+                if ids:
+                    if executor is None:
+                        results = [process_event(event_id) for event_id in ids]
+                    else:
+                        results = list(executor.map(_process_in_thread, ids))
+                    processed += results.count(True)
+                    failed += results.count(False)
+                    continue
+
+                self.purge(options['purge_after_hours'])
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} events in {elapsed:.1f}s ({failed} failed attempts).'))
+
+    def purge(self, hours):
+        OutboxEvent.objects.filter(
+            status=OutboxEvent.STATUS_DONE,
+            processed_at__lt=timezone.now() - timezone.timedelta(hours=hours),
+        ).delete()
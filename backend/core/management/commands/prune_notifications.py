@@ -0,0 +1,102 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ArchivedNotification, Notification
+
+
+ARCHIVED_FIELDS = [
+    'id', 'recipient_id', 'notification_type', 'message', 'content_type_id',
+    'object_id', 'is_read', 'created_at', 'extra_data', 'target_url',
+]
+
+
+def retention_days(notification_type, is_read):
+    """Days to keep; a type's policy falls back to 'default' per read state"""
+    retention = getattr(settings, 'NOTIFICATION_RETENTION', {})
+    state = 'read' if is_read else 'unread'
+    policy = retention.get(notification_type, {})
+    if state in policy:
+        return policy[state]
+    return retention.get('default', {}).get(state)
+
+
+class Command(BaseCommand):
+    help = ('Delete, or with --archive move to the archive table, notifications '
+            'older than NOTIFICATION_RETENTION allows, in short batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--archive', action='store_true',
+            help='Copy expired notifications to the archive before deleting them.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows removed per transaction.')
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Seconds to sleep between batches to leave room for other writes.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only count the expired notifications.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        now = timezone.now()
+        total = 0
+
+        for notification_type, _ in Notification.NOTIFICATION_TYPES:
+            for is_read in (True, False):
+                days = retention_days(notification_type, is_read)
+                if days is None:
+                    continue
+                expired = Notification.objects.filter(
+                    notification_type=notification_type,
+                    is_read=is_read,
+                    created_at__lt=now - timezone.timedelta(days=days),
+                )
+                if options['dry_run']:
+                    removed = expired.count()
+                else:
+                    removed = self.prune(expired, **options)
+                total += removed
+                if removed:
+                    state = 'read' if is_read else 'unread'
+                    self.stdout.write(
+                        f'{notification_type} ({state}, older than {days} days): {removed}')
+
+        elapsed = time.perf_counter() - started
+        verb = 'Found' if options['dry_run'] else (
+            'Archived' if options['archive'] else 'Deleted')
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {total} notifications in {elapsed:.1f}s ({rate:.0f} rows/s).'))
+
+    def prune(self, expired, batch_size, archive, pause, **options):
+        """
+        Remove `expired` in batches, each its own short transaction. Every
+        batch is the front of the (type, is_read, created_at) index range,
+        which the previous batch has already cleared.
+        """
+        expired = expired.order_by('created_at', 'id')
+        removed = 0
+        while True:
+            with transaction.atomic():
+                if archive:
+                    rows = list(expired.values(*ARCHIVED_FIELDS)[:batch_size])
+                    ids = [row['id'] for row in rows]
+                    ArchivedNotification.objects.bulk_create(
+                        (ArchivedNotification(original_id=row.pop('id'), **row)
+                         for row in rows),
+                        ignore_conflicts=True,
+                    )
+                else:
+                    ids = list(expired.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    return removed
+                Notification.objects.filter(id__in=ids).delete()
+            removed += len(ids)
+            if pause:
+                time.sleep(pause)
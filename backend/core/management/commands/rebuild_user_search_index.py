@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import MyUser, UserSearchToken
+from core.search import index_users
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the prefix index used by the user search typeahead.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of users indexed per transaction.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        UserSearchToken.objects.all().delete()
+        indexed = index_users(MyUser.objects.all(), batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} users in {elapsed:.1f}s.'))
@@ -0,0 +1,68 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.models import DailyClickCount, Notification
+from core.utils import create_notification
+
+
+class Command(BaseCommand):
+    help = ('Send staff one notification summarizing a day of affiliate clicks. '
+            'Safe to re-run: staff who already have the digest are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--day', help='YYYY-MM-DD, defaults to yesterday.')
+        parser.add_argument('--top', type=int, default=5,
+                            help='Number of items listed in the digest.')
+
+    def handle(self, *args, **options):
+        if options['day']:
+            try:
+                day = date.fromisoformat(options['day'])
+            except ValueError:
+                raise CommandError('--day must be formatted as YYYY-MM-DD.')
+        else:
+            day = timezone.localdate() - timezone.timedelta(days=1)
+
+        counts = DailyClickCount.objects.filter(day=day)
+        total = counts.aggregate(total=Sum('clicks'))['total']
+        if not total:
+            self.stdout.write(f'No affiliate clicks on {day}.')
+            return
+
+        top = [
+            row for row in
+            counts.select_related('content_type').order_by('-clicks')[:options['top']]
+            if row.content_object is not None
+        ]
+        if not top:
+            self.stdout.write(f'No remaining items were clicked on {day}.')
+            return
+        summary = ', '.join(
+            f"{getattr(row.content_object, 'title', None) or row.content_object.name} ({row.clicks})"
+            for row in top)
+
+        already_sent = Notification.objects.filter(
+            notification_type=Notification.NOTIFICATION_TYPE_AFFILIATE_CLICKED,
+            extra_data__digest_day=day.isoformat(),
+        ).values('recipient_id')
+        recipients = get_user_model().objects.filter(
+            is_staff=True, is_active=True).exclude(id__in=already_sent)
+
+        sent = 0
+        for staff_user in recipients:
+            notification = create_notification(
+                recipient=staff_user,
+                notification_type=Notification.NOTIFICATION_TYPE_AFFILIATE_CLICKED,
+                message=f"{total} affiliate clicks on {day}. Top: {summary}.",
+                content_object=top[0].content_object,
+            )
+            notification.extra_data = {'digest_day': day.isoformat(), 'total_clicks': total}
+            notification.save(update_fields=['extra_data'])
+            sent += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent the {day} click digest to {sent} staff members.'))
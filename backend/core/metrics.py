@@ -0,0 +1,357 @@
+"""
+Per-route request metrics: latency, query count, SQL time, serialization
+time and response size, plus detection of N+1 query patterns.
+
+RequestMetricsMiddleware times every request and, through a database
+execute wrapper, every query it runs. Observations go into fixed-bucket
+histograms kept in process memory, labelled by the resolved view name, so
+a route costs the same few counters however many URLs it serves.
+`/metrics` publishes them in the Prometheus text format and
+`/analytics/requests/` summarises them for staff. Numbers are per process;
+scrape every worker to see them all.
+
+A query shape (its SQL with literals and placeholder lists collapsed)
+running `N_PLUS_ONE_THRESHOLD` times or more within one request is flagged
+as a likely N+1.
+
+Serialization time is the time spent in the view and the renderer minus
+the SQL it waited on: for read endpoints, building and rendering the
+payload.
+"""
+import contextvars
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'TOKEN': '',
+}
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# (name, help, buckets) of each histogram, in RouteStats.histograms order.
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Time spent handling the request.', DURATION_BUCKETS),
+    ('request_queries', 'Database queries run by the request.', QUERY_BUCKETS),
+    ('request_db_seconds', 'Time spent waiting on database queries.', DURATION_BUCKETS),
+    ('request_serialization_seconds',
+     'Time spent in the view and renderer, excluding database queries.', DURATION_BUCKETS),
+    ('request_response_bytes', 'Size of the response body.', SIZE_BUCKETS),
+)
+PREFIX = 'dogworld_'
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+MAX_SHAPES_PER_ROUTE = 10
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)')
+_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+
+def get_setting(name):
+    return getattr(settings, 'REQUEST_METRICS', {}).get(name, DEFAULTS[name])
+
+
+@lru_cache(maxsize=2048)
+def query_shape(sql):
+    """`sql` with literals replaced by ? and placeholder lists by (...)"""
+    sql = _NUMBER.sub('?', _STRING.sub('?', sql))
+    return _LISTS.sub('(...)', _LIST.sub('(...)', sql))
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.max = 0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+    def quantile(self, q):
+        """Estimated like Prometheus' histogram_quantile(), within the max seen"""
+        count = self.count
+        if not count:
+            return None
+        rank = q * count
+        lower, seen = 0, 0
+        for upper, bucket in zip((*self.buckets, self.max), self.counts):
+            upper = min(upper, self.max)
+            if bucket and seen + bucket >= rank:
+                return lower + (upper - lower) * (rank - seen) / bucket
+            seen += bucket
+            lower = upper
+        return self.max
+
+
+class RouteStats:
+    __slots__ = ('histograms', 'n_plus_one', 'shapes')
+
+    def __init__(self):
+        self.histograms = [Histogram(buckets) for _, _, buckets in HISTOGRAMS]
+        self.n_plus_one = 0
+        # {shape: [requests flagged, most runs in one request]}
+        self.shapes = {}
+
+
+class MetricsRegistry:
+    """The histograms of this process, keyed by (route, method)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+            self.started = timezone.now()
+
+    def record(self, key, values, repeated=None):
+        new_shapes = []
+        with self._lock:
+            stats = self.routes.get(key)
+            if stats is None:
+                stats = self.routes[key] = RouteStats()
+            for histogram, value in zip(stats.histograms, values):
+                if value is not None:
+                    histogram.observe(value)
+            if not repeated:
+                return
+            stats.n_plus_one += 1
+            for shape, runs in repeated.items():
+                seen = stats.shapes.get(shape)
+                if seen is None:
+                    if len(stats.shapes) >= MAX_SHAPES_PER_ROUTE:
+                        continue
+                    seen = stats.shapes[shape] = [0, 0]
+                    new_shapes.append((shape, runs))
+                seen[0] += 1
+                seen[1] = max(seen[1], runs)
+        # Once per route and shape, so a hot endpoint does not flood the log.
+        for shape, runs in new_shapes:
+            logger.warning(f"Possible N+1 on {key[1]} {key[0]}: {runs} runs of {shape[:300]}")
+
+    def prometheus(self):
+        """The histograms in the Prometheus text exposition format"""
+        with self._lock:
+            routes = sorted(self.routes.items())
+            lines = []
+            for index, (name, help_text, buckets) in enumerate(HISTOGRAMS):
+                lines += [f'# HELP {PREFIX}{name} {help_text}',
+                          f'# TYPE {PREFIX}{name} histogram']
+                for (route, method), stats in routes:
+                    histogram = stats.histograms[index]
+                    labels = f'route="{_escape(route)}",method="{_escape(method)}"'
+                    for le, total in zip((*buckets, '+Inf'), histogram.cumulative()):
+                        lines.append(f'{PREFIX}{name}_bucket{{{labels},le="{le}"}} {total}')
+                    lines.append(f'{PREFIX}{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{PREFIX}{name}_count{{{labels}}} {total}')
+            lines += [f'# HELP {PREFIX}request_n_plus_one_total '
+                      f'Requests that repeated one query shape too often.',
+                      f'# TYPE {PREFIX}request_n_plus_one_total counter']
+            for (route, method), stats in routes:
+                lines.append(f'{PREFIX}request_n_plus_one_total'
+                             f'{{route="{_escape(route)}",method="{_escape(method)}"}} '
+                             f'{stats.n_plus_one}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Per-route figures for the staff summary, slowest in total first"""
+        def milliseconds(histogram):
+            if not histogram.count:
+                return None
+            return {
+                'mean': round(histogram.sum / histogram.count * 1000, 2),
+                'p50': round(histogram.quantile(0.5) * 1000, 2),
+                'p95': round(histogram.quantile(0.95) * 1000, 2),
+                'p99': round(histogram.quantile(0.99) * 1000, 2),
+                'max': round(histogram.max * 1000, 2),
+            }
+
+        with self._lock:
+            routes = []
+            for (route, method), stats in self.routes.items():
+                duration, queries, db, serialization, size = stats.histograms
+                routes.append({
+                    'route': route,
+                    'method': method,
+                    'requests': duration.count,
+                    'total_seconds': round(duration.sum, 3),
+                    'duration_ms': milliseconds(duration),
+                    'db_ms': milliseconds(db),
+                    'serialization_ms': milliseconds(serialization),
+                    'queries': {'mean': round(queries.sum / queries.count, 2),
+                                'p95': round(queries.quantile(0.95), 1),
+                                'max': queries.max},
+                    'response_bytes': {
+                        'mean': round(size.sum / size.count) if size.count else None,
+                        'max': size.max if size.count else None,
+                    },
+                    'n_plus_one': stats.n_plus_one,
+                    'repeated_queries': [
+                        {'sql': shape, 'requests': flagged, 'max_runs': runs}
+                        for shape, (flagged, runs) in sorted(
+                            stats.shapes.items(), key=lambda item: -item[1][0])
+                    ],
+                })
+            started = self.started
+        routes.sort(key=lambda route: -route['total_seconds'])
+        return {'since': started, 'routes': routes}
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class QueryStats:
+    __slots__ = ('queries', 'seconds', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0
+        self.statements = Counter()
+
+
+_current = contextvars.ContextVar('request_query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper timing the queries of the request being measured"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.seconds += time.perf_counter() - started
+        stats.queries += 1
+        stats.statements[sql] += 1
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        # First, so `with connection.execute_wrapper()` blocks, which pop
+        # the last wrapper, keep removing their own.
+        connection.execute_wrappers.insert(0, record_query)
+
+
+def repeated_shapes(statements, threshold):
+    if sum(statements.values()) < threshold:
+        return None
+    shapes = Counter()
+    for sql, runs in statements.items():
+        shapes[query_shape(sql)] += runs
+    return {shape: runs for shape, runs in shapes.items() if runs >= threshold}
+
+
+class RequestMetricsMiddleware:
+    """Records the metrics of every request; see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_setting('ENABLED'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = get_setting('N_PLUS_ONE_THRESHOLD')
+        for connection in connections.all(initialized_only=True):
+            install_query_wrapper(None, connection)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started, stats, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started, stats, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, response, started, stats)
+        return response
+
+    def start(self, request):
+        stats = QueryStats()
+        request._metrics = {'view_started': None, 'view_db_seconds': 0, 'rendered': None}
+        return time.perf_counter(), stats, _current.set(stats)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = _current.get()
+        request._metrics['view_started'] = time.perf_counter()
+        request._metrics['view_db_seconds'] = stats.seconds if stats else 0
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook; time the renderer too.
+        def rendered(response):
+            request._metrics['rendered'] = time.perf_counter()
+        response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, started, stats):
+        finished = time.perf_counter()
+        marks = request._metrics
+        serialization = None
+        if marks['view_started'] is not None:
+            view_finished = marks['rendered'] or finished
+            serialization = max(view_finished - marks['view_started']
+                                - (stats.seconds - marks['view_db_seconds']), 0)
+        size = None if response.streaming else len(response.content)
+
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'OTHER'
+        registry.record(
+            (route, method),
+            (finished - started, stats.queries, stats.seconds, serialization, size),
+            repeated_shapes(stats.statements, self.threshold),
+        )
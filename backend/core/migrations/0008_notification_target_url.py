@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_notification_extra_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='target_url',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
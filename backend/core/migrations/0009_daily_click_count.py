@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0008_notification_target_url'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyClickCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('day', models.DateField()),
+                ('clicks', models.PositiveIntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['day', 'content_type'], name='core_dailyc_day_8b5010_idx')],
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id', 'day'), name='unique_daily_click_count')],
+            },
+        ),
+    ]
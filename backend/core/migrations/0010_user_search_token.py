@@ -0,0 +1,51 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_search_tokens(apps, schema_editor):
+    # The tokenizer only reads plain field values, so historical users work.
+    from core.search import user_tokens
+
+    MyUser = apps.get_model('core', 'MyUser')
+    UserSearchToken = apps.get_model('core', 'UserSearchToken')
+
+    users = MyUser.objects.filter(is_active=True).only(
+        'id', 'username', 'first_name', 'last_name', 'email').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(users.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            return
+        UserSearchToken.objects.bulk_create(
+            (UserSearchToken(user_id=user.pk, token=token, weight=weight)
+             for user in batch
+             for token, weight in user_tokens(user).items()),
+            batch_size=5000
+        )
+        last_pk = batch[-1].pk
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_daily_click_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+                ('weight', models.PositiveSmallIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'weight', 'user'], name='core_userse_token_3d8b99_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'token'), name='unique_user_search_token')],
+            },
+        ),
+        migrations.RunPython(populate_search_tokens, migrations.RunPython.noop),
+    ]
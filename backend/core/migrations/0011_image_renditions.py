@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_user_search_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='myuser',
+            name='profile_image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
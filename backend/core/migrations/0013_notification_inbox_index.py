@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0012_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'is_read', '-created_at', '-id'], name='core_notifi_recipie_5b8dc0_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='core_notifi_recipie_aeffaf_idx',
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:11
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+
+def populate_stats(apps, schema_editor):
+    UserProfile = apps.get_model('core', 'UserProfile')
+    Blog = apps.get_model('content', 'Blog')
+    Post = apps.get_model('content', 'Post')
+    Comment = apps.get_model('content', 'Comment')
+
+    def total(model, fk_name, expression):
+        rows = (
+            model.objects.filter(**{fk_name: OuterRef('user_id')})
+            .order_by()
+            .values(fk_name)
+            .annotate(value=expression)
+            .values('value')
+        )
+        return Coalesce(Subquery(rows), 0)
+
+    UserProfile.objects.update(
+        post_count=total(Post, 'author', Count('id')),
+        blog_count=total(Blog, 'author', Count('id')),
+        comment_count=total(Comment, 'user', Count('id')),
+        rating_sum=(total(Post, 'author', Sum('rating_sum'))
+                    + total(Blog, 'author', Sum('rating_sum'))),
+        rating_count=(total(Post, 'author', Sum('rating_count'))
+                      + total(Blog, 'author', Sum('rating_count'))),
+    )
+    UserProfile.objects.update(rating=Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast('rating_sum', FloatField()) / F('rating_count'),
+        output_field=FloatField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_notification_counter'),
+        ('content', '0022_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='blog_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,7 @@
+from django.apps import apps
 from django.db import models
+from django.db.models.functions import Cast, Coalesce, Greatest
+from django.utils import timezone
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
@@ -14,6 +17,8 @@ class MyUser(AbstractUser):
         blank=True,
         default='profile_images/default.webp'
     )
+    profile_image_renditions = models.JSONField(
+        default=dict, blank=True, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
@@ -25,6 +30,60 @@ class MyUser(AbstractUser):
         return f"{obj.first_name} {obj.last_name}"
 
 
+class UserProfileManager(models.Manager):
+    def _refresh_rating(self, queryset):
+        return queryset.update(rating=models.Case(
+            models.When(rating_count=0, then=models.Value(0.0)),
+            default=Cast('rating_sum', models.FloatField()) / models.F('rating_count'),
+            output_field=models.FloatField(),
+        ))
+
+    def adjust_counters(self, user_id, **deltas):
+        """Apply F() deltas to a user's stored stats"""
+        if not user_id:
+            return
+        profiles = self.filter(user_id=user_id)
+        # Decrements stop at zero should a counter have drifted low.
+        profiles.update(**{
+            field: models.F(field) + delta if delta >= 0
+            else Greatest(models.F(field) + delta, 0)
+            for field, delta in deltas.items()})
+        # Separate statement: MySQL evaluates SET assignments left to right.
+        if 'rating_sum' in deltas or 'rating_count' in deltas:
+            self._refresh_rating(profiles)
+
+    def recalculate_counters(self, user_ids=None):
+        """Recompute the stored stats from the content tables"""
+        Blog = apps.get_model('content', 'Blog')
+        Post = apps.get_model('content', 'Post')
+        Comment = apps.get_model('content', 'Comment')
+
+        def total(model, fk_name, aggregate):
+            rows = (
+                model.objects.filter(**{fk_name: models.OuterRef('user_id')})
+                .order_by()
+                .values(fk_name)
+                .annotate(value=aggregate)
+                .values('value')
+            )
+            return Coalesce(models.Subquery(rows), 0)
+
+        profiles = self.all()
+        if user_ids is not None:
+            profiles = profiles.filter(user_id__in=user_ids)
+        updated = profiles.update(
+            post_count=total(Post, 'author', models.Count('id')),
+            blog_count=total(Blog, 'author', models.Count('id')),
+            comment_count=total(Comment, 'user', models.Count('id')),
+            rating_sum=(total(Post, 'author', models.Sum('rating_sum'))
+                        + total(Blog, 'author', models.Sum('rating_sum'))),
+            rating_count=(total(Post, 'author', models.Sum('rating_count'))
+                          + total(Blog, 'author', models.Sum('rating_count'))),
+        )
+        self._refresh_rating(profiles)
+        return updated
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -35,6 +94,14 @@ class UserProfile(models.Model):
     favorite_breeds = models.CharField(max_length=255, blank=True)
     joined = models.DateTimeField(auto_now_add=True)
     rating = models.FloatField(default=0.0)  # average from reviews
+    # Maintained by content signals; see UserProfileManager.
+    post_count = models.PositiveIntegerField(default=0, editable=False)
+    blog_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = UserProfileManager()
 
     def __str__(self):
         return f"{self.user.username}'s profile"
@@ -69,6 +136,7 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     extra_data = models.JSONField(default=dict, blank=True)
+    target_url = models.CharField(max_length=255, blank=True, default='')
 
     def __str__(self):
         return f'{self.get_notification_type_display()} for {self.recipient.username}'
@@ -76,7 +144,161 @@ class Notification(models.Model):
     class Meta:
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['recipient', 'is_read']),
+            # The inbox: a user's notifications, unread first, newest first.
+            models.Index(fields=['recipient', 'is_read', '-created_at', '-id']),
             models.Index(fields=['content_type', 'object_id']),
+            # Retention pruning walks expired rows of one type and state.
+            models.Index(fields=['notification_type', 'is_read', 'created_at']),
         ]
         verbose_name_plural = 'Notifications'
+
+
+class NotificationCounterManager(models.Manager):
+    def increment(self, recipient_id, notification_type, target):
+        """
+        Count one more event about `target` and return the counter. Only
+        concurrent events about the same target serialize, on this counter's
+        row lock, until the caller's transaction commits.
+        """
+        key = {
+            'recipient_id': recipient_id,
+            'notification_type': notification_type,
+            'content_type': ContentType.objects.get_for_model(target),
+            'object_id': target.pk,
+        }
+        self.bulk_create([self.model(**key)], ignore_conflicts=True)
+        self.filter(**key).update(count=models.F('count') + 1)
+        return self.get(**key)
+
+
+class NotificationCounter(models.Model):
+    """Events behind the current grouped notification of a recipient and target"""
+    recipient = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    target = GenericForeignKey('content_type', 'object_id')
+    notification = models.ForeignKey(
+        Notification, on_delete=models.SET_NULL, related_name='+', null=True, blank=True)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = NotificationCounterManager()
+
+    def __str__(self):
+        return f'{self.count} {self.notification_type} for {self.recipient_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'notification_type', 'content_type', 'object_id'],
+                name='unique_notification_counter'),
+        ]
+
+
+class ArchivedNotification(models.Model):
+    """
+    Notification moved out of the live table by `prune_notifications
+    --archive`. The inbox only reads the live table.
+    """
+    original_id = models.PositiveBigIntegerField(unique=True)
+    recipient = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    notification_type = models.CharField(
+        max_length=20, choices=Notification.NOTIFICATION_TYPES)
+    message = models.TextField(default='')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    extra_data = models.JSONField(default=dict, blank=True)
+    target_url = models.CharField(max_length=255, blank=True, default='')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Archived {self.get_notification_type_display()} for {self.recipient_id}'
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', '-created_at']),
+        ]
+
+
+class DailyClickCount(models.Model):
+    """Affiliate clicks on a product or service, per item and day"""
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    day = models.DateField()
+    clicks = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.clicks} clicks on {self.content_type.model} {self.object_id} ({self.day})'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['content_type', 'object_id', 'day'], name='unique_daily_click_count'),
+        ]
+        indexes = [
+            models.Index(fields=['day', 'content_type']),
+        ]
+
+
+class UserSearchToken(models.Model):
+    """Normalized word prefix of a user's name fields, for typeahead search"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=32)
+    weight = models.PositiveSmallIntegerField()
+
+    def __str__(self):
+        return f'{self.token} -> {self.user_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'token'], name='unique_user_search_token'),
+        ]
+        indexes = [
+            # Covers the search query: seek on token, read weight and user.
+            models.Index(fields=['token', 'weight', 'user']),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """
+    A side effect recorded in the same transaction as the write that caused
+    it, and carried out later by the `process_outbox` worker (or right after
+    commit with OUTBOX['EAGER']).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Earliest time a worker may (re)try the event.
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f'{self.topic} #{self.id} ({self.status})'
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
@@ -0,0 +1,117 @@
+"""
+Transactional outbox for write-path side effects.
+
+`enqueue()` stores an OutboxEvent in the caller's transaction, so the event
+exists exactly when the write that caused it commits. The `process_outbox`
+command claims due events in batches and runs the handler registered for
+their topic; each handler runs in the same transaction that marks its event
+done, so database side effects happen once even across retries.
+"""
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Run handlers in the request thread right after commit instead of in
+    # the process_outbox worker; they then hold their row locks there.
+    'EAGER': False,
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 8,
+    'RETRY_DELAY_SECONDS': 5,
+    # A claimed event becomes claimable again if its worker died.
+    'LEASE_SECONDS': 300,
+}
+
+_handlers = {}
+
+
+def outbox_setting(name):
+    return getattr(settings, 'OUTBOX', {}).get(name, DEFAULTS[name])
+
+
+class UnknownTopic(Exception):
+    pass
+
+
+def handler(topic):
+    """Register the function that carries out events of `topic`"""
+    def register(func):
+        _handlers[topic] = func
+        return func
+    return register
+
+
+def enqueue(topic, **payload):
+    event = OutboxEvent.objects.create(topic=topic, payload=payload)
+    if outbox_setting('EAGER'):
+        transaction.on_commit(lambda: process_event(event.id))
+    return event
+
+
+def claim_batch(batch_size=None):
+    """
+    Lease up to `batch_size` due events to this worker and return their ids.
+    Concurrent workers skip each other's locked rows instead of waiting.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutboxEvent.objects
+            .filter(status=OutboxEvent.STATUS_PENDING, available_at__lte=now)
+            .order_by('id')
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size or outbox_setting('BATCH_SIZE')]
+        )
+        OutboxEvent.objects.filter(id__in=ids).update(
+            available_at=now + timezone.timedelta(seconds=outbox_setting('LEASE_SECONDS')))
+    return ids
+
+
+def retry_delay(attempts):
+    """Exponential backoff: 5s, 10s, 20s, ... capped at one hour"""
+    return min(outbox_setting('RETRY_DELAY_SECONDS') * 2 ** (attempts - 1), 3600)
+
+
+def process_event(event_id):
+    """Run one event's handler; returns True once the event is done"""
+    try:
+        with transaction.atomic():
+            event = (OutboxEvent.objects.select_for_update()
+                     .filter(id=event_id, status=OutboxEvent.STATUS_PENDING).first())
+            if event is None:
+                return False
+            func = _handlers.get(event.topic)
+            if func is None:
+                raise UnknownTopic(event.topic)
+            func(**event.payload)
+            event.status = OutboxEvent.STATUS_DONE
+            event.attempts += 1
+            event.processed_at = timezone.now()
+            event.save(update_fields=['status', 'attempts', 'processed_at'])
+        return True
+    except Exception:
+        logger.exception(f"Outbox event {event_id} failed")
+        record_failure(event_id, traceback.format_exc())
+        return False
+
+
+def record_failure(event_id, error):
+    event = OutboxEvent.objects.filter(id=event_id).first()
+    if event is None:
+        return
+    event.attempts += 1
+    event.last_error = error[-4000:]
+    if event.attempts >= outbox_setting('MAX_ATTEMPTS'):
+        event.status = OutboxEvent.STATUS_FAILED
+    else:
+        event.available_at = timezone.now() + timezone.timedelta(
+            seconds=retry_delay(event.attempts))
+    event.save(update_fields=['attempts', 'last_error', 'status', 'available_at'])
@@ -0,0 +1,52 @@
+"""
+JSON rendering through orjson, byte-for-byte identical to DRF's renderer.
+
+orjson writes the same compact UTF-8 as `json.dumps` for everything except
+exponent-form floats (`1e+16` vs `1e16`, `1e-05` vs `0.00001`). Payloads
+that may contain one of those, or a value orjson cannot encode, are
+rendered again by DRF's renderer. The one difference left: NaN and
+infinities come out as null where DRF's strict mode raises. Requires the
+optional `orjson` package; without it the renderer simply is DRF's.
+"""
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# A digit followed by an exponent, or a small float orjson writes in full.
+# Also matches inside strings, which only costs a fallback render.
+_DIVERGENT_FLOAT = re.compile(rb'\d[eE]|0\.0000')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Compact application/json; indented output is left to DRF"""
+
+    def can_render_fast(self, accepted_media_type, renderer_context):
+        return (orjson is not None
+                and self.compact and self.strict and not self.ensure_ascii
+                and self.get_indent(accepted_media_type, renderer_context) is None)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if not self.can_render_fast(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except (orjson.JSONEncodeError, TypeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if _DIVERGENT_FLOAT.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escapes as JSONRenderer; JavaScript rejects them raw.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
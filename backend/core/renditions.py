@@ -0,0 +1,234 @@
+"""
+Resized WebP/JPEG variants of uploaded images.
+
+Variants are written next to the original (`dog.jpg` -> `dog.thumb.webp`,
+`dog.thumb.jpg`, ...) and recorded on the owning row in a
+`<field>_renditions` JSON column together with the source file name. The
+column only counts while its source matches the current file, so readers
+serve the original until the variants of a new upload exist.
+"""
+import io
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import bump_version
+from .cards import bump_profile_version
+
+
+logger = logging.getLogger(__name__)
+
+# name: (max width, max height, crop to fill). Images are never upscaled.
+RENDITIONS = {
+    'thumb': (160, 160, True),
+    'card': (640, 640, False),
+    'full': (1600, 1600, False),
+}
+# format key: (Pillow format, file extension, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+# Models whose images get renditions: label -> image field name.
+IMAGE_FIELDS = {
+    'content.Blog': 'image',
+    'content.Post': 'image',
+    'marketplace.Product': 'image',
+    'services.Service': 'image',
+    'core.MyUser': 'profile_image',
+}
+
+
+def renditions_field(field_name):
+    return f'{field_name}_renditions'
+
+
+def rendition_name(source, rendition, extension):
+    stem, _ = posixpath.splitext(source)
+    return f'{stem}.{rendition}.{extension}'
+
+
+def target_size(width, height, rendition):
+    max_width, max_height, crop = RENDITIONS[rendition]
+    if crop:
+        scale = min(1.0, max(max_width / width, max_height / height))
+        return (min(max_width, round(width * scale)),
+                min(max_height, round(height * scale)))
+    scale = min(1.0, max_width / width, max_height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _resize(image, rendition):
+    size = target_size(image.width, image.height, rendition)
+    if RENDITIONS[rendition][2]:
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    if size == image.size:
+        return image
+    return image.resize(size, Image.LANCZOS)
+
+
+def _encode(image, image_format, options):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_image(source, force=False, storage=None):
+    """
+    Write every variant of the stored image `source` that does not exist
+    yet (or all of them with `force`) and return the renditions record.
+    Touches storage only, never the database, so it can run in any worker.
+    """
+    storage = storage or default_storage
+    names = {
+        (rendition, key): rendition_name(source, rendition, extension)
+        for rendition in RENDITIONS
+        for key, (_, extension, _) in FORMATS.items()
+    }
+    missing = names if force else {
+        variant: name for variant, name in names.items()
+        if not storage.exists(name)
+    }
+
+    with storage.open(source, 'rb') as file:
+        image = Image.open(file)
+        if missing:
+            image = ImageOps.exif_transpose(image)
+            image.load()
+        # Header only when nothing needs rendering; EXIF rotation swaps sides.
+        width, height = image.size
+        if not missing and (image.getexif().get(0x0112) or 1) >= 5:
+            width, height = height, width
+
+        record = {'source': source}
+        for rendition in RENDITIONS:
+            resized = None
+            for key, (image_format, _, options) in FORMATS.items():
+                name = names[(rendition, key)]
+                if (rendition, key) in missing:
+                    if resized is None:
+                        resized = _resize(image, rendition)
+                    if storage.exists(name):
+                        storage.delete(name)
+                    saved = storage.save(name, ContentFile(
+                        _encode(resized, image_format, options)))
+                    name = saved
+                record.setdefault(rendition, {})[key] = name
+            record[rendition]['width'], record[rendition]['height'] = (
+                target_size(width, height, rendition))
+    return record
+
+
+def record_renditions(model, field_name, source, record, pk=None):
+    """Store `record` on rows whose image is still `source`"""
+    rows = model.objects.filter(**{field_name: source})
+    if pk is not None:
+        rows = rows.filter(pk=pk)
+    updated = rows.update(**{renditions_field(field_name): record})
+    if updated:
+        # Cached API responses and user cards embed the image URLs.
+        bump_version(model._meta.label_lower)
+        if pk is not None and model is get_user_model():
+            bump_profile_version(pk)
+    return updated
+
+
+def current_renditions(image, record):
+    """The stored record when it belongs to `image`'s current file, else None"""
+    if image and record and record.get('source') == image.name:
+        return record
+    return None
+
+
+def rendition_urls(image, record):
+    """
+    srcset-style URLs per rendition and format. Every entry points at the
+    original file until the renditions of the current upload exist.
+    """
+    if not image:
+        return None
+    record = current_renditions(image, record)
+    if record is None:
+        return {
+            'ready': False,
+            **{rendition: {key: image.url for key in FORMATS}
+               for rendition in RENDITIONS},
+        }
+    return {
+        'ready': True,
+        **{rendition: {
+            **{key: image.storage.url(record[rendition][key]) for key in FORMATS},
+            'width': record[rendition]['width'],
+            'height': record[rendition]['height'],
+        } for rendition in RENDITIONS},
+    }
+
+
+def thumbnail_url(image, record):
+    """URL of the JPEG thumbnail, or of the original until it exists"""
+    record = current_renditions(image, record)
+    if record is None:
+        return image.url
+    return image.storage.url(record['thumb']['jpeg'])
+
+
+def rendition_setting(name, default):
+    return getattr(settings, 'IMAGE_RENDITIONS', {}).get(name, default)
+
+
+@lru_cache(maxsize=None)
+def get_executor():
+    return ThreadPoolExecutor(
+        max_workers=rendition_setting('WORKERS', 2),
+        thread_name_prefix='renditions')
+
+
+def generate_renditions(model_label, pk, field_name, source):
+    model = apps.get_model(model_label)
+    try:
+        record = render_image(source)
+        record_renditions(model, field_name, source, record, pk=pk)
+    except Exception:
+        logger.exception(f"Failed to render {source} for {model_label} {pk}")
+
+
+def _generate_in_pool(*args):
+    try:
+        generate_renditions(*args)
+    finally:
+        # Pool threads outlive the task; do not leak their connections.
+        connections.close_all()
+
+
+def schedule_renditions(instance, field_name):
+    """Render the variants of a newly saved image once the save commits"""
+    image = getattr(instance, field_name)
+    record = getattr(instance, renditions_field(field_name))
+    if not image or current_renditions(image, record) is not None:
+        return
+
+    args = (instance._meta.label, instance.pk, field_name, image.name)
+    if rendition_setting('WORKERS', 2):
+        transaction.on_commit(lambda: get_executor().submit(_generate_in_pool, *args))
+    else:
+        transaction.on_commit(lambda: generate_renditions(*args))
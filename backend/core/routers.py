@@ -0,0 +1,146 @@
+"""
+Read-replica routing with read-your-writes stickiness.
+
+Views with ReplicaReadMixin serve GET, HEAD and OPTIONS from a random
+replica listed in READ_REPLICAS['ALIASES']. Everything else stays on the
+primary (`default`): writes, `select_for_update()` and other querysets
+built for writing, reads once the request has written, and every view
+without the mixin.
+
+A user whose request wrote anything is pinned to the primary for
+`STICKY_SECONDS`, so the comment or message they just sent is there when
+they reload, however far the replicas lag. Pins live in the cache; with
+several workers CACHE_BACKEND has to be shared between them.
+
+ReadYourWritesMiddleware scopes the routing to one request and records
+the pins. Without replicas it removes itself and all reads go to the
+primary.
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import CachedResponseMixin
+
+
+DEFAULTS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+}
+PIN_KEY = 'primary-pin:{}'
+
+
+def get_setting(name):
+    return getattr(settings, 'READ_REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def pin_to_primary(user):
+    """Send `user`'s replica reads to the primary for STICKY_SECONDS"""
+    cache.set(PIN_KEY.format(user.pk), 1, get_setting('STICKY_SECONDS'))
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(PIN_KEY.format(user.pk)) is not None
+
+
+class RoutingState:
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+_current = contextvars.ContextVar('database_routing', default=None)
+
+
+class ReplicaRouter:
+    """Reads go where the current request allows; writes go to the primary"""
+
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or state.replica is None or state.wrote:
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows, so objects read from any of them
+        # can be related to each other.
+        databases = {DEFAULT_DB_ALIAS, *get_setting('ALIASES')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaReadMixin:
+    """
+    For ViewSets: serves safe methods from a replica unless the user is
+    pinned to the primary. Anonymous requests to views caching their
+    responses stay on the primary, so a lagging replica never fills the
+    cache under a version that is already newer than its data.
+    """
+
+    def use_replica(self, request):
+        if request.method not in SAFE_METHODS or is_pinned(request.user):
+            return False
+        return request.user.is_authenticated or not isinstance(self, CachedResponseMixin)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        state = _current.get()
+        aliases = get_setting('ALIASES')
+        if state is not None and aliases and self.use_replica(request):
+            state.replica = random.choice(aliases)
+
+
+class ReadYourWritesMiddleware:
+    """Scopes replica routing to the request and pins users who wrote"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_setting('ALIASES'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _current.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _current.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.finish(request, state)
+        return response
+
+    def finish(self, request, state):
+        user = getattr(request, 'user', None)
+        if state.wrote and user is not None and user.is_authenticated:
+            pin_to_primary(user)
@@ -0,0 +1,160 @@
+"""
+Prefix index behind the user typeahead.
+
+Every word of a user's username, first/last name and email local part is
+stored as its normalized prefixes (3 characters and up), so a keystroke is
+an index seek on `token` instead of four `icontains` scans of the user
+table. Each token keeps the best weight it earned for that user: whole
+words outrank prefixes and usernames outrank names and emails.
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import MyUser, UserSearchToken
+
+
+WORD_RE = re.compile(r'[^\W_]+', re.UNICODE)
+MIN_PREFIX_LENGTH = 3
+MAX_TOKEN_LENGTH = 32
+MAX_QUERY_WORDS = 4
+# User fields read by the user index and by the author terms of content search.
+SEARCHABLE_USER_FIELDS = frozenset({'username', 'first_name', 'last_name', 'email', 'is_active'})
+
+USERNAME_WEIGHT = 30
+NAME_WEIGHT = 20
+EMAIL_WEIGHT = 10
+# Added when the token is a whole word rather than a prefix of one.
+COMPLETE_WORD_BONUS = 50
+# Added once per user the searcher already has a conversation with.
+MESSAGED_BOOST = 25
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def words(text):
+    return [word[:MAX_TOKEN_LENGTH] for word in WORD_RE.findall(normalize(text))]
+
+
+def user_tokens(user):
+    """{token: weight} for an active user"""
+    username_words = words(user.username)
+    fields = [
+        (username_words, USERNAME_WEIGHT),
+        # "john_doe" is also found by typing "johndoe".
+        ([''.join(username_words)[:MAX_TOKEN_LENGTH]] if len(username_words) > 1 else [],
+         USERNAME_WEIGHT),
+        (words(user.first_name), NAME_WEIGHT),
+        (words(user.last_name), NAME_WEIGHT),
+        (words(user.email.partition('@')[0]), EMAIL_WEIGHT),
+    ]
+    tokens = {}
+    for field_words, weight in fields:
+        for word in field_words:
+            if len(word) >= MIN_PREFIX_LENGTH:
+                tokens[word] = max(tokens.get(word, 0), weight + COMPLETE_WORD_BONUS)
+            for length in range(MIN_PREFIX_LENGTH, len(word)):
+                prefix = word[:length]
+                tokens[prefix] = max(tokens.get(prefix, 0), weight)
+    return tokens
+
+
+def index_user(user):
+    """(Re)build the tokens of a single user; inactive users are unlisted"""
+    tokens = user_tokens(user) if user.is_active else {}
+    with transaction.atomic():
+        UserSearchToken.objects.filter(user=user).delete()
+        UserSearchToken.objects.bulk_create(
+            UserSearchToken(user=user, token=token, weight=weight)
+            for token, weight in tokens.items()
+        )
+
+
+def index_users(queryset, batch_size=1000):
+    """Bulk (re)index a user queryset; returns the number of users indexed"""
+    queryset = queryset.filter(is_active=True).only(
+        'id', 'username', 'first_name', 'last_name', 'email').order_by('pk')
+    indexed = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return indexed
+        with transaction.atomic():
+            UserSearchToken.objects.filter(user__in=batch).delete()
+            UserSearchToken.objects.bulk_create(
+                (UserSearchToken(user=user, token=token, weight=weight)
+                 for user in batch
+                 for token, weight in user_tokens(user).items()),
+                batch_size=5000
+            )
+        indexed += len(batch)
+        last_pk = batch[-1].pk
+
+
+def search_terms(query):
+    """Distinct query words usable against the index, in typed order"""
+    query = query.partition('@')[0] if '@' in query else query
+    terms = []
+    for word in words(query):
+        # Shorter words are neither indexed nor stored as prefixes.
+        if len(word) >= MIN_PREFIX_LENGTH and word not in terms:
+            terms.append(word)
+    return terms[:MAX_QUERY_WORDS]
+
+
+def _matching_users(terms, searcher, limit, user_ids=None):
+    """[(user_id, weight)] of users matching every term, heaviest first"""
+    tokens = UserSearchToken.objects.filter(
+        token__in=terms).exclude(user_id=searcher.pk)
+    if user_ids is not None:
+        tokens = tokens.filter(user_id__in=user_ids)
+    if len(terms) == 1:
+        # Read straight off the (token, weight, user) index, no grouping.
+        rows = tokens.order_by('-weight', '-user_id').values_list('user_id', 'weight')
+    else:
+        rows = (
+            tokens.values('user_id')
+            .annotate(matched=Count('id'), total=Sum('weight'))
+            .filter(matched=len(terms))
+            .order_by('-total', '-user_id')
+            .values_list('user_id', 'total')
+        )
+    return list(rows[:limit])
+
+
+def rank_users(query, searcher, limit=20):
+    """
+    Active users matching every word of `query` as a whole word or prefix,
+    best first: exact words before prefixes, usernames before names, and
+    people `searcher` has a conversation with ahead of strangers.
+    """
+    # Imported here: messaging depends on core, not the other way round.
+    from messaging.models import Conversation
+
+    terms = search_terms(query)
+    exact_email = []
+    if '@' in query:
+        exact_email = list(MyUser.objects.filter(
+            email__iexact=query, is_active=True).exclude(pk=searcher.pk)[:1])
+    if not terms:
+        return exact_email
+
+    # Boosted users only come from the searcher's own conversations, so the
+    # overall top `limit` is within the unboosted top `limit` plus those.
+    scores = dict(_matching_users(terms, searcher, limit))
+    partners = Conversation.objects.filter(
+        owner_id=searcher.pk).values('other_user_id')
+    for user_id, weight in _matching_users(terms, searcher, limit, partners):
+        scores[user_id] = weight + MESSAGED_BOOST
+
+    ids = sorted(scores, key=lambda pk: (-scores[pk], -pk))[:limit]
+    users = MyUser.objects.in_bulk(ids)
+    ranked = exact_email + [users[pk] for pk in ids
+                            if pk in users and users[pk] not in exact_email]
+    return ranked[:limit]
@@ -0,0 +1,442 @@
+"""
+Synthetic, referentially consistent datasets for benchmarks and load tests.
+
+Primary keys are assigned up front and the rows of each chunk of a table
+come from a generator seeded with the dataset's seed, the table and the
+chunk. A table therefore comes out the same whether it is written in one
+go, by several processes or to CSV files. Rows go in as multi-row
+INSERTs: bulk_create would still build a model per row and run
+AutoSlugField's uniqueness query for every product and service. Slugs
+embed the row's id instead.
+
+Signals are skipped. Profiles are generated with their users, and
+`finish_dataset` rebuilds the rest of what the signals maintain.
+"""
+import csv
+import os
+import random
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+import django
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import slugify
+from faker import Faker
+
+from content.models import Blog, Comment, Post, Rating, Tag
+from content.search import index_queryset
+from marketplace.models import Category, Product
+from messaging.models import Conversation, Message
+from services.models import Service
+
+from .models import MyUser, Notification, UserProfile
+from .search import index_users
+
+
+# Rows at scale 1; `dataset_counts` multiplies them.
+DEFAULT_COUNTS = {
+    'users': 200,
+    'posts': 2000,
+    'blogs': 500,
+    'comments': 5000,
+    'ratings': 5000,
+    'messages': 5000,
+    'notifications': 5000,
+    'products': 1000,
+    'services': 300,
+}
+TAGS = 30
+CATEGORIES = 10
+# Users exchange messages with the users this many ids away either side.
+CONTACT_STRIDES = (1, 7, 31, 127)
+# Rows generated per chunk; also what the randomness is seeded per, so
+# changing it changes the data.
+CHUNK_SIZE = 20000
+INSERT_BATCH_SIZE = 2000
+POOL_SIZE = 500
+SPAN = timedelta(days=365)
+
+
+def dataset_counts(scale=1.0, **overrides):
+    counts = {name: max(int(count * scale), 1) for name, count in DEFAULT_COUNTS.items()}
+    counts.update({name: count for name, count in overrides.items() if count is not None})
+    counts['users'] = max(counts['users'], 3)  # so every user has contacts
+    return counts
+
+
+class Dataset:
+    """The counts, first primary keys and text pools of one dataset"""
+
+    def __init__(self, counts, seed=0, first_ids=None):
+        self.counts = counts
+        self.seed = seed
+        self.first_ids = first_ids or next_ids()
+        end = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.end = timezone.make_naive(end, connection.timezone)
+
+        fake = Faker()
+        fake.seed_instance(seed)
+
+        def pool(make):
+            return [make() for _ in range(POOL_SIZE)]
+
+        self.first_names = pool(fake.first_name)
+        self.last_names = pool(fake.last_name)
+        self.cities = pool(fake.city)
+        self.words = pool(fake.word)
+        self.titles = pool(lambda: fake.sentence(nb_words=7)[:200])
+        self.sentences = pool(lambda: fake.sentence(nb_words=12))
+        self.paragraphs = pool(lambda: fake.paragraph(nb_sentences=4)[:1000])
+        self.articles = [('\n\n'.join(fake.paragraphs(nb=5))) for _ in range(50)]
+        self.urls = pool(fake.url)
+        self.phrases = pool(lambda: fake.catch_phrase()[:200])
+        self.companies = pool(fake.company)
+        self.emails = pool(fake.company_email)
+
+        users = counts['users']
+        self.strides = [k for k in CONTACT_STRIDES if k < users / 2] or [1]
+        self.post_type_id = ContentType.objects.get_for_model(Post).pk
+
+    def pk(self, table, index):
+        return self.first_ids[table] + index
+
+    def pks(self, table):
+        first = self.first_ids[table]
+        return range(first, first + self.counts[table])
+
+    def timestamp(self, fraction):
+        """When, as a fraction of the past year, formatted for the database"""
+        return str(self.end - SPAN * (1 - fraction))
+
+    def conversation(self, index):
+        """The user pks of the index-th pair of contacts"""
+        user, stride = divmod(index, len(self.strides))
+        other = (user + self.strides[stride]) % self.counts['users']
+        return self.pk('users', user), self.pk('users', other)
+
+    def contacts(self, user_pk):
+        user, users = user_pk - self.first_ids['users'], self.counts['users']
+        return sorted({self.pk('users', (user + sign * stride) % users)
+                       for stride in self.strides for sign in (1, -1)})
+
+
+def next_ids():
+    """The first free primary key of every table with generated ids"""
+    return {
+        table.name: (table.model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        for table in TABLES if 'id' in table.columns
+    }
+
+
+def user_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        pk = ds.pk('users', i)
+        first_name, last_name = rng.choice(ds.first_names), rng.choice(ds.last_names)
+        username = re.sub(r'[^a-z0-9.]', '', f'{first_name}.{last_name}'.lower()) + str(pk)
+        yield (pk, '!', username, f'{username}@example.com', first_name, last_name,
+               rng.choice(ds.cities), ds.timestamp(rng.random()))
+
+
+def profile_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        yield (ds.pk('profiles', i), ds.pk('users', i), rng.choice(ds.sentences),
+               rng.choice(ds.cities), ds.timestamp(rng.random()))
+
+
+def tag_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        pk = ds.pk('tags', i)
+        yield pk, f'{rng.choice(ds.words)}-{pk}'
+
+
+def author(ds, rng):
+    # Skewed, so a few authors write most of the content.
+    return ds.pk('users', int(ds.counts['users'] * rng.random() ** 2))
+
+
+def post_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        yield (ds.pk('posts', i), author(ds, rng), rng.choice(ds.titles),
+               rng.choice(ds.paragraphs), rng.choice(ds.urls) if rng.random() < 0.2 else None,
+               ds.timestamp((i + rng.random()) / ds.counts['posts']))
+
+
+def blog_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        created = ds.timestamp((i + rng.random()) / ds.counts['blogs'])
+        yield (ds.pk('blogs', i), author(ds, rng), rng.choice(ds.titles),
+               rng.choice(ds.articles), created, created)
+
+
+def tagging_rows(table):
+    def rows(ds, rng, start, stop):
+        for i in range(start, stop):
+            for tag in rng.sample(range(TAGS), rng.randint(0, 3)):
+                yield ds.pk(table, i), ds.pk('tags', tag)
+    return rows
+
+
+def target(ds, rng):
+    # Posts draw most of the activity, as they do in production.
+    if rng.random() < 0.8:
+        return ds.pk('posts', rng.randrange(ds.counts['posts'])), None
+    return None, ds.pk('blogs', rng.randrange(ds.counts['blogs']))
+
+
+def comment_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        created = ds.timestamp((i + rng.random()) / ds.counts['comments'])
+        yield (ds.pk('comments', i), ds.pk('users', rng.randrange(ds.counts['users'])),
+               *target(ds, rng), rng.choice(ds.sentences), created, created)
+
+
+def rating_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        yield (ds.pk('ratings', i), ds.pk('users', rng.randrange(ds.counts['users'])),
+               *target(ds, rng), rng.randint(1, 5))
+
+
+def message_rows(ds, rng, start, stop):
+    pairs = ds.counts['users'] * len(ds.strides)
+    count = ds.counts['messages']
+    for i in range(start, stop):
+        sender, receiver = ds.conversation(int(pairs * rng.random() ** 2))
+        if rng.random() < 0.5:
+            sender, receiver = receiver, sender
+        # Ids follow send time, and only recent messages are still unread.
+        fraction = (i + rng.random()) / count
+        is_read = fraction < 0.98 or rng.random() < 0.5
+        yield (ds.pk('messages', i), sender, receiver, rng.choice(ds.sentences),
+               int(is_read), ds.timestamp(fraction))
+
+
+def notification_rows(ds, rng, start, stop):
+    types = (Notification.NOTIFICATION_TYPE_NEW_COMMENT,
+             Notification.NOTIFICATION_TYPE_RATING_GIVEN)
+    for i in range(start, stop):
+        post = ds.pk('posts', rng.randrange(ds.counts['posts']))
+        fraction = (i + rng.random()) / ds.counts['notifications']
+        yield (ds.pk('notifications', i), ds.pk('users', rng.randrange(ds.counts['users'])),
+               rng.choice(types), rng.choice(ds.sentences), ds.post_type_id, post,
+               int(fraction < 0.9 or rng.random() < 0.3), ds.timestamp(fraction),
+               # What get_target_url() gives for a post.
+               f'/post/{post}#ratings')
+
+
+def category_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        pk, name = ds.pk('categories', i), rng.choice(ds.words).title()
+        yield pk, name, f'{slugify(name)}-{pk}'
+
+
+def product_rows(ds, rng, start, stop):
+    for i in range(start, stop):
+        pk = ds.pk('products', i)
+        title = f'{rng.choice(ds.phrases)} {pk}'
+        created = ds.timestamp(rng.random())
+        yield (pk, title, slugify(title), rng.choice(ds.paragraphs),
+               Decimal(rng.randint(199, 49999)) / 100, rng.choice(ds.urls),
+               ds.pk('categories', rng.randrange(CATEGORIES)), created, created)
+
+
+def service_rows(ds, rng, start, stop):
+    types = [value for value, _ in Service.SERVICE_TYPES]
+    for i in range(start, stop):
+        pk, name = ds.pk('services', i), rng.choice(ds.companies)
+        created = ds.timestamp(rng.random())
+        yield (pk, name, f'{slugify(name)}-{pk}', rng.choice(types),
+               rng.choice(ds.paragraphs), rng.choice(ds.emails), rng.choice(ds.cities),
+               created, created)
+
+
+class Table:
+    """
+    How to generate one table: `rows(dataset, rng, start, stop)` yields
+    tuples of `columns` for units start to stop of `count`, a key of the
+    dataset's counts or a fixed number. Other columns get the model's
+    defaults.
+    """
+
+    def __init__(self, name, model, columns, rows, count=None):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.rows = rows
+        self.count = count or name
+
+    def units(self, dataset):
+        return self.count if isinstance(self.count, int) else dataset.counts[self.count]
+
+    def chunks(self, dataset):
+        return range((self.units(dataset) + CHUNK_SIZE - 1) // CHUNK_SIZE)
+
+    def chunk_rows(self, dataset, chunk):
+        rng = random.Random(f'{dataset.seed}:{self.name}:{chunk}')
+        start = chunk * CHUNK_SIZE
+        return self.rows(dataset, rng, start, min(start + CHUNK_SIZE, self.units(dataset)))
+
+    def insert_columns(self):
+        """All columns written, and the values of those left to defaults"""
+        defaults = [field for field in self.model._meta.concrete_fields
+                    if not field.primary_key and field.column not in self.columns]
+        values = []
+        for field in defaults:
+            value = field.get_db_prep_save(field.get_default(), connection)
+            values.append(int(value) if isinstance(value, bool) else value)
+        return [*self.columns, *(field.column for field in defaults)], tuple(values)
+
+
+TABLES = [
+    Table('users', MyUser, ('id', 'password', 'username', 'email', 'first_name',
+                            'last_name', 'location', 'date_joined'), user_rows),
+    Table('profiles', UserProfile, ('id', 'user_id', 'bio', 'location', 'joined'),
+          profile_rows, count='users'),
+    Table('tags', Tag, ('id', 'name'), tag_rows, count=TAGS),
+    Table('posts', Post, ('id', 'author_id', 'title', 'caption', 'youtube_url',
+                          'created_at'), post_rows),
+    Table('post_tags', Post.tags.through, ('post_id', 'tag_id'),
+          tagging_rows('posts'), count='posts'),
+    Table('blogs', Blog, ('id', 'author_id', 'title', 'content', 'created', 'updated'),
+          blog_rows),
+    Table('blog_tags', Blog.tags.through, ('blog_id', 'tag_id'),
+          tagging_rows('blogs'), count='blogs'),
+    Table('comments', Comment, ('id', 'user_id', 'post_id', 'blog_id', 'content',
+                                'created', 'updated'), comment_rows),
+    Table('ratings', Rating, ('id', 'user_id', 'post_id', 'blog_id', 'score'), rating_rows),
+    Table('messages', Message, ('id', 'sender_id', 'receiver_id', 'content', 'is_read',
+                                'sent_at'), message_rows),
+    Table('notifications', Notification, (
+        'id', 'recipient_id', 'notification_type', 'message', 'content_type_id',
+        'object_id', 'is_read', 'created_at', 'target_url'), notification_rows),
+    Table('categories', Category, ('id', 'name', 'slug'), category_rows, count=CATEGORIES),
+    Table('products', Product, ('id', 'title', 'slug', 'description', 'price',
+                                'affiliate_url', 'category_id', 'created_at',
+                                'updated_at'), product_rows),
+    Table('services', Service, ('id', 'name', 'slug', 'service_type', 'description',
+                                'contact_email', 'city', 'created_at', 'updated_at'),
+          service_rows),
+]
+TABLES_BY_NAME = {table.name: table for table in TABLES}
+
+
+def insert_chunk(table, dataset, chunk, batch_size=INSERT_BATCH_SIZE):
+    columns, defaults = table.insert_columns()
+    quote = connection.ops.quote_name
+    sql = (f'INSERT INTO {quote(table.model._meta.db_table)} '
+           f'({", ".join(map(quote, columns))}) VALUES ({", ".join(["%s"] * len(columns))})')
+    written = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        batch = []
+        for row in table.chunk_rows(dataset, chunk):
+            batch.append(row + defaults)
+            if len(batch) == batch_size:
+                cursor.executemany(sql, batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            written += len(batch)
+    return written
+
+
+def csv_chunk(table, dataset, chunk, directory):
+    """Write a chunk as CSV for LOAD DATA INFILE; NULL is the bare word NULL"""
+    columns, defaults = table.insert_columns()
+    path = os.path.join(directory, f'{table.model._meta.db_table}.{chunk:05d}.csv')
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        for row in table.chunk_rows(dataset, chunk):
+            writer.writerow(['NULL' if value is None else value for value in row + defaults])
+            written += 1
+    return written
+
+
+def load_data_statement(table, path):
+    """The MySQL statement loading a csv_chunk() file, whatever the current backend"""
+    columns, _ = table.insert_columns()
+
+    def quote(name):
+        return f'`{name}`'
+
+    return (f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {quote(table.model._meta.db_table)} "
+            f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            f"ESCAPED BY '' LINES TERMINATED BY '\\n' ({', '.join(map(quote, columns))});")
+
+
+_worker_dataset = None
+
+
+def _start_worker(dataset):
+    global _worker_dataset
+    if not apps.ready:  # spawned rather than forked
+        django.setup()
+    _worker_dataset = dataset
+
+
+def _write_chunk(name, chunk, directory, batch_size):
+    table = TABLES_BY_NAME[name]
+    if directory:
+        return csv_chunk(table, _worker_dataset, chunk, directory)
+    return insert_chunk(table, _worker_dataset, chunk, batch_size)
+
+
+def generate(dataset, workers=1, directory=None, batch_size=INSERT_BATCH_SIZE, progress=None):
+    """
+    Write every table, into the database or as CSV files in `directory`,
+    spreading each table's chunks over `workers` processes. Tables are
+    written one after another so foreign keys always point at rows that
+    exist. Calls progress(table, rows) after each table.
+    """
+    executor = None
+    if workers > 1:
+        connections.close_all()  # children open their own
+        executor = ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(dataset,))
+    else:
+        _start_worker(dataset)
+    try:
+        for table in TABLES:
+            chunks = list(table.chunks(dataset))
+            args = ([table.name] * len(chunks), chunks, [directory] * len(chunks),
+                    [batch_size] * len(chunks))
+            written = sum(executor.map(_write_chunk, *args) if executor
+                          else map(_write_chunk, *args))
+            if progress:
+                progress(table, written)
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def finish_dataset(dataset, batch_size=1000):
+    """Rebuild what signals maintain: search indexes, counters and conversations"""
+    users = dataset.pks('users')
+    index_users(MyUser.objects.filter(pk__range=(users[0], users[-1])), batch_size=batch_size)
+    for name, model in (('blogs', Blog), ('posts', Post)):
+        pks = dataset.pks(name)
+        if pks:
+            index_queryset(model.objects.filter(pk__range=(pks[0], pks[-1])),
+                           batch_size=batch_size)
+    call_command('reconcile_content_counters', batch_size=batch_size, stdout=StringIO())
+    Conversation.objects.rebuild(batch_size=batch_size)
+
+
+def seed_dataset(counts, seed=0):
+    """
+    Create a dataset in the database and return {name: [pk, ...]} of the
+    rows created, plus 'contacts': {user pk: [pks of their contacts]}.
+    """
+    dataset = Dataset(counts, seed)
+    generate(dataset)
+    finish_dataset(dataset)
+    created = {name: list(dataset.pks(name)) for name in counts}
+    created['contacts'] = {pk: dataset.contacts(pk) for pk in created['users']}
+    return created
@@ -1,10 +1,35 @@
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer, UserSerializer as BaseUserSerializer
 from .models import MyUser, Notification
-from marketplace.models import Product
-from services.models import Service
-from messaging.models import Message
-from content.models import Blog, Post
+from .utils import resolve_target_urls
+from .cards import UserCardMixin
+from .renditions import FORMATS, RENDITIONS, rendition_urls, renditions_field
+
+
+class ImageRenditionsField(serializers.Field):
+    """srcset-style URLs of an image's renditions, falling back to the original"""
+
+    def __init__(self, image_field='image', **kwargs):
+        self.image_field = image_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return self.represent(
+            getattr(instance, self.image_field),
+            getattr(instance, renditions_field(self.image_field)),
+            self.context.get('request'))
+
+    @staticmethod
+    def represent(image, record, request=None):
+        urls = rendition_urls(image, record)
+        if urls and request:
+            for rendition in RENDITIONS:
+                for key in FORMATS:
+                    urls[rendition][key] = request.build_absolute_uri(
+                        urls[rendition][key])
+        return urls
 
 
 class UserCreateSerializer(BaseUserCreateSerializer):
@@ -15,10 +40,12 @@ class UserCreateSerializer(BaseUserCreateSerializer):
 
 class UserSerializer(BaseUserSerializer):
     # profile_image = serializers.SerializerMethodField()
+    profile_image_renditions = ImageRenditionsField(image_field='profile_image')
 
     class Meta(BaseUserSerializer.Meta):
         fields = ['id', 'username', 'email', 'first_name',
-                  'last_name', 'location', 'date_joined', 'is_active', 'is_staff', 'profile_image']
+                  'last_name', 'location', 'date_joined', 'is_active', 'is_staff', 'profile_image',
+                  'profile_image_renditions']
 
     def get_profile_image(self, obj):
         request = self.context.get("request")
@@ -34,14 +61,16 @@ class UserSerializer(BaseUserSerializer):
         return default_image
 
 
-class PublicUserSerializer(serializers.ModelSerializer):
+class PublicUserSerializer(UserCardMixin, serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     profile_image = serializers.SerializerMethodField()
+    profile_image_renditions = ImageRenditionsField(image_field='profile_image')
 
     class Meta:
         model = MyUser
         fields = ['id', 'username', 'email', 'full_name',
-                  'location', 'is_active', 'date_joined', 'profile_image']
+                  'location', 'is_active', 'date_joined', 'profile_image',
+                  'profile_image_renditions']
 
     def get_full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}".strip()
@@ -56,6 +85,12 @@ class PublicUserSerializer(serializers.ModelSerializer):
         return None
 
 
+class NotificationListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        notifications = list(data.all() if hasattr(data, 'all') else data)
+        return super().to_representation(resolve_target_urls(notifications))
+
+
 class NotificationSerializer(serializers.ModelSerializer):
     target_url = serializers.SerializerMethodField()
 
@@ -66,28 +101,9 @@ class NotificationSerializer(serializers.ModelSerializer):
             'is_read', 'target_url'
         ]
         read_only_fields = ['recipient', 'notification_type', 'message']
+        list_serializer_class = NotificationListSerializer
 
     def get_target_url(self, obj):
-        target = obj.content_object
-
-        if hasattr(target, "blog") and target.blog:
-            return f"/blog/{target.blog.id}/#comment-{target.id}"
-
-        elif hasattr(target, "post") and target.post:
-            return f"/post/{target.post.id}/#comment-{target.id}"
-
-        elif isinstance(target, Product):
-            return f"/marketplace/product/{target.slug}"
-
-        elif isinstance(target, Service):
-            return f"/services/{target.slug}"
-
-        elif isinstance(target, Message):
-            return f"/messages/conversation/?user_id={target.sender.id}"
-
-        elif isinstance(target, Blog):
-            return f"/blog/{target.id}#ratings"
-        elif isinstance(target, Post):
-            return f"/post/{target.id}#ratings"
-
-        return "/"
+        if not obj.target_url:
+            resolve_target_urls([obj])
+        return obj.target_url
@@ -1,7 +1,12 @@
+from django.apps import apps
 from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_save, pre_delete, pre_save
 from .models import UserProfile
+from .cache import bump_version
+from .cards import CARD_FIELDS, bump_profile_version
+from .search import SEARCHABLE_USER_FIELDS, index_user
+from .renditions import IMAGE_FIELDS, schedule_renditions
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -17,3 +22,49 @@ def delete_profile_for_deleted_user(sender, **kwargs):
         userprofile.delete()
     except UserProfile.DoesNotExist:
         pass
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def remember_card_fields(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._previous_card = None
+    if raw or instance.pk is None:
+        return
+    # e.g. logins, which only touch last_login: no cached payload shows it.
+    if update_fields is not None and not CARD_FIELDS & set(update_fields):
+        return
+    instance._previous_card = (
+        sender.objects.filter(pk=instance.pk)
+        .values(*CARD_FIELDS)
+        .first()
+    )
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def bump_user_cache_version(sender, instance, created, raw=False, **kwargs):
+    # A new user is in no cached payload yet.
+    previous = getattr(instance, '_previous_card', None)
+    if created or raw or previous is None:
+        return
+    if all(getattr(instance, field) == value for field, value in previous.items()):
+        return
+    bump_version(sender._meta.label_lower)
+    bump_profile_version(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def update_user_search_index(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not SEARCHABLE_USER_FIELDS & set(update_fields):
+        return
+    index_user(instance)
+
+
+def render_uploaded_image(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_renditions(instance, IMAGE_FIELDS[sender._meta.label])
+
+
+for label in IMAGE_FIELDS:
+    post_save.connect(render_uploaded_image, sender=apps.get_model(label),
+                      dispatch_uid=f'render_uploaded_image:{label}')
@@ -1,3 +1,1066 @@
-from django.test import TestCase
+import datetime
+import io
+import shutil
+import tempfile
+import threading
+from importlib import import_module
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.contrib.contenttypes.models import ContentType
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient, force_authenticate
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from content.models import Blog, Comment, Post, Rating, SearchDocument, Tag
+from content.serializers import PostSerializer
+from marketplace.models import Category, Product
+from messaging.models import Conversation, Message
+from services.models import Service
+
+from .analytics import ClickBuffer, click_buffer, write_click_counts
+from .compiled import compile_serializer
+from .metrics import RequestMetricsMiddleware, query_shape, registry
+from .management.commands.prune_notifications import retention_days
+from .models import (ArchivedNotification, DailyClickCount, MyUser, Notification, OutboxEvent,
+                     UserProfile, UserSearchToken)
+from .outbox import enqueue, handler, process_event
+from .renderers import FastJSONRenderer
+from .renditions import record_renditions, render_image, rendition_urls, target_size
+from .routers import PIN_KEY, ReadYourWritesMiddleware, ReplicaReadMixin
+from .search import search_terms
+from .serializers import PublicUserSerializer
+from .seeding import dataset_counts, seed_dataset
+from .utils import create_notification, get_target_url, resolve_target_urls
+
+
+RECORD = {
+    'source': 'post_images/dog.jpg',
+    'thumb': {'webp': 'post_images/dog.thumb.webp', 'jpeg': 'post_images/dog.thumb.jpg',
+              'width': 160, 'height': 160},
+    'card': {'webp': 'post_images/dog.card.webp', 'jpeg': 'post_images/dog.card.jpg',
+             'width': 640, 'height': 480},
+    'full': {'webp': 'post_images/dog.full.webp', 'jpeg': 'post_images/dog.full.jpg',
+             'width': 1600, 'height': 1200},
+}
+
+
+class CompiledReadTests(TestCase):
+    """The compiled list path renders the same bytes as the serializers"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x',
+            first_name='Alice', last_name='Ünïcode ')
+        cls.bob = MyUser.objects.create_user(
+            username='bob', email='bob@example.com', password='x',
+            profile_image='profile_images/bob.jpg')
+        dogs, cats = Tag.objects.create(name='dogs'), Tag.objects.create(name='cats')
+
+        for i in range(12):
+            post = Post.objects.create(
+                author=cls.alice if i % 3 else cls.bob, title=f'Post {i}',
+                caption='"quoted" \\ caption', youtube_url=None if i % 2 else 'https://y.tube/x')
+            post.tags.set([dogs, cats][:i % 3])
+            blog = Blog.objects.create(author=cls.bob, title=f'Blog {i}', content='Text')
+            blog.tags.set([cats])
+        Post.objects.filter(title='Post 1').update(
+            image='post_images/dog.jpg', image_renditions=RECORD,
+            rating_sum=10, rating_count=3)
+        Post.objects.filter(title='Post 2').update(image='')
+
+        toys = Category.objects.create(name='Toys', slug='toys')
+        for i in range(5):
+            Product.objects.create(
+                title=f'Ball {i}', slug=f'ball-{i}', description='Bouncy',
+                price=Decimal('9.90') + i, affiliate_url='https://shop.example.com/ball',
+                category=toys if i % 2 else None)
+            Service.objects.create(
+                name=f'Walker {i}', service_type='walker', description='Walks',
+                contact_email='walk@example.com', city='Oslo')
+
+        for i in range(6):
+            Message.objects.create(
+                sender=cls.alice if i % 2 else cls.bob,
+                receiver=cls.bob if i % 2 else cls.alice,
+                content=f'Hello {i}', attachment='attachments/a.pdf' if i == 3 else None)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def assertSameBytes(self, url):
+        with override_settings(COMPILED_READS=False):
+            expected = self.client.get(url)
+        with override_settings(COMPILED_READS=True):
+            actual = self.client.get(url)
+        self.assertEqual(expected.status_code, 200, expected.content)
+        self.assertEqual(actual.status_code, 200, actual.content)
+        self.assertEqual(actual.content, expected.content)
+
+    def test_posts(self):
+        for url in ('/content/posts/', '/content/posts/?page=2',
+                    '/content/posts/?pagination=cursor&page_size=5',
+                    f'/content/posts/?tags={Tag.objects.get(name="dogs").pk}',
+                    '/content/posts/?search=dogs', '/content/posts/?ordering=title'):
+            with self.subTest(url=url):
+                self.assertSameBytes(url)
+
+    def test_blogs(self):
+        self.assertSameBytes('/content/blogs/')
+        self.assertSameBytes('/content/blogs/?pagination=cursor')
+
+    def test_products(self):
+        self.assertSameBytes('/marketplace/products/')
+        self.assertSameBytes('/marketplace/products/?ordering=-price')
+
+    def test_services(self):
+        self.assertSameBytes('/services/')
+
+    def test_messages(self):
+        self.assertSameBytes('/messaging/messages/')
+
+    def test_sparse_fieldsets(self):
+        for url in ('/content/posts/?fields=id,title', '/content/posts/?include=tags',
+                    '/content/posts/?fields=id,average_rating&include=author',
+                    '/content/blogs/?pagination=cursor&fields=id,title',
+                    '/marketplace/products/?include=', '/services/?fields=slug',
+                    '/messaging/messages/?fields=id,time_ago,attachment_url'):
+            with self.subTest(url=url):
+                self.assertSameBytes(url)
+
+        post = self.client.get('/content/posts/?fields=title,id').json()['results'][0]
+        self.assertEqual(list(post), ['id', 'title'])
+        response = self.client.get('/content/posts/?fields=id,nope&include=title')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'fields', 'include'})
+
+    def test_sparse_fieldsets_trim_sql(self):
+        for compiled in (False, True):
+            with override_settings(COMPILED_READS=compiled), \
+                    CaptureQueriesContext(connection) as queries:
+                self.client.get('/content/posts/?fields=id,title')
+            sql = ' '.join(query['sql'] for query in queries.captured_queries)
+            self.assertNotIn('caption', sql)
+            self.assertNotIn('content_tag', sql)
+            self.assertNotIn('core_myuser', sql)
+
+    def test_reads_values_rows(self):
+        compiled = compile_serializer(PostSerializer)
+        compiled.render(compiled.values(Post.objects.all()), {})  # warm the cards
+        with self.assertNumQueries(2):  # the rows, then their tags
+            data = compiled.render(compiled.values(Post.objects.all()), {})
+        self.assertEqual(len(data), 12)
+
+
+class FastJSONRendererTests(TestCase):
+    def assertSameRender(self, data, media_type=None):
+        self.assertEqual(FastJSONRenderer().render(data, media_type),
+                         JSONRenderer().render(data, media_type))
+
+    def test_matches_json_renderer(self):
+        self.assertSameRender({
+            'text': 'ünïcode \u2028 \u2029 "quotes" \\ \x00 \x1f \t\n',
+            'numbers': [0, -1, 2 ** 63 - 1, 0.1, 1 / 3, 4.0, -0.0, 0.0001],
+            'when': timezone.now(),
+            'naive': datetime.datetime(2024, 1, 2, 3, 4, 5, 678901),
+            'date': datetime.date(2024, 1, 2),
+            'price': Decimal('9.90'),
+            'nested': [{'a': None, 'b': True}, (1, 2)],
+        })
+
+    def test_falls_back_where_orjson_differs(self):
+        for value in (1e16, 1e-05, 9.999e-05, 1.5e300, 2 ** 64, {1: 'int key'}):
+            with self.subTest(value=value):
+                self.assertSameRender({'value': value})
+
+    def test_indent(self):
+        self.assertSameRender({'a': [1, 2]}, 'application/json; indent=4')
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = MyUser.objects.create_user(
+            username='staff', email='staff@example.com', password='x', is_staff=True)
+        Post.objects.create(author=cls.staff, title='Post', caption='Caption')
+
+    def setUp(self):
+        registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_records_routes(self):
+        self.client.get('/content/posts/')
+        self.client.get('/content/posts/')
+        route = self.client.get('/analytics/requests/').json()['routes'][0]
+        self.assertEqual((route['route'], route['method'], route['requests']),
+                         ('post-list', 'GET', 2))
+        self.assertGreater(route['queries']['max'], 0)
+        self.assertIsNotNone(route['serialization_ms'])
+        self.assertGreater(route['response_bytes']['mean'], 0)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/analytics/requests/').status_code, 401)
+
+    def test_flags_repeated_query_shapes(self):
+        def view(request):
+            for pk in range(6):
+                MyUser.objects.filter(pk=pk).exists()
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        request.resolver_match = None
+        with self.assertLogs('core.metrics', 'WARNING'):
+            RequestMetricsMiddleware(view)(request)
+        route = registry.summary()['routes'][0]
+        self.assertEqual((route['route'], route['n_plus_one']), ('unmatched', 1))
+        self.assertEqual(route['repeated_queries'][0]['max_runs'], 6)
+
+    def test_query_shape(self):
+        self.assertEqual(
+            query_shape("SELECT 1 FROM t WHERE a IN (%s, %s) AND b = 'x' LIMIT 21"),
+            'SELECT ? FROM t WHERE a IN (...) AND b = ? LIMIT ?')
+
+    def test_prometheus_endpoint(self):
+        self.client.get('/content/posts/')
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        with override_settings(REQUEST_METRICS={'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'dogworld_request_queries_count{route="post-list",method="GET"} 1\n',
+                      response.content)
+
+
+class SeedDatasetTests(TestCase):
+    def test_seeds_rows_and_derived_data(self):
+        counts = dataset_counts(0.02)
+        data = seed_dataset(counts, seed=7)
+        self.assertEqual(len(data['posts']), counts['posts'])
+        self.assertEqual(UserProfile.objects.filter(user__in=data['users']).count(),
+                         counts['users'])
+        self.assertTrue(UserSearchToken.objects.filter(user__in=data['users']).exists())
+        self.assertTrue(Conversation.objects.exists())
+        post = Post.objects.filter(comments__isnull=False).first()
+        self.assertEqual(post.comment_count, post.comments.count())
+        self.assertEqual(SearchDocument.objects.count(), counts['posts'] + counts['blogs'])
+        notification = Notification.objects.filter(recipient__in=data['users']).first()
+        self.assertEqual(notification.target_url, get_target_url(notification.content_object))
+        word = max(post.title.split(), key=len)
+        response = self.client.get('/content/search/', {'q': word})
+        self.assertGreater(len(response.data['results']), 0)
+
+
+class RoutingProbeView(ReplicaReadMixin, APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        if 'write' in request.query_params:
+            Tag.objects.create(name='probe')
+        return Response({'read': Post.objects.all().db,
+                         'locking': Post.objects.select_for_update().db})
+
+    def post(self, request):
+        Tag.objects.create(name='probe')
+        return Response(status=201)
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica'], 'STICKY_SECONDS': 5})
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(
+            username='reader', email='reader@example.com', password='x')
+
+    def setUp(self):
+        cache.delete(PIN_KEY.format(self.user.pk))
+
+    def request(self, method='get', path='/', user=None, middleware=True):
+        request = getattr(RequestFactory(), method)(path)
+        if user:
+            force_authenticate(request, user)
+        view = RoutingProbeView.as_view()
+        return (ReadYourWritesMiddleware(view) if middleware else view)(request)
+
+    def test_routes_safe_reads_to_replica(self):
+        self.assertEqual(self.request(user=self.user).data,
+                         {'read': 'replica', 'locking': 'default'})
+        self.assertEqual(self.request().data['read'], 'replica')
+        self.assertEqual(self.request(path='/?write=1').data['read'], 'default')
+        self.assertEqual(self.request(user=self.user, middleware=False).data['read'], 'default')
+
+    def test_pins_writers_to_primary(self):
+        self.assertEqual(self.request('post', user=self.user).status_code, 201)
+        self.assertEqual(self.request(user=self.user).data['read'], 'default')
+        cache.delete(PIN_KEY.format(self.user.pk))
+        self.assertEqual(self.request(user=self.user).data['read'], 'replica')
+
+
+REPLICAS = [alias for alias in settings.DATABASES if alias != 'default']
+
+
+@skipUnless(REPLICAS, 'needs a replica, e.g. DB_ENGINE=django.db.backends.sqlite3 '
+                      'DB_NAME=primary.sqlite3 DB_REPLICAS=replica.sqlite3')
+@override_settings(READ_REPLICAS={'ALIASES': REPLICAS[:1], 'STICKY_SECONDS': 5})
+class ReplicaDatabaseTests(TestCase):
+    """Two databases that are not replicated, to tell where each read went"""
+    databases = {'default', *REPLICAS[:1]}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        Post.objects.create(author=cls.user, title='default', caption='Caption')
+        # bulk_create, so no signal writes the replica's rows to the primary
+        MyUser.objects.using(REPLICAS[0]).bulk_create(
+            [MyUser(pk=cls.user.pk, username='alice', email='alice@example.com')])
+        Post.objects.using(REPLICAS[0]).bulk_create(
+            [Post(author_id=cls.user.pk, title=REPLICAS[0], caption='Caption')])
+
+    def setUp(self):
+        cache.delete(PIN_KEY.format(self.user.pk))
+        self.client = APIClient()
+
+    def titles(self):
+        return [post['title'] for post in self.client.get('/content/posts/').json()['results']]
+
+    def test_reads_own_writes(self):
+        self.assertEqual(self.titles(), ['default'])  # anonymous reads are cached
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.titles(), REPLICAS[:1])
+
+        post = Post.objects.get()
+        response = self.client.post('/content/comments/', {'post': post.pk, 'content': 'Hi'})
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(self.titles(), ['default'])
+
+
+class AsyncReadTests(TestCase):
+    """The async endpoints served under ASGI answer exactly like the sync ones"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x', first_name='Alice')
+        cls.bob = MyUser.objects.create_user(
+            username='bob', email='bob@example.com', password='x')
+        dogs = Tag.objects.create(name='dogs')
+        for i in range(12):
+            post = Post.objects.create(author=cls.alice if i % 3 else cls.bob,
+                                       title=f'Post {i}', caption='Caption')
+            post.tags.set([dogs][:i % 2])
+        for i in range(25):
+            Message.objects.create(sender=cls.alice if i % 2 else cls.bob,
+                                   receiver=cls.bob if i % 2 else cls.alice, content=f'Hi {i}')
+        for i in range(3):
+            Notification.objects.create(
+                recipient=cls.alice, notification_type='comment', message=f'Comment {i}',
+                content_type=ContentType.objects.get_for_model(Post), object_id=post.pk,
+                target_url='' if i == 1 else '/')
+        cls.token = f'Bearer {AccessToken.for_user(cls.alice)}'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=self.token)
+
+    def assertSameResponse(self, url, method='get', **data):
+        expected = getattr(self.client, method)(url, data)
+        with override_settings(ROOT_URLCONF='dogworld.asgi_urls'):
+            actual = getattr(self.client, method)(url, data)
+        self.assertEqual(actual.status_code, expected.status_code, actual.content)
+        self.assertEqual(actual.content, expected.content)
+
+    def test_matches_sync_views(self):
+        post = Post.objects.first()
+        for url in ('/content/posts/', '/content/posts/?page=2&page_size=5',
+                    '/content/posts/?page=9', '/content/posts/?pagination=cursor&page_size=5',
+                    '/content/posts/?search=dogs&fields=id,title',
+                    f'/content/posts/?author={self.bob.pk}', f'/content/posts/{post.pk}/',
+                    '/content/posts/0/', '/messaging/messages/conversations/',
+                    f'/messaging/messages/conversation/?user_id={self.bob.pk}',
+                    '/messaging/messages/conversation/', '/messaging/messages/unread_count/',
+                    '/messaging/notifications/', '/messaging/notifications/unread_count/'):
+            with self.subTest(url=url):
+                self.assertSameResponse(url)
+
+        self.client.credentials()
+        self.assertSameResponse('/content/posts/')
+        self.assertSameResponse('/messaging/notifications/')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer nope')
+        self.assertSameResponse('/content/posts/')
+
+    def test_writes_fall_back_to_sync_views(self):
+        with override_settings(ROOT_URLCONF='dogworld.asgi_urls'):
+            response = self.client.post('/content/posts/', {'title': 'New', 'caption': 'New'})
+        self.assertEqual(response.status_code, 201, response.content)
+
+    async def test_runs_on_event_loop(self):
+        client = AsyncClient()
+        with override_settings(ROOT_URLCONF='dogworld.asgi_urls'):
+            for url in ('/content/posts/', '/messaging/messages/conversations/',
+                        '/messaging/notifications/'):
+                response = await client.get(url, headers={'authorization': self.token})
+                self.assertEqual(response.status_code, 200, response.content)
+
+
+class KeysetPaginationTests(TestCase):
+    """?pagination=cursor walks a list once, in order, with no offsets"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        for i in range(15):
+            Post.objects.create(author=cls.alice, title=f'Post {i}')
+        # Ties on the timestamp are broken by the id.
+        created_at = timezone.now() - datetime.timedelta(days=1)
+        Post.objects.filter(pk__in=Post.objects.order_by('pk').values('pk')[5:10]).update(
+            created_at=created_at)
+        cls.expected = list(Post.objects.order_by('-created_at', '-id')
+                            .values_list('pk', flat=True))
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(set(response.data), {'next', 'previous', 'results'})
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_walks_every_row_once(self):
+        pages = self.walk('/content/posts/?pagination=cursor&page_size=4')
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 3])
+        self.assertEqual(sum(pages, []), self.expected)
+
+    def test_inserts_do_not_shift_pages(self):
+        response = self.client.get('/content/posts/?pagination=cursor&page_size=4')
+        Post.objects.create(author=self.alice, title='Newer')
+        rest = self.walk(response.data['next'])
+        self.assertEqual(sum(rest, []), self.expected[4:])
+
+    def test_previous_link(self):
+        first = self.client.get('/content/posts/?pagination=cursor&page_size=4')
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+        self.assertIsNone(first.data['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/content/posts/?cursor=bm9wZQ')
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_numbers_by_default(self):
+        response = self.client.get('/content/posts/?page_size=4&page=2')
+        self.assertEqual(response.data['count'], 15)
+        self.assertEqual([row['id'] for row in response.data['results']], self.expected[4:8])
+
+
+class TargetUrlTests(TestCase):
+    """Notifications store their frontend link; legacy rows are resolved in bulk"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        cls.bob = MyUser.objects.create_user(
+            username='bob', email='bob@example.com', password='x')
+        cls.post = Post.objects.create(author=cls.alice, title='Walk')
+        cls.blog = Blog.objects.create(author=cls.alice, title='Diary', content='Text')
+        cls.comments = [Comment.objects.create(user=cls.bob, post=cls.post, content=str(i))
+                        for i in range(3)]
+
+    def legacy(self, target):
+        return Notification.objects.create(
+            recipient=self.alice, notification_type='comment', message='Legacy',
+            content_type=ContentType.objects.get_for_model(target), object_id=target.pk)
+
+    def test_target_urls(self):
+        product = Product.objects.create(title='Leash', price=10,
+                                         affiliate_url='https://example.com')
+        service = Service.objects.create(name='Walks', service_type='walking', city='Leeds')
+        message = Message.objects.create(sender=self.bob, receiver=self.alice, content='Hi')
+        comment = self.comments[0]
+        self.assertEqual(get_target_url(comment),
+                         f'/post/{self.post.pk}/#comment-{comment.pk}')
+        self.assertEqual(get_target_url(self.blog), f'/blog/{self.blog.pk}#ratings')
+        self.assertEqual(get_target_url(product), f'/marketplace/product/{product.slug}')
+        self.assertEqual(get_target_url(service), f'/services/{service.slug}')
+        self.assertEqual(get_target_url(message),
+                         f'/messages/conversation/?user_id={self.bob.pk}')
+        self.assertEqual(get_target_url(None), '/')
+
+    def test_create_notification_stores_url(self):
+        notification = create_notification(self.alice, 'comment', 'Hi', self.comments[1])
+        self.assertEqual(Notification.objects.get(pk=notification.pk).target_url,
+                         get_target_url(self.comments[1]))
+
+    def test_resolves_one_query_per_content_type(self):
+        notifications = [self.legacy(target) for target in (*self.comments, self.blog)]
+        gone = Post.objects.create(author=self.alice, title='Gone')
+        deleted = self.legacy(gone)
+        gone.delete()
+
+        notifications = list(Notification.objects.filter(
+            pk__in=[n.pk for n in notifications + [deleted]]).order_by('pk'))
+        for model in (Comment, Blog, Post):
+            ContentType.objects.get_for_model(model)
+        with self.assertNumQueries(3):
+            resolve_target_urls(notifications)
+        self.assertEqual([n.target_url for n in notifications],
+                         [f'/post/{self.post.pk}/#comment-{c.pk}' for c in self.comments]
+                         + [f'/blog/{self.blog.pk}#ratings', '/'])
+
+    def test_backfill_command(self):
+        legacy = self.legacy(self.blog)
+        stored = create_notification(self.alice, 'comment', 'Hi', self.comments[0])
+        call_command('backfill_notification_target_urls', batch_size=1, stdout=StringIO())
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.target_url, f'/blog/{self.blog.pk}#ratings')
+        self.assertEqual(Notification.objects.get(pk=stored.pk).target_url,
+                         stored.target_url)
+
+
+class ClickAnalyticsTests(TestCase):
+    """Affiliate clicks are buffered, upserted per day and summarized for staff"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = MyUser.objects.create_user(
+            username='staff', email='staff@example.com', password='x', is_staff=True)
+        cls.product = Product.objects.create(title='Leash', price=10,
+                                             affiliate_url='https://example.com')
+        cls.service = Service.objects.create(name='Walks', service_type='walking', city='Leeds')
+        cls.product_type = ContentType.objects.get_for_model(Product).id
+
+    def tearDown(self):
+        # Nothing may be left for the global buffer's timer to write later.
+        click_buffer.flush()
+
+    def test_flushes_at_max_events(self):
+        buffer = ClickBuffer(max_events=3, max_age=60)
+        day = timezone.localdate()
+        with mock.patch('core.analytics.write_click_counts') as write:
+            buffer.add(self.product_type, self.product.pk, day)
+            buffer.add(self.product_type, self.product.pk, day)
+            write.assert_not_called()
+            buffer.add(self.product_type, 99, day)
+        write.assert_called_once_with({(self.product_type, self.product.pk, day): 2,
+                                       (self.product_type, 99, day): 1})
+        self.assertIsNone(buffer._timer)
+
+    def test_flushes_after_max_age_without_more_clicks(self):
+        buffer = ClickBuffer(max_events=100, max_age=0.05)
+        flushed = threading.Event()
+        with mock.patch('core.analytics.write_click_counts',
+                        side_effect=lambda counts: flushed.set()) as write, \
+                mock.patch('core.analytics.connections'):
+            buffer.add(self.product_type, self.product.pk, timezone.localdate())
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(sum(write.call_args.args[0].values()), 1)
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_write_click_counts_upserts(self):
+        day = timezone.localdate()
+        write_click_counts({(self.product_type, self.product.pk, day): 2})
+        write_click_counts({(self.product_type, self.product.pk, day): 3})
+        self.assertEqual(DailyClickCount.objects.get().clicks, 5)
+
+    def test_click_endpoints_and_analytics(self):
+        client = APIClient()
+        for _ in range(3):
+            self.assertEqual(client.post(
+                f'/marketplace/products/{self.product.slug}/click/').status_code, 200)
+        client.post(f'/services/{self.service.slug}/click/')
+        client.force_authenticate(self.staff)
+        client.post(f'/marketplace/products/{self.product.slug}/click/')
+
+        response = client.get('/analytics/clicks/')
+        self.assertEqual(response.data['total_clicks'], 4)
+        self.assertEqual([(item['type'], item['clicks']) for item in response.data['top_items']],
+                         [('product', 3), ('service', 1)])
+        response = client.get('/analytics/clicks/', {'type': 'service'})
+        self.assertEqual(response.data['total_clicks'], 1)
+        response = client.get('/analytics/clicks/', {'type': 'product', 'id': self.product.pk})
+        self.assertEqual(response.data['series'][0]['clicks'], 3)
+        for params in ({'days': 'x'}, {'type': 'product', 'id': 'x'}):
+            self.assertEqual(client.get('/analytics/clicks/', params).status_code, 400)
+
+    def test_digest_command_is_idempotent(self):
+        yesterday = timezone.localdate() - timezone.timedelta(days=1)
+        write_click_counts({(self.product_type, self.product.pk, yesterday): 4})
+        call_command('send_click_digest', stdout=StringIO())
+        call_command('send_click_digest', stdout=StringIO())
+        notification = Notification.objects.get(recipient=self.staff)
+        self.assertEqual(notification.extra_data['total_clicks'], 4)
+        self.assertIn('Leash (4)', notification.message)
+
+
+class UserSearchTests(TestCase):
+    """/users/search/ ranks active users from the prefix index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        def user(username, first_name='', last_name='', **extra):
+            return MyUser.objects.create_user(
+                username=username, email=f'{username}@example.com', password='x',
+                first_name=first_name, last_name=last_name, **extra)
+
+        cls.searcher = user('searcher')
+        cls.john = user('john_doe', 'John', 'Doe')
+        cls.johanna = user('johanna', 'Johanna', 'Smith')
+        cls.smithers = user('walker', 'Jo', 'Smithers')
+        cls.inactive = user('johnny', is_active=False)
+
+    def setUp(self):
+        # Cached user cards of other tests' users may share these pks.
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.searcher)
+
+    def search(self, query):
+        response = self.client.get('/users/search/', {'query': query})
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data['results']]
+
+    def test_ranks_whole_words_and_usernames_first(self):
+        self.assertEqual(self.search('joh'), ['johanna', 'john_doe'])
+        self.assertEqual(self.search('john'), ['john_doe'])
+        self.assertEqual(self.search('johndoe'), ['john_doe'])
+        self.assertEqual(self.search('smith'), ['johanna', 'walker'])
+        self.assertEqual(self.search('john_doe@example.com'), ['john_doe'])
+        self.assertEqual(self.search('searcher'), [])
+
+    def test_conversation_partners_rank_higher(self):
+        Message.objects.create(sender=self.john, receiver=self.searcher, content='Hi')
+        self.assertEqual(self.search('joh'), ['john_doe', 'johanna'])
+
+    def test_short_words_are_ignored(self):
+        self.assertEqual(search_terms('jo smith'), ['smith'])
+        self.assertEqual(search_terms('Jö, SMITH smith'), ['smith'])
+        self.assertEqual(self.search('jo smith'), ['johanna', 'walker'])
+        self.assertFalse(UserSearchToken.objects.filter(token='jo').exists())
+
+    def test_index_follows_user_changes(self):
+        self.john.first_name = 'Jonathan'
+        self.john.save()
+        self.assertEqual(self.search('jonathan'), ['john_doe'])
+        self.john.is_active = False
+        self.john.save()
+        self.assertEqual(self.search('jonathan'), [])
+
+    def test_rebuild_and_migration_backfill_match(self):
+        expected = set(UserSearchToken.objects.values_list('user_id', 'token', 'weight'))
+        UserSearchToken.objects.all().delete()
+        call_command('rebuild_user_search_index', stdout=StringIO())
+        self.assertEqual(set(UserSearchToken.objects.values_list('user_id', 'token', 'weight')),
+                         expected)
+
+        UserSearchToken.objects.all().delete()
+        import_module('core.migrations.0010_user_search_token').populate_search_tokens(apps, None)
+        self.assertEqual(set(UserSearchToken.objects.values_list('user_id', 'token', 'weight')),
+                         expected)
+
+
+def image_file(name, size=(2000, 1000), mode='RGB', orientation=None):
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    Image.new(mode, size, 'red').save(buffer, 'PNG' if 'A' in mode else 'JPEG', exif=exif)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+@override_settings(IMAGE_RENDITIONS={'WORKERS': 0})
+class RenditionTests(TestCase):
+    """Uploaded images get resized WebP/JPEG variants recorded on their row"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(author=self.alice, title='Walk', image=image)
+        post.refresh_from_db()
+        return post
+
+    def test_target_size(self):
+        self.assertEqual(target_size(2000, 1000, 'thumb'), (160, 160))
+        self.assertEqual(target_size(2000, 1000, 'card'), (640, 320))
+        self.assertEqual(target_size(2000, 1000, 'full'), (1600, 800))
+        self.assertEqual(target_size(100, 50, 'full'), (100, 50))
+        self.assertEqual(target_size(100, 50, 'thumb'), (100, 50))
+
+    def test_renders_variants_after_commit(self):
+        post = self.upload(image_file('dog.jpg'))
+        record = post.image_renditions
+        self.assertEqual(record['source'], post.image.name)
+        for rendition, size in (('thumb', (160, 160)), ('card', (640, 320)),
+                                ('full', (1600, 800))):
+            self.assertEqual((record[rendition]['width'], record[rendition]['height']), size)
+            for key, image_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                with default_storage.open(record[rendition][key]) as file, \
+                        Image.open(file) as image:
+                    self.assertEqual((image.format, image.size), (image_format, size))
+
+        data = self.client.get(f'/content/posts/{post.pk}/').data['image_renditions']
+        self.assertTrue(data['ready'])
+        self.assertTrue(data['thumb']['webp'].endswith('.thumb.webp'))
+
+    def test_exif_rotation_and_transparency(self):
+        record = self.upload(image_file('tall.jpg', orientation=6)).image_renditions
+        self.assertEqual((record['card']['width'], record['card']['height']), (320, 640))
+
+        record = self.upload(image_file('clear.png', mode='RGBA')).image_renditions
+        with default_storage.open(record['card']['jpeg']) as file, Image.open(file) as image:
+            self.assertEqual(image.mode, 'RGB')
+
+    def test_new_upload_serves_original_until_rendered(self):
+        post = self.upload(image_file('dog.jpg'))
+        stale = post.image_renditions
+        post.image = image_file('cat.jpg')
+        post.save()
+
+        urls = rendition_urls(post.image, stale)
+        self.assertFalse(urls['ready'])
+        self.assertEqual(urls['card']['webp'], post.image.url)
+        self.assertEqual(record_renditions(Post, 'image', stale['source'], stale, pk=post.pk), 0)
+
+    def test_backfill_renders_each_file_once(self):
+        post = self.upload(image_file('dog.jpg'))
+        other = Post.objects.create(author=self.alice, title='Run', image=post.image.name)
+        Post.objects.filter(pk=post.pk).update(image_renditions={})
+        MyUser.objects.update(profile_image='')
+        out = StringIO()
+        call_command('backfill_image_renditions', workers=1, stdout=out)
+        self.assertIn('Rendering 1 images', out.getvalue())
+        other.refresh_from_db()
+        self.assertEqual(other.image_renditions, render_image(post.image.name))
+
+
+@handler('tests.fail')
+def fail(**payload):
+    raise ValueError('Boom')
+
+
+class OutboxTests(TestCase):
+    """Side effects of writes run from process_outbox with retries, or eagerly after commit"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        cls.bob = MyUser.objects.create_user(
+            username='bob', email='bob@example.com', password='x')
+        cls.post = Post.objects.create(author=cls.alice, title='Walk')
+
+    def comment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(user=self.bob, post=self.post, content='Hi')
+        return OutboxEvent.objects.get(topic='content.comment_created')
+
+    def process_outbox(self, **options):
+        out, err = StringIO(), StringIO()
+        call_command('process_outbox', once=True, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    @override_settings(OUTBOX={'EAGER': True})
+    def test_runs_eagerly_after_commit_when_enabled(self):
+        event = self.comment()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_DONE, 1))
+        self.assertTrue(Notification.objects.filter(recipient=self.alice).exists())
+
+    def test_worker_processes_queued_events(self):
+        event = self.comment()
+        self.assertEqual(event.status, OutboxEvent.STATUS_PENDING)
+        self.assertFalse(Notification.objects.exists())
+
+        out, err = self.process_outbox(workers=4)
+        self.assertIn('Processed 1 events', out)
+        self.assertIn('using 1 worker', err)
+        event.refresh_from_db()
+        self.assertEqual(event.status, OutboxEvent.STATUS_DONE)
+        self.assertEqual(Notification.objects.get().recipient, self.alice)
+        self.assertFalse(process_event(event.id))
+
+    @override_settings(OUTBOX={'MAX_ATTEMPTS': 2, 'RETRY_DELAY_SECONDS': 5})
+    def test_failures_back_off_then_give_up(self):
+        event = enqueue('tests.fail', id=1)
+        with self.assertLogs('core.outbox', 'ERROR'):
+            self.process_outbox()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_PENDING, 1))
+        self.assertIn('Boom', event.last_error)
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertIn('Processed 0 events', self.process_outbox()[0])
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        with self.assertLogs('core.outbox', 'ERROR'):
+            self.process_outbox()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), (OutboxEvent.STATUS_FAILED, 2))
+
+    def test_unknown_topics_fail(self):
+        event = OutboxEvent.objects.create(topic='tests.unknown')
+        with self.assertLogs('core.outbox', 'ERROR'):
+            self.assertFalse(process_event(event.id))
+        event.refresh_from_db()
+        self.assertIn('UnknownTopic', event.last_error)
+
+    def test_purges_old_done_events(self):
+        event = self.comment()
+        self.process_outbox()
+        OutboxEvent.objects.update(processed_at=timezone.now() - timezone.timedelta(hours=30))
+        self.process_outbox(purge_after_hours=24)
+        self.assertFalse(OutboxEvent.objects.filter(pk=event.pk).exists())
+
+
+class NotificationInboxTests(TestCase):
+    """/messaging/notifications/ pages unread first and marks in bulk"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        cls.bob = MyUser.objects.create_user(
+            username='bob', email='bob@example.com', password='x')
+        cls.post = Post.objects.create(author=cls.alice, title='Walk')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.notifications = [
+            create_notification(self.alice, 'comment', str(i), self.post) for i in range(5)]
+        Notification.objects.filter(pk__in=[n.pk for n in self.notifications[:2]]).update(
+            is_read=True)
+        self.others = create_notification(self.bob, 'comment', 'Bob', self.post)
+
+    def test_pages_unread_first(self):
+        response = self.client.get('/messaging/notifications/', {'page_size': 2})
+        self.assertEqual(set(response.data), {'next', 'previous', 'results'})
+        self.assertIsNone(response.data['previous'])
+
+        seen = []
+        while True:
+            seen += [(n['id'], n['is_read']) for n in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, [(n.pk, False) for n in reversed(self.notifications[2:])]
+                         + [(n.pk, True) for n in reversed(self.notifications[:2])])
+
+    def test_bulk_mark_read(self):
+        ids = [n.pk for n in self.notifications[2:4]] + [self.others.pk]
+        response = self.client.post('/messaging/notifications/mark_read/', {'ids': ids},
+                                    format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertFalse(Notification.objects.get(pk=self.others.pk).is_read)
+        self.assertEqual(self.client.get('/messaging/notifications/unread_count/').data,
+                         {'unread_count': 1})
+
+        for ids in ([], 'x', ['1'], list(range(501))):
+            response = self.client.post('/messaging/notifications/mark_read/', {'ids': ids},
+                                        format='json')
+            self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/messaging/notifications/mark_all_read/')
+        self.assertEqual(response.data, {'updated': 1})
+        self.assertFalse(Notification.objects.filter(recipient=self.alice, is_read=False).exists())
+
+
+@override_settings(
+    NOTIFICATION_RETENTION={
+        'affiliate_click': {'read': 30},
+        'message': {'read': None, 'unread': None},
+        'default': {'read': 180, 'unread': 365},
+    },
+)
+class PruneNotificationTests(TestCase):
+    """prune_notifications removes what NOTIFICATION_RETENTION no longer keeps"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+        cls.post = Post.objects.create(author=cls.alice, title='Walk')
+
+    def notification(self, notification_type, days, is_read=False):
+        notification = create_notification(self.alice, notification_type, 'Hi', self.post)
+        Notification.objects.filter(pk=notification.pk).update(
+            is_read=is_read, created_at=timezone.now() - timezone.timedelta(days=days))
+        return notification.pk
+
+    def prune(self, *args):
+        call_command('prune_notifications', *args, batch_size=1, stdout=StringIO())
+        return set(Notification.objects.values_list('pk', flat=True))
+
+    def test_retention_days(self):
+        self.assertEqual(retention_days('affiliate_click', True), 30)
+        self.assertEqual(retention_days('affiliate_click', False), 365)
+        self.assertIsNone(retention_days('message', True))
+        self.assertEqual(retention_days('comment', False), 365)
+
+    def test_prunes_per_type_and_state(self):
+        kept = {
+            self.notification('affiliate_click', 20, is_read=True),
+            self.notification('affiliate_click', 200),
+            self.notification('message', 1000, is_read=True),
+            self.notification('comment', 100, is_read=True),
+        }
+        expired = {
+            self.notification('affiliate_click', 40, is_read=True),
+            self.notification('affiliate_click', 400),
+            self.notification('comment', 200, is_read=True),
+        }
+        self.assertEqual(self.prune('--dry-run'), kept | expired)
+        self.assertEqual(self.prune(), kept)
+        self.assertFalse(ArchivedNotification.objects.exists())
+
+    def test_archives(self):
+        expired = self.notification('comment', 400)
+        self.prune('--archive')
+        archived = ArchivedNotification.objects.get()
+        self.assertEqual((archived.original_id, archived.recipient_id, archived.message),
+                         (expired, self.alice.pk, 'Hi'))
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': 'card-tests'}},
+)
+class UserCardTests(TestCase):
+    """Nested user cards are cached per profile version and built once per request"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x',
+                                       first_name=name.title())
+            for name in ('alice', 'bob'))
+        for author in (cls.alice, cls.bob, cls.alice):
+            Post.objects.create(author=author, title='Walk')
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().get('/')
+
+    def authors(self, request=None):
+        posts = Post.objects.select_related('author').order_by('id')
+        data = PostSerializer(posts, many=True, context={'request': request or self.request}).data
+        return [post['author']['full_name'] for post in data]
+
+    def test_caches_cards_until_the_profile_changes(self):
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(self.authors(), ['Alice', 'Bob', 'Alice'])
+        card_reads = [call.args[0] for call in get_many.call_args_list
+                      if call.args[0][0].startswith('user-card:')]
+        self.assertEqual([len(keys) for keys in card_reads], [2])
+
+        # update() skips the signals, so the cached cards are still served.
+        MyUser.objects.update(first_name='Stale')
+        self.assertEqual(self.authors(), ['Alice', 'Bob', 'Alice'])
+
+        self.alice.first_name = 'Alicia'
+        self.alice.save()
+        self.assertEqual(self.authors(), ['Alicia', 'Bob', 'Alicia'])
+        self.alice.save(update_fields=['last_login'])
+        self.assertEqual(self.authors()[0], 'Alicia')
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'example.com'])
+    def test_cards_are_keyed_by_origin(self):
+        # Cards embed absolute image URLs, so each site origin has its own.
+        self.authors()
+        MyUser.objects.update(first_name='Fresh')
+        other = RequestFactory().get('/', HTTP_HOST='example.com')
+        self.assertEqual(self.authors(other), ['Fresh', 'Fresh', 'Fresh'])
+        self.assertEqual(self.authors(), ['Alice', 'Bob', 'Alice'])
+
+    def test_load_cards_by_id_reads_only_uncached_users(self):
+        serializer = PublicUserSerializer(context={'request': self.request})
+        with self.assertNumQueries(1):
+            cards = serializer.load_cards_by_id([self.alice.pk, self.bob.pk, 0])
+        self.assertEqual(set(cards), {self.alice.pk, self.bob.pk})
+
+        serializer = PublicUserSerializer(context={'request': self.request})
+        with self.assertNumQueries(0):
+            cards = serializer.load_cards_by_id([self.alice.pk, self.bob.pk])
+        self.assertEqual(cards[self.bob.pk]['username'], 'bob')
+
+
+class PublicProfileTests(TestCase):
+    """/users/<username>/profile/ reads the stats stored on UserProfile"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('alice', 'bob'))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def profile(self, username='alice', **params):
+        response = self.client.get(f'/users/{username}/profile/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_stats_and_latest_posts(self):
+        posts = [Post.objects.create(author=self.alice, title=str(i)) for i in range(3)]
+        blog = Blog.objects.create(author=self.alice, title='Diary', content='Text')
+        Rating.objects.create(user=self.bob, post=posts[0], score=4)
+        Rating.objects.create(user=self.bob, blog=blog, score=2)
+        Comment.objects.create(user=self.alice, post=posts[1], content='Hi')
+
+        data = self.profile(posts=2)
+        self.assertEqual(data['user']['username'], 'alice')
+        self.assertEqual(data['stats'], {'posts': 3, 'blogs': 1, 'comments': 1,
+                                         'ratings_received': 2, 'average_rating': 3.0})
+        self.assertEqual([post['id'] for post in data['latest_posts']],
+                         [posts[2].pk, posts[1].pk])
+
+        posts[0].delete()
+        self.assertEqual(self.profile()['stats']['ratings_received'], 1)
+        self.assertEqual(self.client.get('/users/nobody/profile/').status_code, 404)
+
+    def test_users_without_a_profile(self):
+        Post.objects.create(author=self.alice, title='Walk')
+        UserProfile.objects.filter(user=self.alice).delete()
+        self.assertEqual(self.profile()['stats']['posts'], 1)
+        self.assertTrue(UserProfile.objects.filter(user=self.alice).exists())
+
+    def test_counters_stop_at_zero(self):
+        post = Post.objects.create(author=self.bob, title='Walk')
+        comment = Comment.objects.create(user=self.alice, post=post, content='Hi')
+        UserProfile.objects.filter(user=self.alice).update(comment_count=0)
+        comment.delete()
+        self.assertEqual(self.profile()['stats']['comments'], 0)
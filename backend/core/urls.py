@@ -1,7 +1,8 @@
 from django.urls import path
-from .views import PublicUserDetailView, search_users
+from .views import PublicProfileView, PublicUserDetailView, search_users
 
 urlpatterns = [
     path('search/', search_users, name='search_users'),
+    path('<str:username>/profile/', PublicProfileView.as_view(), name='user-profile'),
     path('<str:username>/', PublicUserDetailView.as_view(), name='user-detail'),
 ]
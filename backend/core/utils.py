@@ -1,5 +1,62 @@
+from collections import defaultdict
+
 from django.contrib.contenttypes.models import ContentType
-from core.models import Notification
+from django.utils import timezone
+
+from core.models import Notification, NotificationCounter
+
+# Latest actors named in a grouped notification
+MAX_NOTIFICATION_ACTORS = 3
+
+
+def get_target_url(target):
+    """Frontend URL a notification about `target` should link to"""
+    from content.models import Blog, Post, Comment
+    from marketplace.models import Product
+    from services.models import Service
+    from messaging.models import Message
+
+    if isinstance(target, Comment):
+        if target.blog_id:
+            return f"/blog/{target.blog_id}/#comment-{target.id}"
+        if target.post_id:
+            return f"/post/{target.post_id}/#comment-{target.id}"
+
+    elif isinstance(target, Product):
+        return f"/marketplace/product/{target.slug}"
+
+    elif isinstance(target, Service):
+        return f"/services/{target.slug}"
+
+    elif isinstance(target, Message):
+        return f"/messages/conversation/?user_id={target.sender_id}"
+
+    elif isinstance(target, Blog):
+        return f"/blog/{target.id}#ratings"
+    elif isinstance(target, Post):
+        return f"/post/{target.id}#ratings"
+
+    return "/"
+
+
+def resolve_target_urls(notifications):
+    """
+    Fill in `target_url` for notifications stored without one, loading
+    their targets with a single query per content type.
+    """
+    pending = defaultdict(list)
+    for notification in notifications:
+        if not notification.target_url:
+            pending[notification.content_type_id].append(notification)
+
+    for content_type_id, group in pending.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        targets = model._base_manager.in_bulk(
+            {notification.object_id for notification in group}) if model else {}
+        for notification in group:
+            notification.target_url = get_target_url(
+                targets.get(notification.object_id))
+    return notifications
 
 
 def create_notification(recipient, notification_type, message, content_object):
@@ -8,5 +65,63 @@ def create_notification(recipient, notification_type, message, content_object):
         notification_type=notification_type,
         message=message,
         content_type=ContentType.objects.get_for_model(content_object),
-        object_id=content_object.id
+        object_id=content_object.id,
+        target_url=get_target_url(content_object),
     )
+
+
+def format_actors(actors, more=False):
+    """"alice", "bob and alice", "carol, bob and others" """
+    if more:
+        return f"{', '.join(actors)} and others"
+    if len(actors) > 1:
+        return f"{', '.join(actors[:-1])} and {actors[-1]}"
+    return actors[0]
+
+
+def coalesce_notification(recipient, notification_type, target, actor, content_object, describe):
+    """
+    Fold an event about `target` into the recipient's unread notification
+    of this type for it, or start a new one once that has been read.
+    `describe(actors_text, count)` returns the message.
+
+    Runs inside the caller's transaction without locking the notification:
+    the counter increment serializes concurrent events about one target
+    until that transaction commits. Callers are outbox handlers, so the
+    lock is held in the process_outbox worker unless OUTBOX['EAGER'] is on.
+    """
+    counter = NotificationCounter.objects.increment(
+        recipient.id, notification_type, target)
+
+    notification = None
+    if counter.notification_id and counter.count > 1:
+        notification = Notification.objects.filter(
+            pk=counter.notification_id, is_read=False).first()
+
+    if notification is None:
+        notification = create_notification(
+            recipient=recipient,
+            notification_type=notification_type,
+            message=describe(actor, 1),
+            content_object=content_object,
+        )
+        notification.extra_data = {'count': 1, 'actors': [actor]}
+        notification.save(update_fields=['extra_data'])
+        NotificationCounter.objects.filter(pk=counter.pk).update(
+            notification=notification, count=1)
+        return notification
+
+    previous = notification.extra_data.get('actors', [])
+    actors = [actor] + [name for name in previous if name != actor]
+    more = notification.extra_data.get('more_actors', False) or len(actors) > MAX_NOTIFICATION_ACTORS
+    actors = actors[:MAX_NOTIFICATION_ACTORS]
+
+    notification.message = describe(format_actors(actors, more), counter.count)
+    notification.extra_data = {'count': counter.count, 'actors': actors, 'more_actors': more}
+    # Link to the latest event and show it as latest activity.
+    notification.content_object = content_object
+    notification.target_url = get_target_url(content_object)
+    notification.created_at = timezone.now()
+    notification.save(update_fields=[
+        'message', 'extra_data', 'content_type', 'object_id', 'target_url', 'created_at'])
+    return notification
@@ -1,18 +1,37 @@
 from .models import MyUser  # Assuming MyUser is your custom user model
 from .serializers import PublicUserSerializer
 from .serializers import NotificationSerializer, PublicUserSerializer
-from .models import Notification, MyUser
-from django.db.models import Q
+from .models import Notification, MyUser, DailyClickCount, UserProfile
+from .analytics import click_buffer
+from .asyncviews import AsyncReadMixin
+from .metrics import get_setting as get_metrics_setting, registry as metrics_registry
+from .search import rank_users
+from .pagination import KeysetPagination
+from .utils import resolve_target_urls
+from asgiref.sync import sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Sum
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from content.models import Post
+from content.serializers import PostSerializer
+from marketplace.models import Product
+from services.models import Service
+from messaging.events import publish
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import generics, permissions
+from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import SearchFilter
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 from rest_framework import status
 
+import hmac
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,7 +41,7 @@ logger = logging.getLogger(__name__)
 @permission_classes([IsAuthenticated])
 def search_users(request):
     """
-    Search for users by username, email, first_name, or last_name
+    Search for users by username, first_name, last_name or email, as you type
     """
     query = request.GET.get('query', '').strip()
 
@@ -33,17 +52,8 @@ def search_users(request):
             'message': 'Please enter at least 3 characters to search.'
         })
 
-    # Search across multiple fields using '__icontains'
-    users = MyUser.objects.filter(
-        Q(username__icontains=query) |
-        Q(email__icontains=query) |
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query)
-    ).filter(
-        is_active=True  # Only return active users
-    ).exclude(
-        id=request.user.id  # Exclude the current user
-    ).distinct()[:20]  # Limit to 20 results
+    # Ranked lookup in the prefix index instead of scanning MyUser
+    users = rank_users(query, request.user, limit=20)
 
     # Serialize the results
     serializer = PublicUserSerializer(
@@ -67,11 +77,59 @@ class PublicUserDetailView(generics.RetrieveAPIView):
         return context
 
 
+class PublicProfileView(APIView):
+    """
+    A user's card, content stats and latest posts in one response. The
+    stats come from the counters kept on UserProfile, not from aggregates.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    default_posts = 6
+    max_posts = 20
+
+    def get_post_limit(self, request):
+        try:
+            limit = int(request.query_params.get('posts', self.default_posts))
+        except ValueError:
+            limit = self.default_posts
+        return max(0, min(limit, self.max_posts))
+
+    def get(self, request, username):
+        user = get_object_or_404(
+            MyUser.objects.select_related('userprofile'), username=username)
+        try:
+            profile = user.userprofile
+        except UserProfile.DoesNotExist:
+            # E.g. users inserted with bulk_create, which sends no post_save.
+            profile, created = UserProfile.objects.get_or_create(user=user)
+            if created:
+                UserProfile.objects.recalculate_counters([user.pk])
+                profile.refresh_from_db()
+        posts = (Post.objects.filter(author=user)
+                 .select_related('author')
+                 .prefetch_related('tags')
+                 .order_by('-created_at', '-id')[:self.get_post_limit(request)])
+        context = {'request': request}
+        return Response({
+            'user': PublicUserSerializer(user, context=context).data,
+            'stats': {
+                'posts': profile.post_count,
+                'blogs': profile.blog_count,
+                'comments': profile.comment_count,
+                'ratings_received': profile.rating_count,
+                'average_rating': profile.rating,
+            },
+            'latest_posts': PostSerializer(posts, many=True, context=context).data,
+        })
+
+
 class NotificationViewSet(ModelViewSet):
     serializer_class = NotificationSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    ordering_fields = ['id', 'created_at']
+    filter_backends = [DjangoFilterBackend, SearchFilter]
     permission_classes = [permissions.IsAuthenticated]
+    # Unread first, newest first within each group
+    pagination_class = KeysetPagination
+    keyset_ordering = ('is_read', '-created_at', '-id')
+    max_bulk_ids = 500
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -85,32 +143,165 @@ class NotificationViewSet(ModelViewSet):
 
     @action(detail=True, methods=['patch'])
     def mark_as_read(self, request, pk=None):
-        # Debug logging
-        logger.info(f"User: {request.user}, User ID: {request.user.id}")
-        logger.info(f"Notification ID: {pk}")
-
-        try:
-            notification = self.get_object()
-            logger.info(
-                f"Notification recipient: {notification.recipient}, Recipient ID: {notification.recipient.id}")
-            logger.info(
-                f"User matches recipient: {notification.recipient == request.user}")
-            logger.info(
-                f"User ID matches recipient ID: {notification.recipient.id == request.user.id}")
-        except Exception as e:
-            logger.error(f"Error getting notification: {e}")
-            return Response({'error': 'Notification not found'}, status=status.HTTP_404_NOT_FOUND)
+        notification = self.get_object()
 
         # Check if user has permission to mark this notification as read
-        if notification.recipient.id == request.user.id:
-            if not notification.is_read:
-                notification.is_read = True
-                notification.save()
-                logger.info(f"Notification {pk} marked as read successfully")
-            else:
-                logger.info(f"Notification {pk} was already read")
-            return Response({'status': 'Notification marked as read'}, status=status.HTTP_200_OK)
-        else:
-            logger.warning(
-                f"Permission denied - User {request.user.id} tried to mark notification {pk} (recipient: {notification.recipient.id})")
+        if notification.recipient_id != request.user.id:
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        if not notification.is_read:
+            notification.is_read = True
+            notification.save(update_fields=['is_read'])
+        return Response({'status': 'Notification marked as read'}, status=status.HTTP_200_OK)
+
+    def _mark_read(self, request, notifications, ids=None):
+        """Mark the user's unread `notifications` read with a single UPDATE"""
+        updated = notifications.filter(
+            recipient=request.user, is_read=False).update(is_read=True)
+        if updated:
+            # update() sends no post_save; tell open streams directly.
+            publish(request.user.id, 'notifications_read', {'ids': ids})
+        return Response({'updated': updated}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'])
+    def mark_all_read(self, request):
+        return self._mark_read(request, Notification.objects.all())
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        ids = request.data.get('ids')
+        if (not isinstance(ids, list) or not ids or len(ids) > self.max_bulk_ids
+                or not all(isinstance(pk, int) for pk in ids)):
+            return Response(
+                {'error': f'ids must be a list of 1 to {self.max_bulk_ids} notification ids'},
+                status=status.HTTP_400_BAD_REQUEST)
+        return self._mark_read(
+            request, Notification.objects.filter(id__in=ids), ids=ids)
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        return Response({'unread_count': self.unread_queryset().count()})
+
+    def unread_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user, is_read=False)
+
+
+class AsyncNotificationViewSet(AsyncReadMixin, NotificationViewSet):
+    """NotificationViewSet with list and unread_count served on the event loop under ASGI"""
+
+    async def prepare_objects(self, objects):
+        if any(not notification.target_url for notification in objects):
+            await sync_to_async(resolve_target_urls)(objects)
+
+    async def aunread_count(self, request):
+        return Response({'unread_count': await self.unread_queryset().acount()})
+
+
+class ClickAnalyticsView(APIView):
+    """
+    Affiliate click analytics for staff.
+    ?days=30&type=product|service&id=<item id>&limit=10
+    """
+    permission_classes = [permissions.IsAdminUser]
+    item_models = {'product': Product, 'service': Service}
+
+    def get(self, request):
+        # Include this process's buffered clicks in the numbers.
+        click_buffer.flush()
+
+        try:
+            days = min(max(int(request.query_params.get('days', 30)), 1), 365)
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+            item_id = request.query_params.get('id')
+            item_id = int(item_id) if item_id else None
+        except ValueError:
+            return Response({'error': 'days, limit and id must be integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        since = timezone.localdate() - timezone.timedelta(days=days - 1)
+        counts = DailyClickCount.objects.filter(day__gte=since)
+
+        item_type = request.query_params.get('type')
+        if item_type:
+            if item_type not in self.item_models:
+                return Response({'error': 'type must be product or service'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            counts = counts.filter(content_type=ContentType.objects.get_for_model(
+                self.item_models[item_type]))
+            if item_id is not None:
+                counts = counts.filter(object_id=item_id)
+
+        top = list(
+            counts.values('content_type_id', 'object_id')
+            .annotate(clicks=Sum('clicks'))
+            .order_by('-clicks')[:limit]
+        )
+        items = {}
+        for model in self.item_models.values():
+            content_type = ContentType.objects.get_for_model(model)
+            ids = [row['object_id'] for row in top
+                   if row['content_type_id'] == content_type.id]
+            for pk, item in model.objects.in_bulk(ids).items():
+                items[(content_type.id, pk)] = (content_type.model, item)
+
+        top_items = []
+        for row in top:
+            item_type, item = items.get(
+                (row['content_type_id'], row['object_id']), (None, None))
+            if item is None:
+                continue
+            top_items.append({
+                'type': item_type,
+                'id': item.id,
+                'name': getattr(item, 'title', None) or getattr(item, 'name', ''),
+                'slug': item.slug,
+                'clicks': row['clicks'],
+            })
+
+        series = list(counts.values('day').annotate(
+            clicks=Sum('clicks')).order_by('day'))
+
+        return Response({
+            'since': since,
+            'total_clicks': sum(point['clicks'] for point in series),
+            'top_items': top_items,
+            'series': series,
+        })
+
+
+class RequestMetricsView(APIView):
+    """
+    Per-route request metrics of this process for staff, slowest in total
+    first. ?limit=50. DELETE starts them afresh.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        summary = metrics_registry.summary()
+        summary['routes'] = summary['routes'][:limit]
+        return Response(summary)
+
+    def delete(self, request):
+        metrics_registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@require_GET
+def prometheus_metrics(request):
+    """
+    Request metrics in the Prometheus text format, for scrapers sending
+    `Authorization: Bearer <REQUEST_METRICS['TOKEN']>`. Off without a token.
+    """
+    token = get_metrics_setting('TOKEN')
+    if not token:
+        raise Http404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(metrics_registry.prometheus(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -2,6 +2,10 @@
 ASGI config for dogworld project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve through ASGI (e.g. ``uvicorn dogworld.asgi:application``) for the
+server-sent event stream at /messaging/stream/ to push events to clients.
+With ASYNC_READS, requests resolve through dogworld/asgi_urls.py, where
+the hottest read endpoints are served by native async views.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,8 +13,23 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dogworld.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+
+class AsyncReadsASGIHandler(ASGIHandler):
+    """Resolves requests through dogworld.asgi_urls"""
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = 'dogworld.asgi_urls'
+        return request, error_response
+
+
+application = AsyncReadsASGIHandler() if settings.ASYNC_READS else ASGIHandler()
@@ -0,0 +1,21 @@
+"""
+URL configuration for the ASGI application (dogworld/asgi.py).
+
+The async versions of the hottest read endpoints take over the paths and
+names of their sync ViewSets; every other URL is the same as in
+dogworld/urls.py.
+"""
+from rest_framework.routers import SimpleRouter
+
+from content.views import AsyncPostViewSet
+from core.views import AsyncNotificationViewSet
+from messaging.views import AsyncMessageViewSet
+
+from . import urls
+
+router = SimpleRouter()
+router.register('content/posts', AsyncPostViewSet, basename='post')
+router.register('messaging/messages', AsyncMessageViewSet, basename='message')
+router.register('messaging/notifications', AsyncNotificationViewSet, basename='notification')
+
+urlpatterns = router.urls + urls.urlpatterns
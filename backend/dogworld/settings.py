@@ -11,13 +11,17 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from datetime import timedelta
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# `manage.py test` is running.
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -64,6 +68,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'core.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -72,6 +77,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.routers.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'dogworld.urls'
@@ -99,16 +105,114 @@ WSGI_APPLICATION = 'dogworld.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': config('DB_ENGINE', default='django.db.backends.mysql'),
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
-        'PORT': '3306',
+        'PORT': config('DB_PORT', default='3306'),
+    }
+}
+
+# Read replicas of `default`, as comma-separated hosts. With SQLite they
+# are database files standing in for replicas; those get test databases of
+# their own, while real replicas read the default test database.
+for number, replica in enumerate(config('DB_REPLICAS', default='', cast=Csv()), 1):
+    if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': replica}
+    else:
+        DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': replica,
+                                         'TEST': {'MIRROR': 'default'}}
+
+# Safe-method reads of the content, marketplace and services ViewSets go to
+# a random replica (core/routers.py). Users who wrote are kept on the
+# primary for STICKY_SECONDS so they always see their own writes; the pins
+# are cached, so several workers need a shared CACHE_BACKEND.
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': config('DB_STICKY_SECONDS', default=5, cast=int),
+}
+
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND',
+                          default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='dogworld'),
     }
 }
 
 
+# Server-sent event stream (/messaging/stream/). Use
+# 'messaging.events.RedisBroker' with EVENT_BROKER_URL to share events
+# between several ASGI workers; it needs `pip install redis`.
+EVENT_STREAM = {
+    'BROKER': config('EVENT_BROKER', default='messaging.events.LocalBroker'),
+    'BROKER_URL': config('EVENT_BROKER_URL', default=''),
+    'HEARTBEAT_SECONDS': 15,
+    'QUEUE_SIZE': 100,
+    'MAX_CONNECTIONS_PER_USER': 5,
+    'TICKET_SECONDS': 30,
+}
+
+
+# Notification side effects of comments, ratings and messages are queued in
+# the outbox table and carried out by `manage.py process_outbox`, which must
+# run alongside the web workers: nothing is delivered without it. The
+# grouped notification handlers hold a per-target counter row lock until
+# they commit, so keeping them in the worker keeps that lock out of request
+# threads. EAGER runs them in the request thread right after commit instead;
+# only use it without concurrent writers, e.g. in development.
+OUTBOX = {
+    'EAGER': config('OUTBOX_EAGER', default=False, cast=bool),
+    'BATCH_SIZE': 100,
+    'MAX_ATTEMPTS': 8,
+}
+
+# Days notifications are kept, per type and read state (None keeps them);
+# `manage.py prune_notifications` deletes or archives older ones.
+NOTIFICATION_RETENTION = {
+    'affiliate_click': {'read': 30, 'unread': 180},
+    'default': {'read': 180, 'unread': 365},
+}
+
+# Uploaded images are resized into thumb/card/full WebP and JPEG variants by
+# a background thread pool; 0 workers renders inline after commit instead,
+# which is the default under `manage.py test`.
+IMAGE_RENDITIONS = {
+    'WORKERS': config('IMAGE_RENDITION_WORKERS', default=0 if TESTING else 2, cast=int),
+}
+
+# Affiliate clicks are buffered in memory and flushed as counter increments
+# after this many clicks or seconds, whichever comes first.
+CLICK_BUFFER_MAX_EVENTS = 500
+CLICK_BUFFER_MAX_AGE_SECONDS = 30
+
+# List endpoints of posts, blogs, products, services and messages serialize
+# `.values()` rows through compiled accessors (core/compiled.py) and render
+# with orjson when it is installed. Payloads are identical either way.
+COMPILED_READS = config('COMPILED_READS', default=True, cast=bool)
+
+# Under ASGI, post list and detail, conversations, message history, unread
+# counts and notifications are served by async views on the event loop
+# (core/asyncviews.py) instead of holding a thread while they wait on the
+# database. WSGI always serves the sync views. Off by default: Django's
+# async ORM still runs every query on one shared thread, so measure with
+# `manage.py benchmark_concurrency` against the production database first.
+ASYNC_READS = config('ASYNC_READS', default=False, cast=bool)
+
+# Per-route latency, query, serialization and size histograms
+# (core/metrics.py), at /analytics/requests/ for staff and at /metrics for
+# Prometheus, which is off until a bearer TOKEN is set. A query shape run
+# N_PLUS_ONE_THRESHOLD times in one request is logged as a likely N+1.
+REQUEST_METRICS = {
+    'ENABLED': config('REQUEST_METRICS', default=True, cast=bool),
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'TOKEN': config('METRICS_TOKEN', default=''),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
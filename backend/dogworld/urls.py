@@ -19,6 +19,7 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 from debug_toolbar.toolbar import debug_toolbar_urls
+from core.views import ClickAnalyticsView, RequestMetricsView, prometheus_metrics
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -40,6 +41,9 @@ urlpatterns = [
     path('services/', include('services.urls')),
     path('messaging/', include('messaging.urls')),
     path('users/', include('core.urls')),
+    path('analytics/clicks/', ClickAnalyticsView.as_view(), name='click-analytics'),
+    path('analytics/requests/', RequestMetricsView.as_view(), name='request-metrics'),
+    path('metrics', prometheus_metrics, name='metrics'),
 ] + debug_toolbar_urls()
 
 if settings.DEBUG:
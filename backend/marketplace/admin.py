@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import reverse
 from django.utils.html import format_html
+from core.renditions import thumbnail_url
 from django.utils.http import urlencode
 from django.db.models import Count
 from .models import Product, Category
@@ -25,7 +26,7 @@ class ProductAdmin(admin.ModelAdmin):
 
     def thumbnail(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="width: 60px; height: 60px; object-fit: cover;" />', obj.image.url)
+            return format_html('<img src="{}" style="width: 60px; height: 60px; object-fit: cover;" />', thumbnail_url(obj.image, obj.image_renditions))
         return 'No Image'
     thumbnail.short_description = 'Image Preview'
 
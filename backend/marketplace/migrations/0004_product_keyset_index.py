@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0003_remove_product_tags_delete_tag'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at', 'id'], name='marketplace_updated_021dfe_idx'),
+        ),
+    ]
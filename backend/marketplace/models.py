@@ -12,6 +12,7 @@ class Product(models.Model):
     affiliate_url = models.URLField()
     image = models.ImageField(
         upload_to='product_images/', blank=True, null=True)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey(
         'Category', on_delete=models.PROTECT, blank=True, null=True)
     is_active = models.BooleanField(default=True)
@@ -24,6 +25,9 @@ class Product(models.Model):
     class Meta:
         ordering = ['-updated_at']
         verbose_name_plural = 'Products'
+        indexes = [
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
 
 class Category(models.Model):
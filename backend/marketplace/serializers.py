@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from .models import Product, Category
 
+from core.fieldsets import SparseFieldsMixin
+from core.serializers import ImageRenditionsField
 
-class CategorySerializer(serializers.ModelSerializer):
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     products_count = serializers.IntegerField(read_only=True)
 
     class Meta:
@@ -10,7 +13,7 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'slug', 'products_count']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     # For read operations, return the full category object
     category = CategorySerializer(read_only=True)
     # For write operations, accept category ID
@@ -19,8 +22,9 @@ class ProductSerializer(serializers.ModelSerializer):
         source='category',
         write_only=True
     )
+    image_renditions = ImageRenditionsField()
 
     class Meta:
         model = Product
         fields = ['id', 'title', 'slug', 'description', 'price', 'affiliate_url',
-                  'image', 'category', 'category_id', 'is_active', 'created_at', 'updated_at']
+                  'image', 'image_renditions', 'category', 'category_id', 'is_active', 'created_at', 'updated_at']
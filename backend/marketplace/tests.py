@@ -1,3 +1,21 @@
 from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from .models import Product
+
+
+class ProductKeysetTests(TestCase):
+    def test_cursor_walks_products_by_update(self):
+        for i in range(7):
+            Product.objects.create(title=f'Leash {i}', price=10, affiliate_url='https://example.com')
+        Product.objects.filter(title__in=['Leash 1', 'Leash 2', 'Leash 3']).update(
+            updated_at=timezone.now())
+        expected = list(Product.objects.order_by('-updated_at', '-id')
+                        .values_list('pk', flat=True))
+
+        url, seen = '/marketplace/products/?pagination=cursor&page_size=3', []
+        while url:
+            response = self.client.get(url)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
@@ -1,5 +1,3 @@
-from django.contrib.auth import get_user_model
-from django.contrib.contenttypes.models import ContentType
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Count
 from rest_framework import status
@@ -8,17 +6,19 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.decorators import action
 
-from core.models import Notification
-from core.utils import create_notification
-from core.pagination import DefaultPagination
+from core.analytics import record_click
+from core.compiled import CompiledListMixin
+from core.fieldsets import SparseFieldsetMixin
+from core.pagination import DefaultPagination, HybridPagination
 from core.permissions import IsAdminOrReadOnly
+from core.routers import ReplicaReadMixin
 from rest_framework.permissions import AllowAny
 from .serializers import CategorySerializer, ProductSerializer
 from .models import Product, Category
 from .filters import ProductFilter
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, SparseFieldsetMixin, CompiledListMixin, ModelViewSet):
     queryset = Product.objects.select_related('category').order_by('title')
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -28,31 +28,22 @@ class ProductViewSet(ModelViewSet):
     ordering_fields = ['id', 'title', 'price', 'created_at']
     lookup_field = 'slug'
     permission_classes = [IsAdminOrReadOnly]
-    pagination_class = DefaultPagination
+    pagination_class = HybridPagination
+    keyset_ordering = ('-updated_at', '-id')
 
     @action(detail=True, methods=['post'], url_path='click', permission_classes=[AllowAny])
     def register_click(self, request, slug=None):
         product = self.get_object()
         user = request.user if request.user.is_authenticated else None
 
-        if user and user.is_staff:
-            return Response({'status': 'Click registered'}, status=status.HTTP_200_OK)
-
-        staff_user = get_user_model().objects.filter(is_staff=True).first()
-        if not staff_user:
-            return Response({'status': 'Click registered'}, status=status.HTTP_200_OK)
+        if not (user and user.is_staff):
+            record_click(product)
 
-        create_notification(
-            recipient=staff_user,
-            notification_type=Notification.NOTIFICATION_TYPE_AFFILIATE_CLICKED,
-            message=f"{user.username if user else 'Anonymous'} clicked on {product.title}.",
-            content_object=product
-        )
         return Response({'status': 'Click registered'}, status=status.HTTP_200_OK)
 
 
-class CategoryViewSet(ModelViewSet):
-    queryset = Category.objects.annotate(products_count=Count('product')).all()
+class CategoryViewSet(ReplicaReadMixin, SparseFieldsetMixin, ModelViewSet):
+    queryset = Category.objects.all()
     serializer_class = CategorySerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['name', 'slug']
@@ -61,6 +52,13 @@ class CategoryViewSet(ModelViewSet):
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = DefaultPagination
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # The count joins every product; only pay for it when it is shown.
+        if self.wants_field('products_count'):
+            queryset = queryset.annotate(products_count=Count('product'))
+        return queryset
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
 
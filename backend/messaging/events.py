@@ -0,0 +1,216 @@
+"""
+Pub/sub delivery of per-user events (new notifications, new messages and
+read-state changes) to the server-sent event stream.
+
+`publish()` is safe to call from sync code and threads, e.g. signal
+handlers running inside sync views under ASGI. Subscribers are asyncio
+queues owned by the event loop serving the stream.
+
+Browsers open the stream with a single-use ticket from `issue_ticket()`
+instead of an access token, which would end up in access and proxy logs
+as part of the URL. Tickets live in the cache; with several workers
+CACHE_BACKEND has to be shared between them.
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BROKER': 'messaging.events.LocalBroker',
+    'BROKER_URL': '',
+    'HEARTBEAT_SECONDS': 15,
+    'QUEUE_SIZE': 100,
+    'MAX_CONNECTIONS_PER_USER': 5,
+    'TICKET_SECONDS': 30,
+}
+TICKET_KEY = 'stream-ticket:{}'
+
+# Put on a subscriber queue when it overflows; the stream tells the client
+# to resync and closes instead of buffering without bound.
+OVERFLOW = object()
+
+
+def stream_setting(name):
+    return getattr(settings, 'EVENT_STREAM', {}).get(name, DEFAULTS[name])
+
+
+class TooManyConnections(Exception):
+    pass
+
+
+def issue_ticket(user_id):
+    """A single-use token that opens one of `user_id`'s streams for TICKET_SECONDS"""
+    ticket = secrets.token_urlsafe(32)
+    cache.set(TICKET_KEY.format(ticket), user_id, stream_setting('TICKET_SECONDS'))
+    return ticket
+
+
+def redeem_ticket(ticket):
+    """The user id of a ticket that has not expired or been used yet, else None"""
+    key = TICKET_KEY.format(ticket)
+    user_id = cache.get(key)
+    # Only one of several concurrent redeemers gets to delete the key.
+    if user_id is None or not cache.delete(key):
+        return None
+    return user_id
+
+
+class Subscription:
+    def __init__(self, broker, user_id, loop, maxsize):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        """Runs on the subscriber's loop; never blocks the publisher"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process broker; events only reach streams served by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        subscription = Subscription(
+            self, user_id, asyncio.get_running_loop(),
+            stream_setting('QUEUE_SIZE'))
+        with self._lock:
+            subscriptions = self._subscribers.setdefault(user_id, set())
+            if len(subscriptions) >= stream_setting('MAX_CONNECTIONS_PER_USER'):
+                raise TooManyConnections(user_id)
+            subscriptions.add(subscription)
+        return subscription
+
+    def connections(self, user_id):
+        """Streams `user_id` has open in this process"""
+        with self._lock:
+            return len(self._subscribers.get(user_id, ()))
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.user_id, None)
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # The loop has shut down underneath a stale subscription.
+                self.unsubscribe(subscription)
+
+    def publish(self, user_id, event):
+        self.deliver(user_id, event)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Shares events between worker processes through Redis pub/sub. Each
+    process keeps one listener connection and fans events out locally.
+    Requires the optional `redis` package and EVENT_STREAM['BROKER_URL'].
+    """
+    channel_prefix = 'dogworld:events:'
+
+    def __init__(self):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured(
+                "messaging.events.RedisBroker requires the redis package; "
+                "install it with `pip install redis`.")
+        self._url = stream_setting('BROKER_URL')
+        self._client = redis.Redis.from_url(self._url)
+        self._listener = None
+
+    def publish(self, user_id, event):
+        self._client.publish(
+            f'{self.channel_prefix}{user_id}',
+            json.dumps(event, cls=DjangoJSONEncoder))
+
+    def subscribe(self, user_id):
+        subscription = super().subscribe(user_id)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return subscription
+
+    async def _listen(self):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self._url)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(f'{self.channel_prefix}*')
+        try:
+            async for message in pubsub.listen():
+                if message['type'] != 'pmessage':
+                    continue
+                channel = message['channel'].decode()
+                user_id = int(channel[len(self.channel_prefix):])
+                self.deliver(user_id, json.loads(message['data']))
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(stream_setting('BROKER'))()
+
+
+def publish(user_id, event_type, data):
+    """Publish an event to a user's streams once the transaction commits"""
+    event = {'type': event_type, 'data': data}
+
+    def send():
+        try:
+            get_broker().publish(user_id, event)
+        except Exception:
+            logger.exception(f"Failed to publish {event_type} event to user {user_id}")
+
+    transaction.on_commit(send)
+
+
+def format_event(event, event_id=None):
+    """Encode an event in the text/event-stream wire format"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], cls=DjangoJSONEncoder)}")
+    return '\n'.join(lines) + '\n\n'
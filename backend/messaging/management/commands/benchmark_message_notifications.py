@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from core.models import Notification, OutboxEvent
+from messaging.models import Message, MessageNotificationCounter
+from messaging.signals import notify_message
+
+
+USERNAME_PREFIX = 'notification-bench-'
+
+
+class Command(BaseCommand):
+    help = ('Fire parallel messages from many senders at one receiver, run the '
+            'notification coalescing concurrently and check the resulting '
+            'counts. Seeded users are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--senders', type=int, default=20)
+        parser.add_argument('--messages', type=int, default=10,
+                            help='Messages sent by each sender.')
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        receiver = User.objects.create(
+            username=f'{USERNAME_PREFIX}receiver',
+            email=f'{USERNAME_PREFIX}receiver@example.com')
+        User.objects.bulk_create(
+            User(username=f'{USERNAME_PREFIX}{i}',
+                 email=f'{USERNAME_PREFIX}{i}@example.com')
+            for i in range(options['senders']))
+        # bulk_create does not return primary keys on every backend
+        senders = list(User.objects.filter(
+            username__startswith=USERNAME_PREFIX).exclude(pk=receiver.pk))
+        try:
+            self.run(receiver, senders, options['messages'], options['threads'])
+        finally:
+            ids = list(Message.objects.filter(receiver=receiver).values_list('id', flat=True))
+            OutboxEvent.objects.filter(
+                topic='messaging.message_created', payload__message_id__in=ids).delete()
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def run(self, receiver, senders, messages, threads):
+        sends = [sender for sender in senders for _ in range(messages)]
+
+        def send(sender):
+            try:
+                with transaction.atomic():
+                    message = Message.objects.create(
+                        sender=sender, receiver=receiver, content='Hello')
+                    # The coalescing the outbox worker would run for it.
+                    notify_message(message.id)
+            finally:
+                connections.close_all()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(send, sends))
+        elapsed = time.perf_counter() - started
+
+        notifications = Notification.objects.filter(
+            recipient=receiver,
+            notification_type=Notification.NOTIFICATION_TYPE_NEW_MESSAGE)
+        counts = {
+            notification.extra_data['sender_id']: notification.extra_data['unread_count']
+            for notification in notifications
+        }
+        counters = dict(MessageNotificationCounter.objects.filter(
+            recipient=receiver).values_list('sender_id', 'unread_count'))
+
+        self.stdout.write(
+            f'{len(sends)} messages from {len(senders)} senders on {threads} threads '
+            f'in {elapsed:.2f}s ({len(sends) / elapsed:.0f} messages/s).')
+        expected = {sender.id: messages for sender in senders}
+        if notifications.count() != len(senders) or counts != expected or counters != expected:
+            raise CommandError(
+                f'Lost or duplicated increments: {notifications.count()} notifications, '
+                f'counts {counts}, counters {counters}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'One notification per sender with {messages} unread messages each.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from messaging.models import Conversation
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-participant conversation summaries from the messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of users whose summaries are rebuilt per transaction.')
+
+    def handle(self, *args, **options):
+        rebuilt = Conversation.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rebuilt} conversation summaries.'))
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def populate_conversations(apps, schema_editor):
+    Message = apps.get_model('messaging', 'Message')
+    Conversation = apps.get_model('messaging', 'Conversation')
+
+    summaries = {}
+    sent = Message.objects.filter(is_deleted_by_sender=False).values_list(
+        'sender_id', 'receiver_id'
+    ).annotate(last_id=Max('id'), last_activity=Max('sent_at')).order_by()
+    for owner_id, other_user_id, last_id, last_activity in sent.iterator():
+        summaries[(owner_id, other_user_id)] = [last_id, last_activity, 0]
+    received = Message.objects.filter(is_deleted_by_receiver=False).values_list(
+        'receiver_id', 'sender_id'
+    ).annotate(
+        last_id=Max('id'), last_activity=Max('sent_at'),
+        unread=Count('id', filter=Q(is_read=False)),
+    ).order_by()
+    for owner_id, other_user_id, last_id, last_activity, unread in received.iterator():
+        summary = summaries.setdefault(
+            (owner_id, other_user_id), [last_id, last_activity, 0])
+        summary[0] = max(summary[0], last_id)
+        summary[1] = max(summary[1], last_activity)
+        summary[2] = unread
+
+    Conversation.objects.bulk_create((
+        Conversation(owner_id=owner_id, other_user_id=other_user_id,
+                     last_message_id=last_id, last_activity=last_activity,
+                     unread_count=unread)
+        for (owner_id, other_user_id), (last_id, last_activity, unread)
+        in summaries.items()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_message_messaging_m_sender__fd66f3_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.message')),
+                ('other_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', 'is_deleted', '-last_activity'], name='messaging_c_owner_i_240c5d_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'other_user'), name='unique_conversation_participant')],
+            },
+        ),
+        migrations.RunPython(populate_conversations, migrations.RunPython.noop),
+    ]
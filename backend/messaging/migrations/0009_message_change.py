@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0008_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.PositiveBigIntegerField()),
+                ('change_type', models.CharField(choices=[('new', 'New'), ('read', 'Read'), ('deleted', 'Deleted')], max_length=10)),
+                ('other_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='messaging_m_user_id_4ba88e_idx'), models.Index(fields=['user', 'other_user', 'id'], name='messaging_m_user_id_48a6ac_idx')],
+            },
+        ),
+    ]
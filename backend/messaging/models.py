@@ -1,7 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.conf import settings
-from django.db.models import Q, Max, Count, Case, When, IntegerField
+from django.db.models import Q, F, Max, Count
 
 
 from .validators import validate_file_extension, validate_file_size
@@ -16,40 +16,13 @@ class MessageManager(models.Manager):
         ).order_by('sent_at')
 
     def get_user_conversations(self, user):
-        """Get all conversations for a user with metadata - OPTIMIZED"""
-        # Subquery to get the latest message for each conversation
-        conversations = (
-            self.filter(
-                Q(sender=user, is_deleted_by_sender=False) |
-                Q(receiver=user, is_deleted_by_receiver=False)
-            )
-            .annotate(
-                # Determine the other participant
-                other_user_id=Case(
-                    When(sender=user, then='receiver_id'),
-                    default='sender_id',
-                    output_field=IntegerField(),
-                )
-            )
-            .values('other_user_id')
-            .annotate(
-                latest_message_id=Max('id'),
-                last_activity=Max('sent_at'),
-                unread_count=Count(
-                    Case(
-                        When(
-                            receiver=user,
-                            is_read=False,
-                            is_deleted_by_receiver=False,
-                            then=1
-                        ),
-                        output_field=IntegerField()
-                    )
-                )
-            )
-            .order_by('-last_activity')
+        """Get all conversations for a user with metadata"""
+        return Conversation.objects.for_user(user).values(
+            'other_user_id',
+            'last_activity',
+            'unread_count',
+            latest_message_id=F('last_message_id'),
         )
-        return conversations
 
     def get_conversation_with_user(self, user, other_user_id):
         """Get conversation between user and specific other user"""
@@ -70,15 +43,20 @@ class MessageManager(models.Manager):
 
     def mark_conversation_as_read(self, user, other_user):
         """Mark all messages from other_user to user as read"""
-        return self.filter(
-            sender=other_user,
-            receiver=user,
-            is_read=False,
-            is_deleted_by_receiver=False
-        ).update(
-            is_read=True,
-            read_at=timezone.now()
-        )
+        with transaction.atomic():
+            unread = list(self.filter(
+                sender=other_user,
+                receiver=user,
+                is_read=False,
+                is_deleted_by_receiver=False
+            ).values_list('id', 'sender_id', 'receiver_id'))
+            updated = self.filter(id__in=[row[0] for row in unread]).update(
+                is_read=True,
+                read_at=timezone.now()
+            )
+            Conversation.objects.record_conversation_read(user, other_user)
+            MessageChange.objects.record(MessageChange.CHANGE_READ, unread)
+        return updated
 
 
 class Message(models.Model):
@@ -115,7 +93,10 @@ class Message(models.Model):
         if not self.is_read:
             self.is_read = True
             self.read_at = timezone.now()
-            self.save(update_fields=['is_read', 'read_at'])
+            with transaction.atomic():
+                self.save(update_fields=['is_read', 'read_at'])
+                if not self.is_deleted_by_receiver:
+                    Conversation.objects.record_read(self.receiver_id, self.sender_id)
 
     def get_other_participant(self, user):
         """Get the other participant in the conversation"""
@@ -142,3 +123,269 @@ class Message(models.Model):
                          'is_deleted_by_receiver']),
             models.Index(fields=['receiver', 'is_deleted_by_receiver']),
         ]
+
+
+class ConversationManager(models.Manager):
+    def for_user(self, user):
+        """A user's inbox, newest activity first: one indexed range read"""
+        return self.select_related(
+            'other_user', 'last_message__sender', 'last_message__receiver'
+        ).filter(
+            owner=user, is_deleted=False, last_message__isnull=False
+        ).order_by('-last_activity')
+
+    def record_message(self, message):
+        """Fold a newly sent message into both participants' summaries"""
+        pairs = [(message.sender_id, message.receiver_id, 0)]
+        if message.sender_id != message.receiver_id:
+            pairs.append((message.receiver_id, message.sender_id, 1))
+
+        for owner_id, other_user_id, unread in pairs:
+            self.get_or_create(owner_id=owner_id, other_user_id=other_user_id)
+            summary = self.filter(owner_id=owner_id, other_user_id=other_user_id)
+            if unread:
+                summary.update(unread_count=F('unread_count') + unread)
+            # Concurrent sends may commit out of order; keep the newest.
+            summary.filter(
+                Q(last_message__isnull=True) | Q(last_message_id__lt=message.id)
+            ).update(
+                last_message_id=message.id,
+                last_activity=message.sent_at,
+                is_deleted=False,
+            )
+
+    def record_read(self, owner, other_user, count=1):
+        self.filter(
+            owner=owner, other_user=other_user, unread_count__gte=count
+        ).update(unread_count=F('unread_count') - count)
+
+    def record_conversation_read(self, owner, other_user):
+        self.filter(owner=owner, other_user=other_user).update(unread_count=0)
+
+    def record_deleted(self, owner, other_user):
+        self.filter(owner=owner, other_user=other_user).update(
+            is_deleted=True, unread_count=0, last_message=None)
+
+    def refresh(self, owner_id, other_user_id):
+        """Recompute one participant's summary from the messages themselves"""
+        summary = Message.objects.filter(
+            Q(sender_id=owner_id, receiver_id=other_user_id, is_deleted_by_sender=False) |
+            Q(sender_id=other_user_id, receiver_id=owner_id, is_deleted_by_receiver=False)
+        ).aggregate(
+            last_message_id=Max('id'),
+            last_activity=Max('sent_at'),
+            unread_count=Count('id', filter=Q(receiver_id=owner_id, is_read=False)),
+        )
+        if summary['last_message_id'] is None:
+            self.filter(owner_id=owner_id, other_user_id=other_user_id).update(
+                is_deleted=True, unread_count=0, last_message=None)
+            return
+        self.update_or_create(
+            owner_id=owner_id, other_user_id=other_user_id,
+            defaults={**summary, 'is_deleted': False},
+        )
+
+    def rebuild(self, batch_size=1000):
+        """
+        Recompute every summary from the messages, `batch_size` owners at a
+        time with two grouped queries each, where `refresh` takes several
+        queries per pair. Pairs without visible messages lose their summary.
+        Returns the number of summaries written.
+        """
+        User = self.model._meta.get_field('owner').related_model
+        written = 0
+        last_pk = None
+        while True:
+            owners = User.objects.order_by('pk')
+            if last_pk is not None:
+                owners = owners.filter(pk__gt=last_pk)
+            owner_ids = list(owners.values_list('pk', flat=True)[:batch_size])
+            if not owner_ids:
+                return written
+            last_pk = owner_ids[-1]
+
+            summaries = {}
+            sent = Message.objects.filter(
+                sender_id__gte=owner_ids[0], sender_id__lte=last_pk,
+                is_deleted_by_sender=False
+            ).values_list('sender_id', 'receiver_id').annotate(
+                last_id=Max('id'), last_activity=Max('sent_at')).order_by()
+            for owner_id, other_user_id, last_id, last_activity in sent:
+                summaries[(owner_id, other_user_id)] = [last_id, last_activity, 0]
+            received = Message.objects.filter(
+                receiver_id__gte=owner_ids[0], receiver_id__lte=last_pk,
+                is_deleted_by_receiver=False
+            ).values_list('receiver_id', 'sender_id').annotate(
+                last_id=Max('id'), last_activity=Max('sent_at'),
+                unread=Count('id', filter=Q(is_read=False)),
+            ).order_by()
+            for owner_id, other_user_id, last_id, last_activity, unread in received:
+                summary = summaries.setdefault(
+                    (owner_id, other_user_id), [last_id, last_activity, 0])
+                summary[0] = max(summary[0], last_id)
+                summary[1] = max(summary[1], last_activity)
+                summary[2] = unread
+
+            with transaction.atomic():
+                self.filter(owner_id__gte=owner_ids[0], owner_id__lte=last_pk).delete()
+                self.bulk_create([
+                    self.model(owner_id=owner_id, other_user_id=other_user_id,
+                               last_message_id=last_id, last_activity=last_activity,
+                               unread_count=unread)
+                    for (owner_id, other_user_id), (last_id, last_activity, unread)
+                    in summaries.items()
+                ], batch_size=batch_size)
+            written += len(summaries)
+
+
+class Conversation(models.Model):
+    """Per-participant summary of a conversation between two users"""
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversations'
+    )
+    other_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    last_activity = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    is_deleted = models.BooleanField(default=False)
+
+    objects = ConversationManager()
+
+    def __str__(self):
+        return f'Conversation of {self.owner_id} with {self.other_user_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'other_user'], name='unique_conversation_participant'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'is_deleted', '-last_activity']),
+        ]
+
+
+class MessageChangeManager(models.Manager):
+    def record(self, change_type, messages, users=None):
+        """
+        Log a change to each of `messages` (Message instances or
+        (id, sender_id, receiver_id) tuples) for both participants, or
+        only for `users` when given.
+        """
+        changes = []
+        for message in messages:
+            if isinstance(message, Message):
+                message = (message.id, message.sender_id, message.receiver_id)
+            message_id, sender_id, receiver_id = message
+            for user_id, other_user_id in ((sender_id, receiver_id),
+                                           (receiver_id, sender_id)):
+                if users is None or user_id in users:
+                    changes.append(self.model(
+                        user_id=user_id,
+                        other_user_id=other_user_id,
+                        message_id=message_id,
+                        change_type=change_type,
+                    ))
+        return self.bulk_create(changes, batch_size=1000)
+
+
+class MessageChange(models.Model):
+    """
+    Append-only log of message changes per participant. Ids are the sync
+    tokens handed to clients, and rows outlive hard-deleted messages.
+    """
+    CHANGE_NEW = 'new'
+    CHANGE_READ = 'read'
+    CHANGE_DELETED = 'deleted'
+
+    CHANGE_TYPES = [
+        (CHANGE_NEW, 'New'),
+        (CHANGE_READ, 'Read'),
+        (CHANGE_DELETED, 'Deleted'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    other_user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    message_id = models.PositiveBigIntegerField()
+    change_type = models.CharField(max_length=10, choices=CHANGE_TYPES)
+
+    objects = MessageChangeManager()
+
+    def __str__(self):
+        return f'{self.get_change_type_display()} message {self.message_id} for {self.user_id}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'other_user', 'id']),
+        ]
+
+
+class MessageNotificationCounterManager(models.Manager):
+    def increment(self, recipient_id, sender_id):
+        """
+        Count one more unread message from `sender_id` and return the
+        counter. The upsert and F() increment never wait on a shared row:
+        only concurrent sends between the same pair serialize, on this
+        counter's row lock, until the caller's transaction commits.
+        """
+        self.bulk_create(
+            [self.model(recipient_id=recipient_id, sender_id=sender_id)],
+            ignore_conflicts=True,
+        )
+        self.filter(recipient_id=recipient_id, sender_id=sender_id).update(
+            unread_count=F('unread_count') + 1, updated_at=timezone.now())
+        return self.get(recipient_id=recipient_id, sender_id=sender_id)
+
+
+class MessageNotificationCounter(models.Model):
+    """Unread messages behind the current new message notification of a pair"""
+    recipient = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    notification = models.ForeignKey(
+        'core.Notification',
+        on_delete=models.SET_NULL,
+        related_name='+',
+        null=True,
+        blank=True
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = MessageNotificationCounterManager()
+
+    def __str__(self):
+        return f'{self.unread_count} unread from {self.sender_id} to {self.recipient_id}'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipient', 'sender'], name='unique_message_notification_counter'),
+        ]
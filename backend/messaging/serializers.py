@@ -1,14 +1,17 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from django.utils import timezone
 from rest_framework import serializers
 from .models import Message
+from core.cards import UserCardMixin
+from core.fieldsets import SparseFieldsMixin
 import logging
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
-class MessageUserSerializer(serializers.ModelSerializer):
+class MessageUserSerializer(UserCardMixin, serializers.ModelSerializer):
     # Serializer for user info in messages
     full_name = serializers.SerializerMethodField()
     profile_image = serializers.SerializerMethodField()
@@ -30,7 +33,7 @@ class MessageUserSerializer(serializers.ModelSerializer):
         return None
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     sender = MessageUserSerializer(read_only=True)
     receiver = MessageUserSerializer(read_only=True)
     receiver_id = serializers.IntegerField(write_only=True)
@@ -45,6 +48,7 @@ class MessageSerializer(serializers.ModelSerializer):
             'read_at', 'time_ago'
         ]
         read_only_fields = ['id', 'sender', 'is_read', 'sent_at', 'read_at']
+        read_dependencies = {'attachment_url': ['attachment'], 'time_ago': ['sent_at']}
 
     def get_time_ago(self, obj):
         now = timezone.now()
@@ -82,12 +86,13 @@ class MessageSerializer(serializers.ModelSerializer):
         receiver_id = validated_data.pop('receiver_id')
         receiver = User.objects.get(id=receiver_id)
 
-        # ✅ Only create the message
-        message = Message.objects.create(
-            sender_id=sender_id,
-            receiver=receiver,
-            **validated_data
-        )
+        # Conversation summaries are updated by signal in the same transaction
+        with transaction.atomic():
+            message = Message.objects.create(
+                sender_id=sender_id,
+                receiver=receiver,
+                **validated_data
+            )
 
         return message
 
@@ -1,10 +1,14 @@
-from django.db.models.signals import post_save
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.db import transaction
-from .models import Message
+from .models import Message, Conversation, MessageChange, MessageNotificationCounter
+from .events import publish
 from core.models import Notification
+from core.outbox import enqueue, handler
+from core.utils import get_target_url
 from django.contrib.contenttypes.models import ContentType
 import logging
 
@@ -14,76 +18,130 @@ logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Message)
-def create_message_notification(sender, instance, created, **kwargs):
+def update_conversation_summaries(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Conversation.objects.record_message(instance)
+
+
+@receiver(post_save, sender=Message)
+def record_message_changes(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        MessageChange.objects.record(MessageChange.CHANGE_NEW, [instance])
+    elif update_fields and 'is_read' in update_fields and instance.is_read:
+        MessageChange.objects.record(MessageChange.CHANGE_READ, [instance])
+
+
+def _messages_deleted(deleted):
+    """Refresh summaries and log deletions for (id, sender_id, receiver_id) rows"""
+    for sender_id, receiver_id in {(row[1], row[2]) for row in deleted}:
+        Conversation.objects.refresh(sender_id, receiver_id)
+        if sender_id != receiver_id:
+            Conversation.objects.refresh(receiver_id, sender_id)
+    MessageChange.objects.record(MessageChange.CHANGE_DELETED, deleted)
+
+
+@receiver(post_delete, sender=Message)
+def handle_message_deleted(sender, instance, origin=None, **kwargs):
+    # Summaries and change logs of a deleted user cascade away with the user.
+    if isinstance(origin, User) or (isinstance(origin, QuerySet) and origin.model is User):
+        return
+
+    row = (instance.id, instance.sender_id, instance.receiver_id)
+    if not isinstance(origin, QuerySet):
+        _messages_deleted([row])
+        return
+
+    # Bulk delete: handle the whole batch once it has been deleted.
+    deleted = origin.__dict__.setdefault('_deleted_messages', [])
+    if not deleted:
+        transaction.on_commit(lambda: _messages_deleted(deleted))
+    deleted.append(row)
+
+
+@receiver(post_save, sender=Message)
+def create_message_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        enqueue('messaging.message_created', message_id=instance.id)
+
+
+@handler('messaging.message_created')
+def notify_message(message_id):
     """
-    Create notification for new messages with improved efficiency and error handling
+    Create or update the receiver's new message notification for the sender
     """
-    if not created:
+    message = (Message.objects.select_related('sender', 'receiver')
+               .filter(pk=message_id).first())
+    if message is None:
         return
 
     # Skip notifications for self-messages or staff messages
-    if instance.sender == instance.receiver or instance.sender.is_staff:
+    if message.sender == message.receiver or message.sender.is_staff:
         return
 
-    try:
-        # Use atomic transaction to prevent race conditions
-        with transaction.atomic():
-            sender_name = (
-                f"{instance.sender.first_name} {instance.sender.last_name}".strip()
-                or instance.sender.username
-            )
-
-            # Use select_for_update to prevent race conditions on notification updates
-            existing_notification = (
-                Notification.objects
-                .select_for_update()
-                .filter(
-                    recipient=instance.receiver,
-                    notification_type=Notification.NOTIFICATION_TYPE_NEW_MESSAGE,
-                    is_read=False,
-                    # Only look for recent notifications (last 24 hours) to avoid
-                    # grouping with very old unread notifications
-                    created_at__gte=timezone.now() - timezone.timedelta(days=1)
-                )
-                .first()
-            )
-
-            if existing_notification:
-                # Increment unread counter safely
-                unread_count = existing_notification.extra_data.get(
-                    "unread_count", 1)
-                existing_notification.extra_data["unread_count"] = unread_count + 1
-                existing_notification.message = (
-                    f"{sender_name} sent you "
-                    f"{existing_notification.extra_data['unread_count']} new messages."
-                )
-                # Update timestamp to show latest activity
-                existing_notification.created_at = timezone.now()
-                existing_notification.save(
-                    update_fields=["extra_data", "message", "created_at"]
-                )
-                logger.info(
-                    f"Updated notification for user {instance.receiver.id}, "
-                    f"total unread: {existing_notification.extra_data['unread_count']}"
-                )
-            else:
-                # Create new notification
-                notification = Notification.objects.create(
-                    recipient=instance.receiver,
-                    notification_type=Notification.NOTIFICATION_TYPE_NEW_MESSAGE,
-                    message=f"{sender_name} sent you a new message.",
-                    content_object=instance,
-                    extra_data={"unread_count": 1,
-                                "sender_id": instance.sender.id},
-                )
-                logger.info(
-                    f"Created new message notification {notification.id} "
-                    f"for user {instance.receiver.id}"
-                )
-
-    except Exception as e:
-        logger.error(
-            f"Failed to create notification for message {instance.id}: {str(e)}",
-            exc_info=True
+    sender_name = (
+        f"{message.sender.first_name} {message.sender.last_name}".strip()
+        or message.sender.username
+    )
+
+    # Holds this pair's counter row until commit; other senders to the same
+    # receiver are not blocked.
+    counter = MessageNotificationCounter.objects.increment(
+        message.receiver_id, message.sender_id)
+
+    # Keep grouping into the current notification while it is unread and
+    # recent (last 24 hours); otherwise start a new one.
+    updated = 0
+    if counter.notification_id and counter.unread_count > 1:
+        updated = Notification.objects.filter(
+            pk=counter.notification_id,
+            is_read=False,
+            created_at__gte=timezone.now() - timezone.timedelta(days=1)
+        ).update(
+            message=f"{sender_name} sent you {counter.unread_count} new messages.",
+            extra_data={"unread_count": counter.unread_count,
+                        "sender_id": message.sender_id},
+            # Show latest activity
+            created_at=timezone.now(),
+        )
+
+    if not updated:
+        notification = Notification.objects.create(
+            recipient=message.receiver,
+            notification_type=Notification.NOTIFICATION_TYPE_NEW_MESSAGE,
+            message=f"{sender_name} sent you a new message.",
+            content_object=message,
+            target_url=get_target_url(message),
+            extra_data={"unread_count": 1,
+                        "sender_id": message.sender_id},
         )
-        # Don't raise the exception to prevent message creation from failing
+        MessageNotificationCounter.objects.filter(pk=counter.pk).update(
+            notification=notification, unread_count=1)
+    else:
+        # update() skips post_save; push the refreshed notification here.
+        publish_notification_event(
+            Notification, Notification.objects.get(pk=counter.notification_id))
+
+
+@receiver(post_save, sender=Message)
+def publish_message_event(sender, instance, created, update_fields=None, **kwargs):
+    from .serializers import MessageSerializer
+
+    if created:
+        data = MessageSerializer(instance).data
+        publish(instance.receiver_id, 'message', data)
+        publish(instance.sender_id, 'message', data)
+    elif update_fields and 'is_read' in update_fields and instance.is_read:
+        data = {'id': instance.id, 'read_at': instance.read_at,
+                'sender_id': instance.sender_id, 'receiver_id': instance.receiver_id}
+        publish(instance.sender_id, 'message_read', data)
+        publish(instance.receiver_id, 'message_read', data)
+
+
+@receiver(post_save, sender=Notification)
+def publish_notification_event(sender, instance, **kwargs):
+    from core.serializers import NotificationSerializer
+
+    publish(instance.recipient_id, 'notification',
+            NotificationSerializer(instance).data)
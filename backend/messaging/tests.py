@@ -1,3 +1,315 @@
-from django.test import TestCase
+import threading
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import MyUser, Notification, OutboxEvent
+from core.outbox import process_event
+
+from .events import RedisBroker, get_broker, issue_ticket
+from .models import Conversation, Message, MessageNotificationCounter
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                        'LOCATION': 'messaging-tests'}},
+    EVENT_STREAM={'BROKER': 'messaging.events.LocalBroker', 'HEARTBEAT_SECONDS': 5,
+                  'QUEUE_SIZE': 3, 'MAX_CONNECTIONS_PER_USER': 2, 'TICKET_SECONDS': 30},
+)
+class EventStreamTests(TestCase):
+    """The SSE stream against the in-process broker"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = MyUser.objects.create_user(
+            username='alice', email='alice@example.com', password='x')
+
+    def test_tickets_are_single_use(self):
+        client = APIClient()
+        self.assertEqual(client.post('/messaging/stream/ticket/').status_code, 401)
+        client.force_authenticate(self.alice)
+        ticket = client.post('/messaging/stream/ticket/').data['ticket']
+
+        self.assertEqual(self.client.get('/messaging/stream/', {'ticket': ticket}).status_code, 200)
+        self.assertEqual(self.client.get('/messaging/stream/', {'ticket': ticket}).status_code, 401)
+        self.assertEqual(self.client.get('/messaging/stream/', {'ticket': 'nope'}).status_code, 401)
+
+    def test_access_tokens_are_not_taken_from_the_url(self):
+        token = str(AccessToken.for_user(self.alice))
+        self.assertEqual(self.client.get('/messaging/stream/', {'token': token}).status_code, 401)
+        response = self.client.get('/messaging/stream/', headers={'authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_redis_broker_needs_the_optional_package(self):
+        with mock.patch.dict('sys.modules', {'redis': None}):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'pip install redis'):
+                RedisBroker()
+
+    async def open_stream(self):
+        response = await AsyncClient().get(
+            '/messaging/stream/', {'ticket': issue_ticket(self.alice.pk)})
+        self.assertEqual(response.status_code, 200)
+        return aiter(response.streaming_content)
+
+    async def test_streams_events_and_resyncs_slow_clients(self):
+        broker = get_broker()
+        stream = await self.open_stream()
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+
+        broker.publish(self.alice.pk, {'type': 'notification', 'data': {'id': 7}})
+        self.assertEqual(await anext(stream),
+                         b'id: 1\nevent: notification\ndata: {"id": 7}\n\n')
+
+        for i in range(5):
+            broker.publish(self.alice.pk, {'type': 'message', 'data': {'id': i}})
+        self.assertEqual(await anext(stream), b'event: resync\ndata: {}\n\n')
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertEqual(broker.connections(self.alice.pk), 0)
+
+    async def test_streams_subscribe_once_started(self):
+        broker = get_broker()
+        unstarted = [await self.open_stream() for _ in range(3)]
+        self.assertEqual(broker.connections(self.alice.pk), 0)
+
+        for stream in unstarted[:2]:
+            await anext(stream)
+        self.assertEqual(broker.connections(self.alice.pk), 2)
+        response = await AsyncClient().get(
+            '/messaging/stream/', {'ticket': issue_ticket(self.alice.pk)})
+        self.assertEqual(response.status_code, 429)
+
+        # The third stream lost the race for the last slot.
+        self.assertIn(b'event: error', await anext(unstarted[2]))
+        self.assertEqual(broker.connections(self.alice.pk), 2)
+        # Overflowing both queues ends both streams.
+        for _ in range(4):
+            broker.publish(self.alice.pk, {'type': 'message', 'data': {}})
+        for stream in unstarted[:2]:
+            self.assertEqual(await anext(stream), b'event: resync\ndata: {}\n\n')
+            self.assertIsNone(await anext(stream, None))
+        self.assertEqual(broker.connections(self.alice.pk), 0)
+
+
+class ConversationTests(TestCase):
+    """Conversation summaries follow the messages they summarize"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('alice', 'bob', 'carol'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, sender, receiver, content='Hi'):
+        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+
+    def summaries(self):
+        return {
+            (c.owner_id, c.other_user_id): (c.last_message_id, c.unread_count, c.is_deleted)
+            for c in Conversation.objects.all()
+        }
+
+    def inbox(self):
+        response = self.client.get('/messaging/messages/conversations/')
+        self.assertEqual(response.status_code, 200)
+        return [(row['participant']['username'], row['latest_message']['content'],
+                 row['unread_count']) for row in response.data]
+
+    def test_summaries_follow_messages(self):
+        self.send(self.bob, self.alice, 'One')
+        second = self.send(self.bob, self.alice, 'Two')
+        self.send(self.carol, self.alice, 'Three')
+        self.assertEqual(self.inbox(), [('carol', 'Three', 1), ('bob', 'Two', 2)])
+        self.assertEqual(self.summaries()[(self.bob.pk, self.alice.pk)], (second.pk, 0, False))
+
+        second.mark_as_read()
+        self.assertEqual(self.inbox()[1], ('bob', 'Two', 1))
+        self.client.post('/messaging/messages/mark_conversation_as_read/', {'user_id': self.bob.pk})
+        self.assertEqual(self.inbox()[1], ('bob', 'Two', 0))
+
+        second.delete()
+        self.assertEqual(self.inbox()[1], ('bob', 'One', 0))
+
+    def test_deleted_conversation_returns_with_new_messages(self):
+        self.send(self.bob, self.alice, 'Old')
+        self.client.post('/messaging/messages/delete_conversation/', {'user_id': self.bob.pk})
+        self.assertEqual(self.inbox(), [])
+        self.assertEqual(self.summaries()[(self.bob.pk, self.alice.pk)][2], False)
+
+        self.send(self.bob, self.alice, 'New')
+        self.assertEqual(self.inbox(), [('bob', 'New', 1)])
+
+    def test_rebuild_and_migration_backfill_match(self):
+        for sender, receiver in ((self.bob, self.alice), (self.alice, self.bob),
+                                 (self.carol, self.bob), (self.alice, self.alice)):
+            self.send(sender, receiver)
+        Message.objects.filter(sender=self.carol).update(is_deleted_by_sender=True)
+        Message.objects.filter(sender=self.bob).first().mark_as_read()
+        Conversation.objects.rebuild()
+        expected = self.summaries()
+
+        Conversation.objects.all().delete()
+        call_command('rebuild_conversations', batch_size=2, stdout=StringIO())
+        self.assertEqual(self.summaries(), expected)
+
+        Conversation.objects.all().delete()
+        import_module('messaging.migrations.0008_conversation').populate_conversations(apps, None)
+        self.assertEqual(self.summaries(), expected)
+
+
+class DeltaSyncTests(TestCase):
+    """/messaging/messages/sync/ replays each participant's changes after a token"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('alice', 'bob', 'carol'))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def sync(self, **params):
+        response = self.client.get('/messaging/messages/sync/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_replays_changes_after_token(self):
+        token = self.sync()['sync_token']
+        first = Message.objects.create(sender=self.bob, receiver=self.alice, content='One')
+        second = Message.objects.create(sender=self.alice, receiver=self.bob, content='Two')
+        Message.objects.create(sender=self.bob, receiver=self.carol, content='Elsewhere')
+
+        data = self.sync(token=token)
+        self.assertEqual([m['id'] for m in data['messages']], [first.pk, second.pk])
+        self.assertEqual((data['read'], data['deleted'], data['has_more']), ([], [], False))
+        token = data['sync_token']
+        self.assertEqual(self.sync()['sync_token'], token)
+
+        first.mark_as_read()
+        self.client.post('/messaging/messages/delete_conversation/', {'user_id': self.bob.pk})
+        data = self.sync(token=token)
+        self.assertEqual(data['messages'], [])
+        self.assertEqual(data['read'], [])
+        self.assertCountEqual(data['deleted'], [first.pk, second.pk])
+        self.assertEqual(self.sync(token=data['sync_token'])['deleted'], [])
+
+    def test_batches_and_filters(self):
+        token = self.sync()['sync_token']
+        for i in range(3):
+            Message.objects.create(sender=self.bob, receiver=self.alice, content=str(i))
+        carols = Message.objects.create(sender=self.carol, receiver=self.alice, content='Hi')
+
+        data = self.sync(token=token, limit=2)
+        self.assertEqual((len(data['messages']), data['has_more']), (2, True))
+        data = self.sync(token=data['sync_token'], limit=2)
+        self.assertEqual((len(data['messages']), data['has_more']), (2, False))
+
+        data = self.sync(token=token, user_id=self.carol.pk)
+        self.assertEqual([m['id'] for m in data['messages']], [carols.pk])
+        for params in ({'token': 'x'}, {'token': token, 'user_id': 'x'}):
+            self.assertEqual(self.client.get('/messaging/messages/sync/', params).status_code,
+                             400)
+        data = self.sync(token=token, limit=-5)
+        self.assertEqual((len(data['messages']), data['has_more']), (1, True))
+
+
+class MessageNotificationTests(TestCase):
+    """Unread messages from one sender share a single notification"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x',
+                                       first_name=name.title())
+            for name in ('alice', 'bob', 'carol'))
+
+    def send(self, sender, receiver=None):
+        message = Message.objects.create(sender=sender, receiver=receiver or self.alice,
+                                         content='Hi')
+        call_command('process_outbox', once=True, stdout=StringIO())
+        return message
+
+    def notifications(self):
+        return list(Notification.objects.filter(recipient=self.alice).order_by('id')
+                    .values_list('message', 'extra_data__unread_count'))
+
+    def test_coalesces_per_sender(self):
+        for _ in range(3):
+            self.send(self.bob)
+        self.send(self.carol)
+        self.assertEqual(self.notifications(), [('Bob sent you 3 new messages.', 3),
+                                                ('Carol sent you a new message.', 1)])
+
+    def test_starts_over_once_read_or_stale(self):
+        self.send(self.bob)
+        Notification.objects.update(is_read=True)
+        self.send(self.bob)
+        self.send(self.bob)
+        Notification.objects.update(created_at=timezone.now() - timezone.timedelta(days=2))
+        self.send(self.bob)
+        self.assertEqual([count for _, count in self.notifications()], [1, 2, 1])
+        self.assertEqual(MessageNotificationCounter.objects.get().unread_count, 1)
+
+    def test_skips_self_and_staff_messages(self):
+        self.send(self.alice)
+        self.send(MyUser.objects.create_user(
+            username='staff', email='staff@example.com', password='x', is_staff=True))
+        self.assertEqual(self.notifications(), [])
+
+    def test_interleaved_events_count_every_message(self):
+        # Handlers may run in any order, e.g. on several outbox workers.
+        for _ in range(3):
+            for sender in (self.bob, self.carol):
+                Message.objects.create(sender=sender, receiver=self.alice, content='Hi')
+        events = list(OutboxEvent.objects.values_list('id', flat=True))
+        for event_id in events[::2] + events[1::2]:
+            self.assertTrue(process_event(event_id))
+        self.assertEqual([count for _, count in self.notifications()], [3, 3])
+
+
+@skipIf(connection.vendor == 'sqlite', 'SQLite serializes writers; run against MySQL')
+class ConcurrentMessageNotificationTests(TransactionTestCase):
+    """Concurrent handlers for one pair serialize on its counter row"""
+
+    def test_concurrent_handlers(self):
+        alice, bob = (
+            MyUser.objects.create_user(username=name, email=f'{name}@example.com', password='x')
+            for name in ('alice', 'bob'))
+        for _ in range(8):
+            Message.objects.create(sender=bob, receiver=alice, content='Hi')
+        events = list(OutboxEvent.objects.values_list('id', flat=True))
+        barrier = threading.Barrier(len(events))
+        results = []
+
+        def run(event_id):
+            try:
+                barrier.wait()
+                results.append(process_event(event_id))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(event_id,)) for event_id in events]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [True] * len(events))
+        notification = Notification.objects.get(recipient=alice)
+        self.assertEqual(notification.extra_data['unread_count'], len(events))
+        self.assertEqual(MessageNotificationCounter.objects.get().unread_count, len(events))
@@ -1,10 +1,14 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from .views import MessageViewSet
+from .views import MessageViewSet, StreamTicketView, event_stream
 from core.views import NotificationViewSet
 
 router = DefaultRouter()
 router.register('messages', MessageViewSet, basename='message')
 router.register('notifications', NotificationViewSet, basename='notification')
 
-urlpatterns = router.urls
+urlpatterns = [
+    path('stream/', event_stream, name='event-stream'),
+    path('stream/ticket/', StreamTicketView.as_view(), name='event-stream-ticket'),
+] + router.urls
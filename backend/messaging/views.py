@@ -1,24 +1,37 @@
+import asyncio
 import logging
+from asgiref.sync import sync_to_async
 from django.db import transaction, models
 from django.db.models import Q, F, Case, When
-from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.http import JsonResponse, StreamingHttpResponse
 
 from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.exceptions import MethodNotAllowed, PermissionDenied
+from rest_framework.exceptions import (MethodNotAllowed, PermissionDenied,
+                                       AuthenticationFailed)
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 
-from .models import Message
+from core.asyncviews import AsyncReadMixin, afetch
+from core.compiled import CompiledListMixin
+from core.fieldsets import SparseFieldsetMixin
+
+from .models import Message, Conversation, MessageChange
 from .serializers import MessageSerializer, ConversationSerializer
 from .permissions import MessagePermission
+from .events import (OVERFLOW, TooManyConnections, format_event, get_broker,
+                     issue_ticket, publish, redeem_ticket, stream_setting)
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
-class MessageViewSet(ModelViewSet):
+class MessageViewSet(SparseFieldsetMixin, CompiledListMixin, ModelViewSet):
     """
     Handles user-to-user messaging:
     - List / retrieve / send messages
@@ -85,31 +98,8 @@ class MessageViewSet(ModelViewSet):
     @action(detail=False, methods=['get'])
     def conversations(self, request):
         """List all conversations for the current user (with latest message + unread count)."""
-        user = request.user
-
-        conversations_data = Message.objects.get_user_conversations(user)
-
-        # Bulk fetch users + messages to avoid N+1
-        participant_ids = [conv['other_user_id']
-                           for conv in conversations_data]
-        participants = User.objects.in_bulk(participant_ids)
-
-        latest_ids = [conv['latest_message_id'] for conv in conversations_data]
-        latest_messages = Message.objects.select_related(
-            'sender', 'receiver').in_bulk(latest_ids)
-
-        results = []
-        for conv in conversations_data:
-            participant = participants.get(conv['other_user_id'])
-            latest_message = latest_messages.get(conv['latest_message_id'])
-
-            if participant and latest_message:
-                results.append({
-                    'participant': participant,
-                    'latest_message': latest_message,
-                    'unread_count': conv['unread_count'],
-                    'last_activity': conv['last_activity']
-                })
+        results = [conversation_summary(conversation)
+                   for conversation in Conversation.objects.for_user(request.user)]
 
         serializer = ConversationSerializer(
             results, many=True, context={'request': request})
@@ -133,29 +123,88 @@ class MessageViewSet(ModelViewSet):
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        qs = Message.objects.get_conversation(request.user, other_user)
+        # Fetch last 20 (+1 to detect more), newest first → reverse to chronological
+        messages = list(self.history_queryset(other_user, before_id))
+        has_more = len(messages) > 20
+        messages = messages[:20][::-1]
+
+        serializer = self.get_serializer(messages, many=True)
+        return Response({
+            'results': serializer.data,
+            'has_more': has_more  # let frontend know if more messages exist
+        })
 
+    def history_queryset(self, other_user, before_id=None):
+        qs = Message.objects.get_conversation(self.request.user, other_user)
         if before_id:
             qs = qs.filter(id__lt=before_id)
+        return qs.order_by('-sent_at')[:21]
 
-        # Fetch last 20, newest first → reverse to chronological
-        messages = list(qs.order_by('-sent_at')[:20])[::-1]
-
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Changes since a sync token: new messages, ids newly read and ids
+        deleted, oldest first, in batches of ?limit= (default 100).
+        Without ?token= only the current token is returned. Pass ?user_id=
+        to sync a single conversation.
+        """
+        try:
+            token = request.query_params.get('token')
+            token = int(token) if token is not None else None
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 500)
+            other_user_id = request.query_params.get('user_id')
+            other_user_id = int(other_user_id) if other_user_id else None
+        except ValueError:
+            return Response({'error': 'token, limit and user_id must be integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        changes = MessageChange.objects.filter(user=request.user)
+        if other_user_id is not None:
+            changes = changes.filter(other_user_id=other_user_id)
+
+        if token is None:
+            latest = changes.order_by('-id').values_list('id', flat=True).first()
+            return Response({'messages': [], 'read': [], 'deleted': [],
+                             'sync_token': latest or 0, 'has_more': False})
+
+        batch = list(
+            changes.filter(id__gt=token).order_by('id')
+            .values_list('id', 'message_id', 'change_type')[:limit + 1]
+        )
+        has_more = len(batch) > limit
+        batch = batch[:limit]
+
+        new, read, deleted = {}, {}, {}
+        for change_id, message_id, change_type in batch:
+            if change_type == MessageChange.CHANGE_DELETED:
+                new.pop(message_id, None)
+                read.pop(message_id, None)
+                deleted[message_id] = True
+            elif message_id not in deleted:
+                target = new if change_type == MessageChange.CHANGE_NEW else read
+                target[message_id] = True
+
+        messages = self.get_queryset().filter(id__in=list(new)).order_by('sent_at', 'id')
         serializer = self.get_serializer(messages, many=True)
         return Response({
-            'results': serializer.data,
-            'has_more': qs.count() > 20  # let frontend know if more messages exist
+            'messages': serializer.data,
+            'read': list(read),
+            'deleted': list(deleted),
+            'sync_token': batch[-1][0] if batch else token,
+            'has_more': has_more,
         })
 
     @action(detail=False, methods=['get'])
     def unread_count(self, request):
         """Get total unread messages for the current user."""
-        count = Message.objects.filter(
-            receiver=request.user,
+        return Response({'unread_count': self.unread_queryset().count()})
+
+    def unread_queryset(self):
+        return Message.objects.filter(
+            receiver=self.request.user,
             is_read=False,
             is_deleted_by_receiver=False
-        ).count()
-        return Response({'unread_count': count})
+        )
 
     @action(detail=False, methods=['post'])
     def mark_conversation_as_read(self, request):
@@ -169,12 +218,13 @@ class MessageViewSet(ModelViewSet):
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        updated = Message.objects.filter(
-            sender=other_user,
-            receiver=request.user,
-            is_read=False,
-            is_deleted_by_receiver=False
-        ).update(is_read=True, read_at=timezone.now())
+        updated = Message.objects.mark_conversation_as_read(
+            request.user, other_user)
+
+        if updated:
+            event = {'reader_id': request.user.id, 'other_user_id': other_user.id}
+            publish(request.user.id, 'conversation_read', event)
+            publish(other_user.id, 'conversation_read', event)
 
         return Response({'status': f'{updated} messages marked as read'})
 
@@ -201,6 +251,13 @@ class MessageViewSet(ModelViewSet):
                 Q(sender_id=other_user_id, receiver=user)
             )
 
+            visible = conv_qs.filter(
+                Q(sender=user, is_deleted_by_sender=False) |
+                Q(receiver=user, is_deleted_by_receiver=False)
+            ).values_list('id', 'sender_id', 'receiver_id')
+            MessageChange.objects.record(
+                MessageChange.CHANGE_DELETED, list(visible), users={user.id})
+
             conv_qs.update(
                 is_deleted_by_sender=Case(
                     When(sender=user, then=True),
@@ -219,6 +276,8 @@ class MessageViewSet(ModelViewSet):
                 is_deleted_by_receiver=True
             ).delete()[0]
 
+            Conversation.objects.record_deleted(user, other_user_id)
+
             logger.info(
                 f"User {user.id} deleted conversation with user {other_user_id}. "
                 f"Permanently deleted {deleted_count} messages."
@@ -228,3 +287,135 @@ class MessageViewSet(ModelViewSet):
             {'status': f'Conversation deleted. {deleted_count} messages permanently removed.'},
             status=status.HTTP_200_OK
         )
+
+
+def conversation_summary(conversation):
+    return {
+        'participant': conversation.other_user,
+        'latest_message': conversation.last_message,
+        'unread_count': conversation.unread_count,
+        'last_activity': conversation.last_activity
+    }
+
+
+class AsyncMessageViewSet(AsyncReadMixin, MessageViewSet):
+    """MessageViewSet with its hottest reads served on the event loop under ASGI"""
+
+    async def aconversations(self, request):
+        results = [conversation_summary(conversation) async for conversation
+                   in Conversation.objects.for_user(request.user).aiterator()]
+
+        serializer = ConversationSerializer(
+            results, many=True, context={'request': request})
+        return Response(serializer.data)
+
+    async def aconversation(self, request):
+        other_user_id = request.query_params.get('user_id')
+        if not other_user_id:
+            return Response({'error': 'user_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            other_user = await User.objects.aget(id=other_user_id)
+        except User.DoesNotExist:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        messages = await afetch(
+            self.history_queryset(other_user, request.query_params.get('before')))
+        has_more = len(messages) > 20
+        messages = messages[:20][::-1]
+
+        serializer = self.get_serializer(messages, many=True)
+        return Response({
+            'results': serializer.data,
+            'has_more': has_more
+        })
+
+    async def aunread_count(self, request):
+        return Response({'unread_count': await self.unread_queryset().acount()})
+
+
+def _authenticate_stream(request):
+    """
+    Resolve the user from a single-use ticket in the `ticket` query
+    parameter, since EventSource cannot set headers, or from a Bearer header.
+    """
+    ticket = request.GET.get('ticket')
+    if ticket is not None:
+        user_id = redeem_ticket(ticket)
+        return User.objects.filter(pk=user_id).first() if user_id else None
+
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = header and authentication.get_raw_token(header)
+    if not raw_token:
+        return None
+    try:
+        validated = authentication.get_validated_token(raw_token)
+        return authentication.get_user(validated)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+class StreamTicketView(APIView):
+    """Issues a short-lived, single-use ticket for opening /messaging/stream/"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({
+            'ticket': issue_ticket(request.user.id),
+            'expires_in': stream_setting('TICKET_SECONDS'),
+        })
+
+
+async def event_stream(request):
+    """
+    Server-sent event stream of the current user's notifications, new
+    messages and read-state changes. Must be served through ASGI.
+    """
+    user = await sync_to_async(_authenticate_stream)(request)
+    if user is None or not user.is_active:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED)
+
+    broker = get_broker()
+    if broker.connections(user.id) >= stream_setting('MAX_CONNECTIONS_PER_USER'):
+        return JsonResponse(
+            {'detail': 'Too many open event streams.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+    heartbeat = stream_setting('HEARTBEAT_SECONDS')
+
+    async def events():
+        # Subscribed only once the server starts streaming, so a response
+        # that is never iterated holds no connection slot.
+        try:
+            subscription = broker.subscribe(user.id)
+        except TooManyConnections:
+            # Another stream took the last slot since the check above.
+            yield format_event(
+                {'type': 'error', 'data': {'detail': 'Too many open event streams.'}})
+            return
+
+        event_id = 0
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await subscription.get(timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': heartbeat\n\n'
+                    continue
+                if event is OVERFLOW:
+                    # The client fell behind; it should refetch and reconnect.
+                    yield format_event({'type': 'resync', 'data': {}})
+                    break
+                event_id += 1
+                yield format_event(event, event_id)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from core.renditions import thumbnail_url
 
 from .models import Service
 
@@ -18,7 +19,7 @@ class ServiceAdmin(admin.ModelAdmin):
             return format_html(
                 '<a href="{}" target="_blank"><img src="{}" style="width: 60px; height: 60px; object-fit: cover;" /></a>',
                 obj.image.url,
-                obj.image.url
+                thumbnail_url(obj.image, obj.image_renditions)
             )
         return 'No Image Available'
 
@@ -1,3 +1,21 @@
 from django.test import TestCase
+from django.utils import timezone
 
-# Create your tests here.
+from .models import Service
+
+
+class ServiceKeysetTests(TestCase):
+    def test_cursor_walks_services_by_update(self):
+        for i in range(7):
+            Service.objects.create(name=f'Walker {i}', service_type='walking', city='Leeds')
+        Service.objects.filter(name__in=['Walker 4', 'Walker 5']).update(
+            updated_at=timezone.now())
+        expected = list(Service.objects.order_by('-updated_at', '-id')
+                        .values_list('pk', flat=True))
+
+        url, seen = '/services/?pagination=cursor&page_size=3', []
+        while url:
+            response = self.client.get(url)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, expected)
@@ -5,18 +5,19 @@ from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework import status
-from django.contrib.auth import get_user_model
 
 
 from .models import Service
 from .serializers import ServiceSerializer
 from core.permissions import IsAdminOrReadOnly
-from core.pagination import DefaultPagination
-from core.models import Notification
-from core.utils import create_notification
+from core.pagination import HybridPagination
+from core.analytics import record_click
+from core.compiled import CompiledListMixin
+from core.fieldsets import SparseFieldsetMixin
+from core.routers import ReplicaReadMixin
 
 
-class ServiceViewSet(ModelViewSet):
+class ServiceViewSet(ReplicaReadMixin, SparseFieldsetMixin, CompiledListMixin, ModelViewSet):
     queryset = Service.objects.all()
     serializer_class = ServiceSerializer
     permission_classes = [IsAdminOrReadOnly]
@@ -26,24 +27,15 @@ class ServiceViewSet(ModelViewSet):
                      'city__icontains', 'description__contains']
     ordering_fields = ['id', 'name', 'service_type', 'city']
     lookup_field = 'slug'
-    pagination_class = DefaultPagination
+    pagination_class = HybridPagination
+    keyset_ordering = ('-updated_at', '-id')
 
     @action(detail=True, methods=['post'], url_path='click', permission_classes=[AllowAny])
     def register_click(self, request, slug=None):
         service = self.get_object()
         user = request.user if request.user.is_authenticated else None
 
-        if user and user.is_staff:
-            return Response({'status': 'Click registered'}, status=status.HTTP_200_OK)
+        if not (user and user.is_staff):
+            record_click(service)
 
-        staff_user = get_user_model().objects.filter(is_staff=True).first()
-        if not staff_user:
-            return Response({'status': 'Click registered'}, status=status.HTTP_200_OK)
-
-        create_notification(
-            recipient=staff_user,
-            notification_type=Notification.NOTIFICATION_TYPE_AFFILIATE_CLICKED,
-            message=f"{user.username if user else 'Anonymous'} clicked on service: {service.name}.",
-            content_object=service
-        )
         return Response({'status': 'Click registered'}, status=status.HTTP_200_OK)